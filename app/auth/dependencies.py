@@ -25,7 +25,8 @@ def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(securit
 
 
 def require_role(required_role: str):
-    def role_checker(request: Request):
+    # async: nessun I/O, così il controllo non occupa un thread del threadpool
+    async def role_checker(request: Request):
         session_data = request.session
 
         if not isinstance(session_data, dict):
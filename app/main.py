@@ -6,6 +6,7 @@ from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.requests import Request
 from fastapi.templating import Jinja2Templates
 from datetime import datetime
+from starlette.concurrency import run_in_threadpool
 from starlette.responses import JSONResponse as StarletteJSONResponse
 from sqlalchemy import text, inspect
 
@@ -14,7 +15,13 @@ from app.utils.loinc_loader import populate_loinc_codes
 from starlette.middleware.sessions import SessionMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.base import Base
-from app.services.database import engine
+from app.services.database import async_engine, engine
+from app.services.ingestion_jobs import start_job_workers, stop_job_workers
+from app.services.migrations import run_migrations
+from app.services.transform_pool import shutdown_transform_pool
+from app.utils.audit_sink import close_audit_sink
+from app.utils.http_metrics import MetricsMiddleware
+from app.utils.request_context import RequestContextMiddleware
 
 from app.routes import (
     patient,
@@ -30,6 +37,11 @@ from app.routes import (
     template,
     test,
     ingestion,
+    search,
+    export,
+    metrics,
+    audit,
+    jobs,
 )
 
 app = FastAPI(
@@ -52,6 +64,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Contesto della richiesta (route corrente) per le metriche del pool DB
+app.add_middleware(RequestContextMiddleware)
+# Metriche HTTP (latenza per route, richieste in corso, query SQL per richiesta), esposte su /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Static e templates
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
@@ -69,10 +86,16 @@ app.include_router(observation.router, prefix="/api")
 app.include_router(condition.router, prefix="/api")
 
 app.include_router(ingestion.router, prefix="/api")
+app.include_router(jobs.router, prefix="/api")
 app.include_router(DEL_loinc.router, prefix="/api")
 app.include_router(test_db.router, prefix="/api")
 app.include_router(dashboard_api.router, prefix="/api")
 app.include_router(test.router, prefix="/api/test")
+# export prima di search: /api/{Type}/$export non deve finire su /api/{Type}/{resource_id}
+app.include_router(export.router, prefix="/api")
+app.include_router(search.router, prefix="/api")
+app.include_router(audit.router, prefix="/api")
+app.include_router(metrics.router)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -138,5 +161,22 @@ def on_startup():
             conn.execute(text(
                 "CREATE INDEX IF NOT EXISTS gin_idx_fhir_resources_content ON fhir_resources USING GIN (content)"
             ))
+    # Colonne di ricerca generate e indici sulle tabelle già esistenti
+    run_migrations(engine)
     # Popola tabella LOINC (internally verifica se già popolata)
-    populate_loinc_codes()
\ No newline at end of file
+    populate_loinc_codes()
+    # Worker dei caricamenti asincroni (coda ingestion_jobs)
+    start_job_workers()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    # Chiamate bloccanti (join dei thread, scritture, pool di processi): fuori dall'event loop
+    # Ferma i worker dei caricamenti asincroni dopo il job in corso
+    await run_in_threadpool(stop_job_workers)
+    # Scrive gli AuditEvent ancora in coda
+    await run_in_threadpool(close_audit_sink)
+    # Termina i processi del pool di trasformazione
+    await run_in_threadpool(shutdown_transform_pool)
+    # Chiude le connessioni del pool async
+    await async_engine.dispose()
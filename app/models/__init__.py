@@ -1,2 +1,7 @@
 from .loinc import LOINCCodes
 from .fhir_resource import FhirResource
+from .search_index import SearchIndexEntry
+from .rollup import EpiRollup
+from .resource_count import ResourceCount
+from .audit_event import AuditEventRecord
+from .ingestion_job import IngestionJob
@@ -0,0 +1,26 @@
+from sqlalchemy import Column, DateTime, Index, Text
+from sqlalchemy.dialects.postgresql import JSONB
+from app.base import Base
+
+
+class AuditEventRecord(Base):
+    """
+    AuditEvent FHIR persistiti su Postgres (AUDIT_BACKEND=db), in una tabella partizionata per mese.
+    La chiave primaria include recorded perché contiene la chiave di partizione;
+    le partizioni mensili sono create al bisogno da app/services/audit_db.py.
+    """
+    __tablename__ = "audit_events"
+
+    id = Column(Text, primary_key=True)
+    recorded = Column(DateTime(timezone=True), primary_key=True)
+    code = Column(Text)
+    username = Column(Text)
+    entity_id = Column(Text)
+    content = Column(JSONB, nullable=False)
+
+    __table_args__ = (
+        Index("idx_audit_events_recorded", "recorded"),
+        Index("idx_audit_events_username_recorded", "username", "recorded"),
+        Index("idx_audit_events_entity_recorded", "entity_id", "recorded"),
+        {"postgresql_partition_by": "RANGE (recorded)"},
+    )
@@ -1,7 +1,35 @@
-from sqlalchemy import Column, Text
+from sqlalchemy import Column, Computed, Date, DateTime, Index, Text, func, text
 from sqlalchemy.dialects.postgresql import JSONB
 from app.base import Base
 
+# Chiavi di ricerca estratte dal JSONB come colonne generate (STORED) e indicizzate.
+# Le espressioni sono condivise con le migrazioni in app/services/migrations.py.
+SEARCH_COLUMNS = {
+    "fhir_id": "content ->> 'id'",
+    "identifier_value": "content -> 'identifier' -> 0 ->> 'value'",
+    "subject_identifier": "content -> 'subject' -> 'identifier' ->> 'value'",
+    "recorded_date": "content ->> 'recordedDate'",
+    "code_value": "content -> 'code' -> 'coding' -> 0 ->> 'code'",
+}
+
+
+def _natural_key(name: str, resource_type: str, *columns) -> Index:
+    return Index(name, *columns, unique=True, postgresql_where=text(f"resource_type = '{resource_type}'"))
+
+
+# Chiavi naturali per tipo (indici unici parziali): gli INSERT ... ON CONFLICT DO NOTHING
+# scartano i duplicati nella stessa istruzione, senza una SELECT preventiva e anche tra upload concorrenti.
+# Le Condition senza onset hanno chiave '' (come il confronto None == None del controllo precedente).
+NATURAL_KEY_INDEXES = (
+    _natural_key("uq_fhir_resources_patient_identifier", "Patient", "identifier_value"),
+    _natural_key("uq_fhir_resources_encounter_identifier", "Encounter", "identifier_value"),
+    _natural_key("uq_fhir_resources_observation_identifier", "Observation", "identifier_value"),
+    _natural_key(
+        "uq_fhir_resources_condition_key", "Condition",
+        "subject_identifier", "code_value", text("COALESCE(content ->> 'onsetDateTime', '')"),
+    ),
+)
+
 
 class FhirResource(Base):
     __tablename__ = "fhir_resources"
@@ -9,3 +37,29 @@ class FhirResource(Base):
     id = Column(Text, primary_key=True)
     resource_type = Column(Text, nullable=False, index=True)
     content = Column(JSONB, nullable=False)
+    # Istante dell'ultima scrittura, usato dai filtri incrementali (_since dell'export)
+    last_updated = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
+    # Chiave di partizione (mese di effectiveDateTime per le Observation, 1970-01-01 per il resto),
+    # valorizzata dall'applicazione: vedi app/services/partitioning.py
+    partition_date = Column(Date, nullable=False, server_default=text("'1970-01-01'"))
+
+    fhir_id = Column(Text, Computed(SEARCH_COLUMNS["fhir_id"], persisted=True))
+    identifier_value = Column(Text, Computed(SEARCH_COLUMNS["identifier_value"], persisted=True))
+    subject_identifier = Column(Text, Computed(SEARCH_COLUMNS["subject_identifier"], persisted=True))
+    # Date ISO-8601 come testo: l'ordinamento lessicografico coincide con quello cronologico
+    recorded_date = Column(Text, Computed(SEARCH_COLUMNS["recorded_date"], persisted=True))
+    code_value = Column(Text, Computed(SEARCH_COLUMNS["code_value"], persisted=True))
+
+    __table_args__ = (
+        Index("idx_fhir_resources_type_id", "resource_type", "id"),
+        Index("idx_fhir_resources_type_fhir_id", "resource_type", "fhir_id"),
+        Index("idx_fhir_resources_type_identifier", "resource_type", "identifier_value"),
+        Index("idx_fhir_resources_type_subject", "resource_type", "subject_identifier"),
+        Index("idx_fhir_resources_type_recorded", "resource_type", "recorded_date"),
+        Index("idx_fhir_resources_type_code", "resource_type", "code_value"),
+        Index("idx_fhir_resources_type_last_updated", "resource_type", "last_updated"),
+        *NATURAL_KEY_INDEXES,
+    )
+    # Identità ORM per tipo e id: con il layout partizionato (app/services/partitioning.py) la chiave primaria
+    # include resource_type, e UPDATE/DELETE delle righe caricate non devono toccare altri tipi con lo stesso id
+    __mapper_args__ = {"primary_key": [id, resource_type]}
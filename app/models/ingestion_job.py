@@ -0,0 +1,44 @@
+from sqlalchemy import BigInteger, Column, DateTime, Index, Integer, Text, func
+from sqlalchemy.dialects.postgresql import JSONB
+from app.base import Base
+
+
+class IngestionJob(Base):
+    """
+    Caricamento CSV/JSON accettato in modo asincrono (Prefer: respond-async) ed eseguito dai worker dell'app.
+    Stati: queued → running → done | failed; un job interrotto torna queued e riprende dall'ultimo checkpoint.
+    updated_at fa da heartbeat del worker che lo esegue.
+    """
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(Text, primary_key=True)
+    # csv | json
+    kind = Column(Text, nullable=False)
+    resource_type = Column(Text)
+    status = Column(Text, nullable=False, default="queued")
+    file_path = Column(Text, nullable=False)
+    filename = Column(Text)
+    username = Column(Text)
+    client_ip = Column(Text)
+    # SHA-256 del file: con il numero di riga determina l'id delle risorse create
+    file_hash = Column(Text)
+    total_bytes = Column(BigInteger, nullable=False, default=0)
+    bytes_processed = Column(BigInteger, nullable=False, default=0)
+    rows_processed = Column(BigInteger, nullable=False, default=0)
+    rows_inserted = Column(BigInteger, nullable=False, default=0)
+    rows_skipped = Column(BigInteger, nullable=False, default=0)
+    # Checkpoint scritto nella transazione di ogni blocco: posizione (byte) e numero della prossima riga da leggere
+    checkpoint_offset = Column(BigInteger, nullable=False, default=0)
+    checkpoint_row = Column(BigInteger, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    # Report parziale durante l'esecuzione, finale a job concluso
+    report = Column(JSONB)
+    error = Column(Text)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("idx_ingestion_jobs_status_created", "status", "created_at"),
+    )
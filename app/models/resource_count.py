@@ -0,0 +1,12 @@
+from sqlalchemy import BigInteger, Column, Text
+from app.base import Base
+
+
+class ResourceCount(Base):
+    """
+    Numero di risorse per tipo, aggiornato nella stessa transazione di ogni inserimento o eliminazione.
+    """
+    __tablename__ = "fhir_resource_counts"
+
+    resource_type = Column(Text, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
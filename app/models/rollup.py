@@ -0,0 +1,24 @@
+from sqlalchemy import BigInteger, Column, Index, Text
+from app.base import Base
+
+
+class EpiRollup(Base):
+    """
+    Conteggi giornalieri pre-aggregati per tipo di risorsa e dimensioni epidemiologiche.
+    Le dimensioni mancanti sono memorizzate come stringa vuota, così da poter far parte della chiave primaria.
+    """
+    __tablename__ = "epi_daily_rollup"
+
+    resource_type = Column(Text, primary_key=True)
+    # Giorno ISO (YYYY-MM-DD) dell'evento: recordedDate, period.start, effectiveDateTime; vuoto per i Patient
+    day = Column(Text, primary_key=True)
+    code = Column(Text, primary_key=True)
+    province = Column(Text, primary_key=True)
+    gender = Column(Text, primary_key=True)
+    age_band = Column(Text, primary_key=True)
+    count = Column(BigInteger, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("idx_epi_rollup_type_day", "resource_type", "day"),
+        Index("idx_epi_rollup_type_province", "resource_type", "province"),
+    )
@@ -0,0 +1,35 @@
+from sqlalchemy import BigInteger, Column, DateTime, Index, Numeric, Text
+from app.base import Base
+
+
+class SearchIndexEntry(Base):
+    """
+    Riga tipizzata dell'indice dei parametri di ricerca FHIR.
+    Ogni risorsa ha una riga per ciascun valore di ciascun parametro (token, date, quantity, reference, string).
+    Le righe delle risorse eliminate sono rimosse dai listener di app/services/search_index.py (nessuna FK:
+    non è possibile verso fhir_resources partizionata).
+    """
+    __tablename__ = "fhir_search_index"
+
+    id = Column(BigInteger, primary_key=True, autoincrement=True)
+    resource_id = Column(Text, nullable=False, index=True)
+    resource_type = Column(Text, nullable=False)
+    param = Column(Text, nullable=False)
+    kind = Column(Text, nullable=False)
+
+    # token: system|code — reference: code — string: code normalizzato (minuscolo), text originale
+    system = Column(Text)
+    code = Column(Text)
+    text = Column(Text)
+    # date: intervallo [date_start, date_end)
+    date_start = Column(DateTime(timezone=True))
+    date_end = Column(DateTime(timezone=True))
+    # quantity
+    number = Column(Numeric)
+    unit = Column(Text)
+
+    __table_args__ = (
+        Index("idx_search_code", "resource_type", "param", "code", postgresql_ops={"code": "text_pattern_ops"}),
+        Index("idx_search_date", "resource_type", "param", "date_start", "date_end"),
+        Index("idx_search_number", "resource_type", "param", "number"),
+    )
@@ -8,6 +8,11 @@ from . import (
     test_db,
     auth,
     dashboard_api,
-    template
+    template,
+    search,
+    export,
+    metrics,
+    audit,
+    jobs
 )
 
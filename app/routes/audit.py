@@ -0,0 +1,40 @@
+import heapq
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+
+from app.auth.dependencies import require_role
+from app.utils.audit_sink import AUDIT_BACKEND, AUDIT_LOG_PATH
+from app.utils.audit_store import search_audit
+
+router = APIRouter(tags=["Audit"])
+
+
+@router.get("/audit", summary="Ricerca negli AuditEvent (dal più recente)")
+def get_audit_events(
+    username: Optional[str] = Query(None, description="Utente che ha eseguito l'azione"),
+    entity_id: Optional[str] = Query(None, description="Identificativo dell'entità coinvolta"),
+    code: Optional[str] = Query(None, description="Codice DICOM dell'evento (es. 110110)"),
+    start: Optional[date] = Query(None, description="Dal giorno (incluso)"),
+    end: Optional[date] = Query(None, description="Al giorno (incluso)"),
+    _count: int = Query(100, ge=1, le=1000, description="Numero massimo di eventi"),
+    _: None = Depends(require_role("admin"))
+):
+    if start and end and start > end:
+        raise HTTPException(status_code=400, detail="start deve precedere end")
+    filters = dict(start=start, end=end, username=username, entity_id=entity_id, code=code, limit=_count)
+    # I segmenti locali contengono anche gli eventi scritti in fallback dal backend db
+    events = search_audit(legacy_path=AUDIT_LOG_PATH, **filters)
+    if AUDIT_BACKEND == "db":
+        from app.services.audit_db import search_audit_db
+        from app.services.database import engine
+        events = heapq.nlargest(
+            _count, events + search_audit_db(engine, **filters), key=lambda e: e.get("recorded", "")
+        )
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "total": len(events),
+        "entry": [{"resource": e} for e in events],
+    }
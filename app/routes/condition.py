@@ -1,12 +1,15 @@
-from typing import List
+from typing import List, Optional
 import logging
 
-from fastapi import APIRouter, Depends, HTTPException, Response, status, Request
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app.auth.dependencies import require_role
 from app.utils.audit import log_audit_event
-from app.services.database import get_db_session
+from app.services.database import clear_resources, get_async_db_session, get_db_session
+from app.services.pagination import DEFAULT_COUNT, MAX_COUNT, paginated_searchset
 from app.models.fhir_resource import FhirResource
 from app.schemas import ConditionCreate, ConditionRead
 
@@ -38,26 +41,16 @@ def create_condition(
     return ConditionRead(**new.content)
 
 
-@router.get("/", response_model=list[ConditionRead])
-def list_conditions(
+@router.get("/", summary="Elenco paginato (keyset) come Bundle searchset")
+async def list_conditions(
     request: Request,
-    db: Session = Depends(get_db_session),
+    _count: int = Query(DEFAULT_COUNT, ge=1, le=MAX_COUNT, description="Numero massimo di risorse per pagina"),
+    _cursor: Optional[str] = Query(None, description="Cursore opaco della pagina successiva (link next)"),
+    _elements: Optional[str] = Query(None, description="Elementi di primo livello da restituire, separati da virgola"),
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
-    rows = db.query(FhirResource).filter(FhirResource.resource_type == "Condition").all()
-    results = []
-    for row in rows:
-        try:
-            raw = row.content
-            data = raw.copy()
-            # flatten clinicalStatus code
-            data['clinicalStatus'] = raw.get('clinicalStatus', {}).get('coding', [{}])[0].get('code')
-            # flatten verificationStatus code
-            data['verificationStatus'] = raw.get('verificationStatus', {}).get('coding', [{}])[0].get('code')
-            results.append(ConditionRead(**data))
-        except Exception as e:
-            logger.warning(f"Condition malformata (id: {raw.get('id', 'N/A')}): {e}")
-            continue
+    bundle = await paginated_searchset(db, request, "Condition", [], _count, _cursor, _elements)
     log_audit_event(
         event_type="110101",
         username=request.session.get("username", "anon"),
@@ -66,22 +59,28 @@ def list_conditions(
         action="R",
         entity_type="Condition"
     )
-    return results
+    return bundle
 
 
 
 
 
 @router.get("/{identifier}", response_model=ConditionRead)
-def get_condition(
+async def get_condition(
     identifier: str,
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
-    row = db.query(FhirResource).filter(
-        FhirResource.resource_type == "Condition",
-        FhirResource.content["id"].astext == identifier
-    ).first()
+    row = (
+        await db.execute(
+            select(FhirResource)
+            .where(
+                FhirResource.resource_type == "Condition",
+                FhirResource.fhir_id == identifier
+            )
+            .limit(1)
+        )
+    ).scalar_one_or_none()
     if not row:
         raise HTTPException(status_code=404, detail="Condition not found")
     raw = row.content
@@ -101,7 +100,7 @@ def update_condition(
 ):
     row = db.query(FhirResource).filter(
         FhirResource.resource_type == "Condition",
-        FhirResource.content["id"].astext == identifier
+        FhirResource.fhir_id == identifier
     ).first()
     if not row:
         raise HTTPException(status_code=404, detail="Condition not found")
@@ -126,8 +125,7 @@ def clear_conditions(
     db: Session = Depends(get_db_session),
     _: None = Depends(require_role("admin"))
 ):
-    deleted = db.query(FhirResource).filter_by(resource_type="Condition")\
-                   .delete(synchronize_session=False)
+    deleted = clear_resources(db, "Condition")
     db.commit()
     log_audit_event(
         event_type="110207",
@@ -150,7 +148,7 @@ def delete_condition(
 ):
     row = db.query(FhirResource).filter(
         FhirResource.resource_type == "Condition",
-        FhirResource.content["id"].astext == identifier
+        FhirResource.fhir_id == identifier
     ).first()
     if not row:
         raise HTTPException(status_code=404, detail="Condition not found")
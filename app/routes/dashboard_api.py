@@ -1,15 +1,20 @@
-import datetime
 from fastapi import HTTPException, Query
-from sqlalchemy import cast, String
+from sqlalchemy import Date, Integer, String, and_, case, cast, or_
 from fastapi.responses import JSONResponse
 from app.models.dashboard import DailyIncidence
 
 from datetime import date, timedelta
 from fastapi import APIRouter, Depends
-from sqlalchemy import func
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from app.models.fhir_resource import FhirResource
+from app.models.rollup import EpiRollup
+from app.services.resource_counts import estimated_counts, exact_counts, resync_counts
+from app.services.response_cache import cached_response, invalidate_cache
+from app.services.rollups import rebuild_rollups
 from app.routes.condition import require_role, get_db_session
+from app.services.database import get_async_db_session
 from app.schemas.dashboard import PeriodComparison
 from pydantic import BaseModel
 
@@ -23,22 +28,43 @@ router = APIRouter(
 )
 
 
-def get_age_group(birth_str: str) -> str:
-    try:
-        birth = datetime.datetime.strptime(birth_str, "%Y-%m-%d").date()
-        today = datetime.date.today()
-        age = (today - birth).days // 365
-    except Exception:
-        return "Sconosciuta"
-
-    if age < 18:
-        return "0-17"
-    elif age < 40:
-        return "18-39"
-    elif age < 65:
-        return "40-64"
-    else:
-        return "65+"
+# birthDate nel formato YYYY-MM-DD: le altre forme finiscono in "Sconosciuta" senza errori di cast
+BIRTH_DATE_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+
+def _is_valid_date(value):
+    """
+    Verifica in SQL che una stringa YYYY-MM-DD sia una data esistente (es. esclude 1980-02-30, 1980-13-01).
+    Da valutare solo dopo il controllo di BIRTH_DATE_PATTERN: le sottostringhe sono già cifre.
+    """
+    year = cast(func.substr(value, 1, 4), Integer)
+    month = cast(func.substr(value, 6, 2), Integer)
+    day = cast(func.substr(value, 9, 2), Integer)
+    leap = or_(and_(year % 4 == 0, year % 100 != 0), year % 400 == 0)
+    month_days = case(
+        (month.in_((4, 6, 9, 11)), 30),
+        (month == 2, case((leap, 29), else_=28)),
+        else_=31,
+    )
+    return and_(year >= 1, month.between(1, 12), day >= 1, day <= month_days)
+
+
+def age_group_expr():
+    """
+    Fascia d'età del Patient calcolata in SQL con age(birthDate).
+    Le condizioni del CASE sono valutate in ordine: il cast a date avviene solo su date valide.
+    """
+    birth = FhirResource.content["birthDate"].astext
+    age = func.date_part("year", func.age(cast(birth, Date)))
+    return case(
+        (birth.is_(None), "Sconosciuta"),
+        (~birth.op("~")(BIRTH_DATE_PATTERN), "Sconosciuta"),
+        (~_is_valid_date(birth), "Sconosciuta"),
+        (age < 18, "0-17"),
+        (age < 40, "18-39"),
+        (age < 65, "40-64"),
+        else_="65+",
+    )
 
 
 def normalize_status(status: str) -> str:
@@ -56,14 +82,22 @@ def normalize_status(status: str) -> str:
 @router.get("/stats",
             tags=["Dashboard"],
             summary="Visualizza le statistiche generali")
-def get_stats_overview(db: Session = Depends(get_db_session)):
+@cached_response
+async def get_stats_overview(
+    mode: str = Query("exact", pattern="^(exact|estimated)$",
+                      description="exact: contatori mantenuti; estimated: statistiche del planner"),
+    db: AsyncSession = Depends(get_async_db_session)
+):
     """
     Restituisce il conteggio di pazienti, encounter e observation.
     """
-    patients = db.query(FhirResource).filter_by(resource_type="Patient").count()
-    encounters = db.query(FhirResource).filter_by(resource_type="Encounter").count()
-    observations = db.query(FhirResource).filter_by(resource_type="Observation").count()
-    conditions = db.query(FhirResource).filter_by(resource_type="Condition").count()
+    totals = await estimated_counts(db) if mode == "estimated" else None
+    if totals is None:
+        totals = await exact_counts(db)
+    patients = totals.get("Patient", 0)
+    encounters = totals.get("Encounter", 0)
+    observations = totals.get("Observation", 0)
+    conditions = totals.get("Condition", 0)
 
     return JSONResponse(content={
         "patients": patients,
@@ -73,44 +107,44 @@ def get_stats_overview(db: Session = Depends(get_db_session)):
     })
 
 
+# Campo aggregabile -> (tipo di risorsa, espressione SQL della chiave di raggruppamento)
+AGGREGATE_FIELDS = {
+    "gender": ("Patient", lambda: func.coalesce(FhirResource.content["gender"].astext, "Sconosciuto")),
+    "status": ("Encounter", lambda: func.coalesce(FhirResource.content["status"].astext, "Sconosciuto")),
+    "code": ("Observation", lambda: func.coalesce(func.nullif(FhirResource.code_value, ""), "Sconosciuto")),
+    "age_group": ("Patient", age_group_expr),
+}
+
+
 @router.get("/stats/aggregate/{field}",
 tags = ["Dashboard"],
 summary = "Aggregazione delle statistiche per campo: gender, status, code, age_group.")
-def aggregate_stats(field: str, db: Session = Depends(get_db_session)):
+@cached_response
+async def aggregate_stats(field: str, db: AsyncSession = Depends(get_async_db_session)):
     """
     Aggregate statistics by field: gender, status, code, age_group.
+    Il conteggio è un unico GROUP BY nel database: al client arriva solo la mappa chiave -> conteggio.
     """
-    result = {}
-
-    if field == "gender":
-        rows = db.query(FhirResource).filter_by(resource_type="Patient").all()
-        for row in rows:
-            key = row.content.get("gender", "Sconosciuto")
-            result[key] = result.get(key, 0) + 1
-
-    elif field == "status":
-        rows = db.query(FhirResource).filter_by(resource_type="Encounter").all()
-        for row in rows:
-            raw_status = row.content.get("status", "Sconosciuto")
-            key = normalize_status(raw_status)
-            result[key] = result.get(key, 0) + 1
-
-    elif field == "code":
-        rows = db.query(FhirResource).filter_by(resource_type="Observation").all()
-        for row in rows:
-            key = (row.content.get("code", {}).get("coding", [{}])[0].get("code") or "Sconosciuto")
-            result[key] = result.get(key, 0) + 1
-
-    elif field == "age_group":
-        rows = db.query(FhirResource).filter_by(resource_type="Patient").all()
-        for row in rows:
-            birth_str = row.content.get("birthDate")
-            group = get_age_group(birth_str)
-            result[group] = result.get(group, 0) + 1
-
-    else:
+    if field not in AGGREGATE_FIELDS:
         raise HTTPException(status_code=400, detail="Campo non supportato")
 
+    resource_type, key_expr = AGGREGATE_FIELDS[field]
+    key_expr = key_expr().label("key")
+    rows = (
+        await db.execute(
+            select(key_expr, func.count().label("value"))
+            .where(FhirResource.resource_type == resource_type)
+            .group_by("key")
+        )
+    ).all()
+
+    result = {}
+    for key, value in rows:
+        # Gli stati Encounter sono normalizzati dopo il raggruppamento (pochi valori distinti)
+        if field == "status":
+            key = normalize_status(key)
+        result[key] = result.get(key, 0) + value
+
     return JSONResponse(content=result)
 
 
@@ -122,8 +156,9 @@ def aggregate_stats(field: str, db: Session = Depends(get_db_session)):
     response_model=list[DailyIncidence],
     summary="Incidenza giornaliera delle Condition (zero-fill)",
 )
-def conditions_daily_incidence(
-    db: Session = Depends(get_db_session),
+@cached_response
+async def conditions_daily_incidence(
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer")),
     start: date | None = Query(None, description="Data inizio (YYYY-MM-DD)"),
     end:   date | None = Query(None, description="Data fine  (YYYY-MM-DD)"),
@@ -132,11 +167,18 @@ def conditions_daily_incidence(
     Serie storica: numero di nuove Condition per recordedDate,
     include anche giorni con valore 0 (zero-fill).
     """
-    # 1) Prendo min/max recordedDate
-    min_max = db.query(
-        func.min(FhirResource.content["recordedDate"].astext),
-        func.max(FhirResource.content["recordedDate"].astext),
-    ).filter(FhirResource.resource_type == "Condition").one()
+    # 1) Prendo min/max del giorno di recordedDate dagli aggregati
+    condition_days = (
+        EpiRollup.resource_type == "Condition",
+        EpiRollup.day != "",
+        EpiRollup.count > 0,
+    )
+    min_max = (await db.execute(
+        select(
+            func.min(EpiRollup.day),
+            func.max(EpiRollup.day),
+        ).where(*condition_days)
+    )).one()
     min_date_str, max_date_str = min_max
 
     # Se non ci sono Condition, restituisco lista vuota
@@ -165,16 +207,16 @@ def conditions_daily_incidence(
         d += timedelta(days=1)
 
     # 4) Query conteggi reali
-    raw_counts = db.query(
-        FhirResource.content["recordedDate"].astext.label("date"),
-        func.count().label("value"),
-    ).filter(
-        FhirResource.resource_type == "Condition",
-        FhirResource.content["recordedDate"].astext.between(
-            start_date.isoformat(), end_date.isoformat()
-        )
-    ).group_by("date").all()
-    counts = {row.date: row.value for row in raw_counts}
+    raw_counts = (await db.execute(
+        select(
+            EpiRollup.day.label("date"),
+            func.sum(EpiRollup.count).label("value"),
+        ).where(
+            *condition_days,
+            EpiRollup.day.between(start_date.isoformat(), end_date.isoformat())
+        ).group_by(EpiRollup.day)
+    )).all()
+    counts = {row.date: int(row.value) for row in raw_counts}
 
     # 5) Zero-fill e build result
     result: list[DailyIncidence] = []
@@ -189,31 +231,44 @@ def conditions_daily_incidence(
     "/patients/by-province",
     summary="Pazienti per provincia"
 )
-def patients_by_province(
-    db: Session = Depends(get_db_session),
+@cached_response
+async def patients_by_province(
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
     """
     Conteggia i Patient raggruppati per address[0].district (provincia).
     """
-    province_expr = (
-        FhirResource.content["address"][0]["district"]
-            .astext
-            .label("province")
+    q = await db.execute(
+        select(
+            EpiRollup.province.label("province"),
+            func.sum(EpiRollup.count).label("value")
+        )
+        .where(EpiRollup.resource_type == "Patient")
+        .group_by(EpiRollup.province)
+        .having(func.sum(EpiRollup.count) > 0)
+        .order_by(EpiRollup.province)
     )
 
-    q = (
-        db.query(
-            province_expr,
-            func.count().label("value")
+    # Provincia mancante: stringa vuota negli aggregati, null nella risposta (in fondo, come in ORDER BY)
+    rows = [{"province": r.province or None, "value": int(r.value)} for r in q]
+    return [r for r in rows if r["province"]] + [r for r in rows if not r["province"]]
+
+
+async def _conditions_between(db: AsyncSession, start: date, end: date) -> int:
+    """
+    Numero di Condition con recordedDate nel periodo, letto dagli aggregati giornalieri.
+    """
+    return int(
+        await db.scalar(
+            select(func.coalesce(func.sum(EpiRollup.count), 0))
+              .where(
+                EpiRollup.resource_type == "Condition",
+                EpiRollup.day.between(start.isoformat(), end.isoformat())
+              )
         )
-        .filter(FhirResource.resource_type == "Patient")
-        .group_by(province_expr)
-        .order_by(province_expr)
     )
 
-    return [{"province": r.province, "value": r.value} for r in q]
-
 
 @router.get("/conditions/incidence-period", response_model=list[PeriodComparison],
             tags = ["Dashboard"],
@@ -226,34 +281,39 @@ def patients_by_province(
     response_model=list[PeriodComparison],
     summary="Confronto incidenza tra due periodi",
 )
-def conditions_incidence_period(
+@cached_response
+async def conditions_incidence_period(
     start1: date = Query(..., description="Inizio periodo 1"),
     end1:   date = Query(..., description="Fine periodo 1"),
     start2: date = Query(..., description="Inizio periodo 2"),
     end2:   date = Query(..., description="Fine periodo 2"),
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
-    # Conta per il primo periodo
-    count1 = (
-        db.query(func.count())
-          .filter(
-            FhirResource.resource_type=="Condition",
-            FhirResource.content["recordedDate"].astext.between(start1.isoformat(), end1.isoformat())
-          )
-          .scalar() or 0
-    )
-    # Conta per il secondo periodo
-    count2 = (
-        db.query(func.count())
-          .filter(
-            FhirResource.resource_type=="Condition",
-            FhirResource.content["recordedDate"].astext.between(start2.isoformat(), end2.isoformat())
-          )
-          .scalar() or 0
-    )
+    count1 = await _conditions_between(db, start1, end1)
+    count2 = await _conditions_between(db, start2, end2)
     # Restituisco sempre una lista di due entry
     return [
       PeriodComparison(period="Periodo 1", value=count1),
       PeriodComparison(period="Periodo 2", value=count2),
-    ]
\ No newline at end of file
+    ]
+
+
+@router.post("/rollups/rebuild", summary="Ricalcola gli aggregati epidemiologici")
+def rebuild_rollup_tables(
+    db: Session = Depends(get_db_session),
+    _: None = Depends(require_role("admin"))
+):
+    rows = rebuild_rollups(db)
+    invalidate_cache()
+    return {"rollup_rows": rows}
+
+
+@router.post("/counters/resync", summary="Risincronizza i contatori per tipo di risorsa")
+def resync_resource_counters(
+    db: Session = Depends(get_db_session),
+    _: None = Depends(require_role("admin"))
+):
+    counts = resync_counts(db)
+    invalidate_cache()
+    return counts
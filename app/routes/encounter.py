@@ -1,21 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, status, Request
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app.auth.dependencies import require_role
 from app.models import FhirResource
 from app.utils.audit import log_audit_event
-from app.services.database import get_db_session
+from app.services.database import clear_resources, get_async_db_session, get_db_session
+from app.services.pagination import DEFAULT_COUNT, MAX_COUNT, paginated_searchset
 from app.models.fhir_resource import FhirResource
 from app.schemas.encounter import EncounterRead
 router = APIRouter(prefix="/encounters", tags=["Encounters"])
 
-@router.get("/", response_model=list[EncounterRead])
-def list_encounters(
+@router.get("/", summary="Elenco paginato (keyset) come Bundle searchset")
+async def list_encounters(
     request: Request,
-    db: Session = Depends(get_db_session),
+    _count: int = Query(DEFAULT_COUNT, ge=1, le=MAX_COUNT, description="Numero massimo di risorse per pagina"),
+    _cursor: Optional[str] = Query(None, description="Cursore opaco della pagina successiva (link next)"),
+    _elements: Optional[str] = Query(None, description="Elementi di primo livello da restituire, separati da virgola"),
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
-    rows: list[type[FhirResource]] = db.query(FhirResource).filter_by(resource_type="Encounter").all()
+    bundle = await paginated_searchset(db, request, "Encounter", [], _count, _cursor, _elements)
     log_audit_event(
         event_type="110101",
         username=request.session.get("username", "anon"),
@@ -24,34 +32,25 @@ def list_encounters(
         action="R",
         entity_type="Encounter"
     )
-    return [
-        EncounterRead(
-            id=row.content.get("id"),
-            resourceType=row.content.get("resourceType", "Encounter"),
-            status=row.content.get("status"),
-            class_fhir=row.content.get("class"),
-            subject=row.content.get("subject"),
-            period=row.content.get("period"),
-            identifier=row.content.get("identifier")
-        )
-        for row in rows
-    ]
+    return bundle
 
 
-def get_encounter(
+async def get_encounter(
     identifier: str,
     request: Request,
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
     row = (
-        db.query(FhirResource)
-          .filter(
-              FhirResource.resource_type == "Encounter",
-              FhirResource.content["id"].astext == identifier
-          )
-          .first()
-    )
+        await db.execute(
+            select(FhirResource)
+            .where(
+                FhirResource.resource_type == "Encounter",
+                FhirResource.fhir_id == identifier
+            )
+            .limit(1)
+        )
+    ).scalar_one_or_none()
     if not row:
         raise HTTPException(status_code=404, detail="Encounter not found")
     log_audit_event(
@@ -106,7 +105,7 @@ def update_encounter(
         db.query(FhirResource)
         .filter(
             FhirResource.resource_type == "Encounter",
-            FhirResource.content["id"].astext == identifier
+            FhirResource.fhir_id == identifier
         )
         .first()
     )
@@ -138,8 +137,7 @@ def clear_encounters(
     db: Session = Depends(get_db_session),
     _: None = Depends(require_role("admin"))
 ):
-    deleted = db.query(FhirResource).filter_by(resource_type="Encounter")\
-                   .delete(synchronize_session=False)
+    deleted = clear_resources(db, "Encounter")
     db.commit()
     log_audit_event(
         event_type="110107",
@@ -163,7 +161,7 @@ def delete_encounter(
         db.query(FhirResource)
           .filter(
               FhirResource.resource_type == "Encounter",
-              FhirResource.content["id"].astext == identifier
+              FhirResource.fhir_id == identifier
           )
           .first()
     )
@@ -0,0 +1,73 @@
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from app.auth.dependencies import require_role
+from app.services.bulk_export import EXPORT_TYPES, export_manifest, gzip_stream, iter_ndjson, parse_export_types
+from app.utils.audit import log_audit_event
+
+router = APIRouter(tags=["Bulk export"])
+
+
+def _audit_export(request: Request, entity_type: str) -> None:
+    log_audit_event(
+        event_type="110121",
+        username=request.session.get("username", "anon"),
+        success=True,
+        ip=request.client.host,
+        action="R",
+        entity_type=entity_type
+    )
+
+
+@router.get("/$export", summary="Manifest dell'export NDJSON (un file per tipo)")
+def export_all(
+    request: Request,
+    _type: Optional[str] = Query(None, description="Tipi da esportare, separati da virgola"),
+    _since: Optional[datetime] = Query(None, description="Solo risorse modificate dopo questo istante"),
+    _compress: bool = Query(False, description="File NDJSON compressi con gzip"),
+    _: None = Depends(require_role("admin"))
+):
+    try:
+        types = parse_export_types(_type)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _audit_export(request, "BulkExport")
+    return export_manifest(request, types, _since, _compress)
+
+
+def _make_type_export_endpoint(resource_type: str):
+    def export(
+        request: Request,
+        _since: Optional[datetime] = Query(None, description="Solo risorse modificate dopo questo istante"),
+        _compress: bool = Query(False, description="Comprime lo stream con gzip"),
+        _: None = Depends(require_role("admin"))
+    ):
+        _audit_export(request, resource_type)
+        body = iter_ndjson(resource_type, _since)
+        filename = f"{resource_type}.ndjson"
+        media_type = "application/fhir+ndjson"
+        if _compress:
+            body = gzip_stream(body)
+            filename += ".gz"
+            media_type = "application/gzip"
+        return StreamingResponse(
+            body,
+            media_type=media_type,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+        )
+
+    export.__name__ = f"export_{resource_type.lower()}"
+    export.__doc__ = f"Stream NDJSON di tutte le risorse {resource_type} (cursore lato server, memoria costante)."
+    return export
+
+
+for _type_name in EXPORT_TYPES:
+    router.add_api_route(
+        f"/{_type_name}/$export",
+        _make_type_export_endpoint(_type_name),
+        methods=["GET"],
+        summary=f"Export NDJSON {_type_name}",
+    )
@@ -1,9 +1,19 @@
 
-import csv, io, json
+import json
+import time
+from collections import Counter
+from typing import Optional
 
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
 from starlette import status
-from app.services.database import get_db_session, save_resource, save_encounter_if_valid
+from starlette.concurrency import run_in_threadpool
+from app.services.database import get_db_session
+from app.services.bulk_ingestion import ingest_csv_rows, record_ingestion
+from app.services.ingestion_jobs import SavedUpload, asave_upload, enqueue_job, job_status, save_upload
+from app.utils.streaming import open_csv_upload, aiter_upload_chunks
+from app.utils.json_stream import aiter_json_resources, JSON_READ_CHUNK
 from app.auth.dependencies import require_role
 from app.utils.audit import log_audit_event
 from app.utils.transform import *
@@ -11,220 +21,97 @@ from app.utils.transform import *
 router = APIRouter(tags=["Upload CSV/JSON"])
 logger = logging.getLogger(__name__)
 
+def wants_async(request: Request) -> bool:
+    """
+    Il client chiede l'elaborazione asincrona (pattern FHIR async: Prefer: respond-async).
+    """
+    return "respond-async" in request.headers.get("prefer", "").lower()
+
+
+def accepted_job(request: Request, db: Session, upload: SavedUpload, kind: str, resource_type: Optional[str],
+                 filename: Optional[str]) -> JSONResponse:
+    """
+    Registra il job e risponde 202 con l'URL di stato in Content-Location.
+    """
+    job = enqueue_job(
+        db, upload, kind, resource_type, filename,
+        username=request.session.get("username", "anon"),
+        client_ip=request.client.host,
+    )
+    status_url = str(request.url_for("get_job", job_id=job.id))
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=jsonable_encoder({**job_status(job), "status_url": status_url}),
+        headers={"Content-Location": status_url},
+    )
+
+
+def _upload_csv(request: Request, file: UploadFile, db: Session, resource_type: str, invalid_headers_msg: str):
+    with open_csv_upload(file) as reader:
+        if not validate_csv_headers(reader.fieldnames, resource_type):
+            raise HTTPException(status_code=400, detail=invalid_headers_msg)
+        if not wants_async(request):
+            return _ingest_csv(db, reader, resource_type)
+    upload = save_upload(file.file, ".csv")
+    return accepted_job(request, db, upload, "csv", resource_type, file.filename)
+
+
+def _ingest_csv(db: Session, reader, resource_type: str) -> dict:
+    start = time.perf_counter()
+    result = ingest_csv_rows(db, reader, resource_type)
+    record_ingestion(
+        "csv",
+        Counter({resource_type: result["inserted"]}),
+        Counter({resource_type: result["skipped"]}),
+        time.perf_counter() - start,
+    )
+    return result
+
 
 
 @router.post("/upload/patient/csv")
 def upload_patient_csv(
+    request: Request,
     file: UploadFile = File(...),
     db: Session = Depends(get_db_session),
     _: None = Depends(require_role("admin"))
 ):
-    raw = file.file.read().decode("utf-8")
-    reader = csv.DictReader(io.StringIO(raw))
-    if not validate_csv_headers(reader.fieldnames, "Patient"):
-        raise HTTPException(status_code=400, detail="Intestazioni CSV non valide per risorsa Patient.")
-
-    inserted, skipped, errors = 0, 0, []
-    for row in reader:
-        try:
-            fhir_data = csv_to_patient(row)
-            resource_id = fhir_data.get("id")
-            exists = db.query(FhirResource).filter(FhirResource.resource_type == "Patient", FhirResource.id == resource_id).first()
-            if exists:
-                logger.info(f"Duplicate Patient con id {resource_id}")
-                skipped += 1
-                continue
-            save_resource(db, "Patient", fhir_data)
-            inserted += 1
-        except Exception as e:
-            skipped += 1
-            logger.error(f"Errore: {e} - Riga: {row}")
-            errors.append(f"Errore: {e} - Riga: {row}")
-
-    return {"inserted": inserted, "skipped": skipped, "errors": errors}
+    return _upload_csv(request, file, db, "Patient", "Intestazioni CSV non valide per risorsa Patient.")
 
 
 @router.post("/upload/encounter/csv")
 def upload_encounter_csv(
+    request: Request,
     file: UploadFile = File(...),
     db: Session = Depends(get_db_session),
     _: None = Depends(require_role("admin"))
 ):
-    raw = file.file.read().decode("utf-8")
-    reader = csv.DictReader(io.StringIO(raw))
-
-    if not validate_csv_headers(reader.fieldnames, "Encounter"):
-        raise HTTPException(status_code=400, detail="Intestazioni CSV non valide per risorsa Encounter.")
-
-    inserted, skipped, errors = 0, 0, []
-
-    for row in reader:
-        try:
-            fhir_data = csv_to_encounter(row)
-
-            # Controllo esistenza Patient (identifier hashato)
-            patient_id = fhir_data.get("subject", {}).get("identifier", {}).get("value")
-            if not patient_id:
-                raise ValueError("CF hashato mancante nel campo subject.identifier")
-
-            patient_exists = db.query(FhirResource).filter(
-                FhirResource.resource_type == "Patient",
-                FhirResource.content["identifier"][0]["value"].astext == patient_id
-            ).first()
-
-            if not patient_exists:
-                msg = f"Encounter scartato: paziente {patient_id} non trovato."
-                logger.warning(msg)
-                errors.append(msg)
-                skipped += 1
-                continue
-
-            # Deduplicazione basata su identifier Encounter
-            encounter_id = fhir_data.get("identifier", [{}])[0].get("value")
-            if not encounter_id:
-                raise ValueError("Encounter identifier mancante")
-
-            exists = db.query(FhirResource).filter(
-                FhirResource.resource_type == "Encounter",
-                FhirResource.content["identifier"][0]["value"].astext == encounter_id
-            ).first()
-
-            if exists:
-                logger.info(f"Duplicate Encounter con identifier {encounter_id}")
-                skipped += 1
-                continue
-
-            # Salvataggio
-            save_resource(db, "Encounter", fhir_data)
-            inserted += 1
-
-        except Exception as e:
-            msg = f"Errore: {e} - Riga: {row}"
-            logger.error(msg)
-            errors.append(msg)
-            skipped += 1
-
-    return {
-        "inserted": inserted,
-        "skipped": skipped,
-        "errors": errors
-    }
+    # Verifica Patient (identifier hashato) e deduplicazione su identifier Encounter a blocchi
+    return _upload_csv(request, file, db, "Encounter", "Intestazioni CSV non valide per risorsa Encounter.")
 
 
 
 @router.post("/upload/observation/csv")
 def upload_observation_csv(
+    request: Request,
     file: UploadFile = File(...),
     db: Session = Depends(get_db_session),
     _: None = Depends(require_role("admin"))
 ):
-    raw = file.file.read().decode("utf-8")
-    reader = csv.DictReader(io.StringIO(raw))
-
-    if not validate_csv_headers(reader.fieldnames, "Observation"):
-        raise HTTPException(status_code=400, detail="Intestazioni CSV non valide per Observation")
-
-    inserted, skipped, errors = 0, 0, []
-
-    for row in reader:
-        try:
-            fhir_data = csv_to_observation(row)
-
-            # Controllo che il Patient esista
-            patient_id = fhir_data["subject"]["identifier"]["value"]
-            patient_exists = db.query(FhirResource).filter(
-                FhirResource.resource_type == "Patient",
-                FhirResource.content["identifier"][0]["value"].astext == patient_id
-            ).first()
-            if not patient_exists:
-                msg = f"Observation scartata: paziente {patient_id} non trovato."
-                logger.warning(msg)
-                errors.append(msg)
-                skipped += 1
-                continue
-
-            # Deduplicazione su identifier
-            obs_id = fhir_data.get("identifier", [{}])[0].get("value")
-            exists = db.query(FhirResource).filter(
-                FhirResource.resource_type == "Observation",
-                FhirResource.content["identifier"][0]["value"].astext == obs_id
-            ).first()
-            if exists:
-                logger.info(f"Observation duplicata con identifier {obs_id}")
-                skipped += 1
-                continue
-
-            save_resource(db, "Observation", fhir_data)
-            inserted += 1
-
-        except Exception as e:
-            msg = f"Errore nella creazione Observation: {e} - Riga: {row}"
-            logger.error(msg)
-            errors.append(msg)
-            skipped += 1
-
-    return {"inserted": inserted, "skipped": skipped, "errors": errors}
+    # Verifica Patient e deduplicazione su identifier a blocchi
+    return _upload_csv(request, file, db, "Observation", "Intestazioni CSV non valide per Observation")
 
 
 
 @router.post("/upload/condition/csv")
 def upload_condition_csv(
+    request: Request,
     file: UploadFile = File(...),
     db: Session = Depends(get_db_session),
     _: None = Depends(require_role("admin"))
 ):
-    raw = file.file.read().decode("utf-8")
-    reader = csv.DictReader(io.StringIO(raw))
-
-    if not validate_csv_headers(reader.fieldnames, "Condition"):
-        raise HTTPException(status_code=400, detail="Intestazioni CSV non valide per risorsa Condition.")
-
-    inserted, skipped, errors = 0, 0, []
-
-    for row in reader:
-        try:
-            fhir_data = csv_to_condition(row)
-
-            # Verifica se il Patient esiste nel DB
-            patient_id = fhir_data["subject"]["identifier"]["value"]
-            exists = db.query(FhirResource).filter(
-                FhirResource.resource_type == "Patient",
-                FhirResource.content["identifier"][0]["value"].astext == patient_id
-            ).first()
-
-            if not exists:
-                msg = f"Condition scartata: paziente {patient_id} non trovato."
-                logger.warning(msg)
-                errors.append(msg)
-                skipped += 1
-                continue
-
-            # Deduplicazione: evita condizioni duplicate con stesso codice e data
-            condition_code = fhir_data.get("code", {}).get("coding", [{}])[0].get("code")
-            condition_date = fhir_data.get("onsetDateTime")
-
-            duplicate = db.query(FhirResource).filter(
-                FhirResource.resource_type == "Condition",
-                FhirResource.content["code"]["coding"][0]["code"].astext == condition_code,
-                FhirResource.content["onsetDateTime"].astext == condition_date,
-                FhirResource.content["subject"]["identifier"]["value"].astext == patient_id
-            ).first()
-
-            if duplicate:
-                logger.info(f"Duplicate Condition per paziente {patient_id} con codice {condition_code} e data {condition_date}")
-                skipped += 1
-                continue
-
-            save_resource(db, "Condition", fhir_data)
-            inserted += 1
-
-        except Exception as e:
-            msg = f"Errore nella creazione della risorsa Condition: {e} - Riga: {row}"
-            logger.error(msg)
-            errors.append(msg)
-            skipped += 1
-
-    return {"inserted": inserted, "skipped": skipped, "errors": errors}
+    # Verifica Patient e deduplicazione su (paziente, codice, data) a blocchi
+    return _upload_csv(request, file, db, "Condition", "Intestazioni CSV non valide per risorsa Condition.")
 
 
 
@@ -237,33 +124,57 @@ def upload_condition_csv(
 )
 async def upload_json_bulk(
     request: Request,
-    file: UploadFile = File(..., description="File .json contenente risorse FHIR"),
+    file: UploadFile | None = File(None, description="File .json/.ndjson contenente risorse FHIR (array, Bundle o NDJSON)"),
     db: Session = Depends(get_db_session),
     _: None = Depends(require_role("admin"))
 ):
     """
-    Riceve un file .json (singolo oggetto o array), valida e persiste
-    le risorse FHIR miste, e restituisce un report di inseriti/scartati.
+    Riceve risorse FHIR miste come file multipart oppure come body in streaming
+    (application/json, application/fhir+json, application/x-ndjson, application/fhir+ndjson):
+    singolo oggetto, array, Bundle o NDJSON. Il parser incrementale produce una risorsa
+    alla volta, che viene validata e persistita a blocchi man mano che i dati arrivano.
+    Restituisce un report di inseriti/scartati; con `Prefer: respond-async` accoda un job e risponde 202.
     """
-    raw = await file.read()
+    if file is not None:
+        chunks = aiter_upload_chunks(file, JSON_READ_CHUNK)
+    elif request.headers.get("content-type", "").startswith("multipart/"):
+        raise HTTPException(status_code=400, detail="File mancante nel form multipart")
+    else:
+        chunks = request.stream()
+
+    if wants_async(request):
+        # Il file viene salvato e importato dai worker dei job: risposta 202 con l'URL di stato
+        if file is not None:
+            upload = await run_in_threadpool(save_upload, file.file, ".json")
+        else:
+            upload = await asave_upload(chunks, ".json")
+        filename = file.filename if file is not None else None
+        return await run_in_threadpool(accepted_job, request, db, upload, "json", None, filename)
+
+    report = new_json_summary()
+    started = time.perf_counter()
+    batch = []
     try:
-        payload = json.loads(raw)
-        resources = payload if isinstance(payload, list) else [payload]
-        # Debug: verifica risorse ricevute
-        logger.info(f"[JSON BULK] Ricevute {len(resources)} risorse JSON")
-        for r in resources:
-            logger.info(f"[JSON BULK] → risorsa id={r.get('id')} type={r.get('resourceType')}")
-
+        async for resource in aiter_json_resources(chunks):
+            batch.append(resource)
+            if len(batch) >= JSON_BATCH_SIZE:
+                await run_in_threadpool(process_json_batch, batch, db, report)
+                batch = []
+        if batch:
+            await run_in_threadpool(process_json_batch, batch, db, report)
     except json.JSONDecodeError as e:
-        raise HTTPException(status_code=400, detail=f"JSON non valido: {e.msg}")
-
-    # Debug: verifica risorse ricevute
-    logger.info(f"[JSON BULK] Ricevute {len(resources)} risorse JSON")
-    for r in resources:
-        logger.info(f"[JSON BULK] → risorsa id={r.get('id')} type={r.get('resourceType')}")
-
-    # Processo le risorse
-    report = process_json_resources(resources, db)
+        raise HTTPException(
+            status_code=400,
+            detail=f"JSON non valido: {e.msg} (risorse già elaborate: {report['total']})"
+        )
+
+    logger.info(f"[JSON BULK] Ricevute {report['total']} risorse JSON")
+    record_ingestion(
+        "json",
+        Counter(report["processed_by_type"]),
+        Counter(e["resourceType"] for e in report["errors"]),
+        time.perf_counter() - started,
+    )
 
     # Audit batch JSON
     log_audit_event(
@@ -276,8 +187,4 @@ async def upload_json_bulk(
     )
 
     # Risposta per il front-end
-    return {
-        "inserted": report["processed"],
-        "skipped": len(report["errors"]),
-        "errors": [f"[{e['resourceType']}/{e['id']}] {e['error']}" for e in report["errors"]]
-    }
+    return json_upload_response(report)
@@ -0,0 +1,47 @@
+import os
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import FileResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.auth.dependencies import require_role
+from app.models.ingestion_job import IngestionJob
+from app.services.database import get_async_db_session
+from app.services.ingestion_jobs import job_errors_path, job_status
+
+router = APIRouter(tags=["Upload CSV/JSON"])
+
+
+@router.get("/jobs/{job_id}", summary="Stato di un caricamento asincrono")
+async def get_job(
+    job_id: str,
+    db: AsyncSession = Depends(get_async_db_session),
+    _: None = Depends(require_role("admin"))
+):
+    """
+    Avanzamento (righe e byte elaborati, throughput, ETA) e, a job concluso, il report inserted/skipped/errors.
+    """
+    return job_status(await _get_job(db, job_id))
+
+
+@router.get("/jobs/{job_id}/errors", summary="Errori di un caricamento asincrono")
+async def get_job_errors(
+    job_id: str,
+    db: AsyncSession = Depends(get_async_db_session),
+    _: None = Depends(require_role("admin"))
+):
+    """
+    Elenco completo degli errori del job (una stringa JSON per riga); il report ne riporta solo i primi.
+    """
+    path = job_errors_path(await _get_job(db, job_id))
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Nessun errore registrato")
+    return FileResponse(path=path, filename=f"{job_id}.errors.ndjson", media_type="application/x-ndjson")
+
+
+async def _get_job(db: AsyncSession, job_id: str) -> IngestionJob:
+    job = (await db.execute(select(IngestionJob).where(IngestionJob.id == job_id))).scalar_one_or_none()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job non trovato")
+    return job
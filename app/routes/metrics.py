@@ -0,0 +1,30 @@
+import hmac
+import os
+
+from fastapi import APIRouter, Request
+from fastapi.responses import PlainTextResponse
+
+from app.auth.dependencies import require_role
+from app.utils.metrics import render_metrics
+
+router = APIRouter(tags=["Metrics"])
+
+# /metrics richiede "Authorization: Bearer <METRICS_TOKEN>" (scraper senza sessione) o una sessione admin;
+# l'accesso anonimo va abilitato esplicitamente con METRICS_PUBLIC=true
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").lower() in ("1", "true", "yes")
+
+_require_admin = require_role("admin")
+
+
+def _valid_token(request: Request) -> bool:
+    if not METRICS_TOKEN:
+        return False
+    return hmac.compare_digest(request.headers.get("authorization", ""), f"Bearer {METRICS_TOKEN}")
+
+
+@router.get("/metrics", response_class=PlainTextResponse, summary="Metriche in formato Prometheus")
+async def metrics_endpoint(request: Request):
+    if not METRICS_PUBLIC and not _valid_token(request):
+        await _require_admin(request)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
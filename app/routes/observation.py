@@ -1,21 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, status, Request
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app.auth.dependencies import require_role
 from app.utils.audit import log_audit_event
-from app.services.database import get_db_session
+from app.services.database import clear_resources, get_async_db_session, get_db_session
+from app.services.pagination import DEFAULT_COUNT, MAX_COUNT, paginated_searchset
+from app.services.partitioning import archive_observation_month
 from app.models.fhir_resource import FhirResource
 from app.schemas import ObservationCreate, ObservationRead
 
 router = APIRouter(prefix="/observations", tags=["Observations"])
 
-@router.get("/", response_model=list[ObservationRead])
-def list_observations(
+@router.get("/", summary="Elenco paginato (keyset) come Bundle searchset")
+async def list_observations(
     request: Request,
-    db: Session = Depends(get_db_session),
+    _count: int = Query(DEFAULT_COUNT, ge=1, le=MAX_COUNT, description="Numero massimo di risorse per pagina"),
+    _cursor: Optional[str] = Query(None, description="Cursore opaco della pagina successiva (link next)"),
+    _elements: Optional[str] = Query(None, description="Elementi di primo livello da restituire, separati da virgola"),
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
-    rows = db.query(FhirResource).filter_by(resource_type="Observation").all()
+    bundle = await paginated_searchset(db, request, "Observation", [], _count, _cursor, _elements)
     log_audit_event(
         event_type="110201",
         username=request.session.get("username", "anon"),
@@ -24,23 +34,25 @@ def list_observations(
         action="R",
         entity_type="Observation"
     )
-    return [ObservationRead(**row.content) for row in rows]
+    return bundle
 
 @router.get("/{identifier}", response_model=ObservationRead)
-def get_observation(
+async def get_observation(
     identifier: str,
     request: Request,
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
     row = (
-        db.query(FhirResource)
-          .filter(
-              FhirResource.resource_type == "Observation",
-              FhirResource.content["id"].astext == identifier
-          )
-          .first()
-    )
+        await db.execute(
+            select(FhirResource)
+            .where(
+                FhirResource.resource_type == "Observation",
+                FhirResource.fhir_id == identifier
+            )
+            .limit(1)
+        )
+    ).scalar_one_or_none()
     if not row:
         raise HTTPException(status_code=404, detail="Observation not found")
     log_audit_event(
@@ -88,7 +100,7 @@ def update_observation(
         db.query(FhirResource)
           .filter(
               FhirResource.resource_type == "Observation",
-              FhirResource.content["id"].astext == identifier
+              FhirResource.fhir_id == identifier
           )
           .first()
     )
@@ -114,8 +126,7 @@ def clear_observations(
     db: Session = Depends(get_db_session),
     _: None = Depends(require_role("admin"))
 ):
-    deleted = db.query(FhirResource).filter_by(resource_type="Observation")\
-                   .delete(synchronize_session=False)
+    deleted = clear_resources(db, "Observation")
     db.commit()
     log_audit_event(
         event_type="110207",
@@ -128,6 +139,36 @@ def clear_observations(
     )
     return {"deleted_count": deleted}
 
+@router.post("/archive/{month}", response_model=dict)
+def archive_observations(
+    month: str,
+    request: Request,
+    db: Session = Depends(get_db_session),
+    _: None = Depends(require_role("admin"))
+):
+    """
+    Archivia le Observation di un mese (YYYY-MM) staccandone la partizione (solo con FHIR_PARTITIONED).
+    """
+    try:
+        first_day = date.fromisoformat(f"{month}-01")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Mese non valido, formato atteso YYYY-MM")
+    try:
+        result = archive_observation_month(db, first_day)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    db.commit()
+    log_audit_event(
+        event_type="110207",
+        username=request.session.get("username", "anon"),
+        success=True,
+        ip=request.client.host,
+        action="D",
+        entity_type="Observation",
+        entity_id=f"ARCHIVE {month}"
+    )
+    return result
+
 @router.delete("/{identifier}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_observation(
     identifier: str,
@@ -139,7 +180,7 @@ def delete_observation(
         db.query(FhirResource)
           .filter(
               FhirResource.resource_type == "Observation",
-              FhirResource.content["id"].astext == identifier
+              FhirResource.fhir_id == identifier
           )
           .first()
     )
@@ -1,21 +1,29 @@
-from fastapi import APIRouter, Depends, HTTPException, Response, status, Request
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app.auth.dependencies import require_role
 from app.utils.audit import log_audit_event
-from app.services.database import get_db_session
+from app.services.database import clear_resources, get_async_db_session, get_db_session
+from app.services.pagination import DEFAULT_COUNT, MAX_COUNT, paginated_searchset
 from app.models.fhir_resource import FhirResource
 from app.schemas import PatientCreate, PatientRead
 
 router = APIRouter(prefix="/patients", tags=["Patients"])
 
-@router.get("/", response_model=list[PatientRead])
-def list_patients(
+@router.get("/", summary="Elenco paginato (keyset) come Bundle searchset")
+async def list_patients(
     request: Request,
-    db: Session = Depends(get_db_session),
+    _count: int = Query(DEFAULT_COUNT, ge=1, le=MAX_COUNT, description="Numero massimo di risorse per pagina"),
+    _cursor: Optional[str] = Query(None, description="Cursore opaco della pagina successiva (link next)"),
+    _elements: Optional[str] = Query(None, description="Elementi di primo livello da restituire, separati da virgola"),
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
-    rows = db.query(FhirResource).filter_by(resource_type="Patient").all()
+    bundle = await paginated_searchset(db, request, "Patient", [], _count, _cursor, _elements)
     log_audit_event(
         event_type="110001",
         username=request.session.get("username", "anon"),
@@ -24,23 +32,25 @@ def list_patients(
         action="R",
         entity_type="Patient"
     )
-    return [PatientRead(**row.content) for row in rows]
+    return bundle
 
 @router.get("/{identifier}", response_model=PatientRead)
-def get_patient(
+async def get_patient(
     identifier: str,
     request: Request,
-    db: Session = Depends(get_db_session),
+    db: AsyncSession = Depends(get_async_db_session),
     _: None = Depends(require_role("viewer"))
 ):
     row = (
-        db.query(FhirResource)
-          .filter(
-              FhirResource.resource_type == "Patient",
-              FhirResource.content["identifier"][0]["value"].astext == identifier
-          )
-          .first()
-    )
+        await db.execute(
+            select(FhirResource)
+            .where(
+                FhirResource.resource_type == "Patient",
+                FhirResource.identifier_value == identifier
+            )
+            .limit(1)
+        )
+    ).scalar_one_or_none()
     if not row:
         raise HTTPException(status_code=404, detail="Patient not found")
     log_audit_event(
@@ -88,7 +98,7 @@ def update_patient(
         db.query(FhirResource)
           .filter(
               FhirResource.resource_type == "Patient",
-              FhirResource.content["identifier"][0]["value"].astext == identifier
+              FhirResource.identifier_value == identifier
           )
           .first()
     )
@@ -119,7 +129,7 @@ def delete_patient(
         db.query(FhirResource)
           .filter(
               FhirResource.resource_type == "Patient",
-              FhirResource.content["identifier"][0]["value"].astext == identifier
+              FhirResource.identifier_value == identifier
           )
           .first()
     )
@@ -144,11 +154,7 @@ def clear_patients(
     db: Session = Depends(get_db_session),
     _: None = Depends(require_role("admin"))
 ):
-    deleted = (
-        db.query(FhirResource)
-          .filter_by(resource_type="Patient")
-          .delete(synchronize_session=False)
-    )
+    deleted = clear_resources(db, "Patient")
     db.commit()
     log_audit_event(
         event_type="110007",
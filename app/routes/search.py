@@ -0,0 +1,85 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.auth.dependencies import require_role
+from app.services.database import get_async_db_session, get_db_session
+from app.services.pagination import DEFAULT_COUNT, MAX_COUNT, paginated_searchset
+from app.services.search_index import SEARCH_PARAMETERS, SearchError, search_conditions, rebuild_search_index
+from app.models.fhir_resource import FhirResource
+
+router = APIRouter(tags=["Search"])
+
+# Parametri di controllo, non compilati come filtri
+CONTROL_PARAMS = {"_count", "_cursor", "_elements"}
+
+
+def _make_search_endpoint(resource_type: str):
+    async def search(
+        request: Request,
+        _count: int = Query(DEFAULT_COUNT, ge=1, le=MAX_COUNT, description="Numero massimo di risultati per pagina"),
+        _cursor: Optional[str] = Query(None, description="Cursore opaco della pagina successiva (link next)"),
+        _elements: Optional[str] = Query(None, description="Elementi di primo livello da restituire, separati da virgola"),
+        db: AsyncSession = Depends(get_async_db_session),
+        _: None = Depends(require_role("viewer"))
+    ):
+        params = [(k, v) for k, v in request.query_params.multi_items() if k not in CONTROL_PARAMS]
+        try:
+            conditions = search_conditions(resource_type, params)
+        except SearchError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return await paginated_searchset(db, request, resource_type, conditions, _count, _cursor, _elements)
+
+    search.__name__ = f"search_{resource_type.lower()}"
+    search.__doc__ = (
+        f"Ricerca FHIR su {resource_type}. Parametri supportati: "
+        + ", ".join(["_id", *SEARCH_PARAMETERS[resource_type]])
+        + ". Più parametri sono in AND, valori separati da virgola in OR; "
+          "date e quantità accettano i prefissi eq, ne, gt, lt, ge, le, sa, eb, ap."
+    )
+    return search
+
+
+def _make_read_endpoint(resource_type: str):
+    async def read(
+        resource_id: str,
+        db: AsyncSession = Depends(get_async_db_session),
+        _: None = Depends(require_role("viewer"))
+    ):
+        content = (await db.execute(
+            select(FhirResource.content)
+            .where(FhirResource.resource_type == resource_type, FhirResource.id == resource_id)
+        )).scalar_one_or_none()
+        if content is None:
+            raise HTTPException(status_code=404, detail=f"{resource_type} not found")
+        return content
+
+    read.__name__ = f"read_{resource_type.lower()}"
+    read.__doc__ = f"Lettura FHIR di un {resource_type} per id logico."
+    return read
+
+
+for _type in SEARCH_PARAMETERS:
+    router.add_api_route(
+        f"/{_type}",
+        _make_search_endpoint(_type),
+        methods=["GET"],
+        summary=f"Ricerca {_type}",
+    )
+    router.add_api_route(
+        f"/{_type}/{{resource_id}}",
+        _make_read_endpoint(_type),
+        methods=["GET"],
+        summary=f"Lettura {_type}",
+    )
+
+
+@router.post("/search-index/rebuild", summary="Ricostruisce l'indice dei parametri di ricerca")
+def rebuild_index(
+    db: Session = Depends(get_db_session),
+    _: None = Depends(require_role("admin"))
+):
+    return {"indexed_entries": rebuild_search_index(db)}
@@ -28,7 +28,7 @@ def test_duplicates(db: Session = Depends(get_db_session)):
     """
     Ritorna gli identifier duplicati tra i pazienti.
     """
-    identifier_expr = FhirResource.content["identifier"][0]["value"].astext
+    identifier_expr = FhirResource.identifier_value
     rows = (
         db.query(identifier_expr)
           .filter_by(resource_type="Patient")
@@ -52,7 +52,7 @@ def test_encounter_links(db: Session = Depends(get_db_session)):
           .all()
     )
     # Prendi tutti gli identifier dei pazienti
-    patient_expr = FhirResource.content["identifier"][0]["value"].astext
+    patient_expr = FhirResource.identifier_value
     patient_rows = (
         db.query(patient_expr)
           .filter_by(resource_type="Patient")
@@ -0,0 +1,132 @@
+"""
+Persistenza degli AuditEvent su Postgres (AUDIT_BACKEND=db).
+
+DatabaseAuditWriter è il writer dell'AuditSink: riceve i blocchi di eventi dal thread di scrittura
+e li inserisce con INSERT multi-riga, quindi le richieste non attendono mai il database.
+La tabella audit_events è partizionata per mese di recorded; la partizione del mese viene creata
+la prima volta che serve. Se il database non è raggiungibile il blocco viene scritto sui segmenti
+locali (fallback), così nessun evento va perso.
+"""
+import logging
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+
+from app.models.audit_event import AuditEventRecord
+from app.utils.audit_store import event_keys
+
+logger = logging.getLogger(__name__)
+
+
+def _parse_recorded(value: str) -> datetime:
+    try:
+        recorded = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return datetime.now(timezone.utc)
+    return recorded if recorded.tzinfo else recorded.replace(tzinfo=timezone.utc)
+
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, datetime.min.time(), timezone.utc)
+
+
+def _month(day: date) -> date:
+    return day.replace(day=1)
+
+
+def _next_month(month: date) -> date:
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{AuditEventRecord.__tablename__}_{month:%Y_%m}"
+
+
+def ensure_partition(conn: Connection, month: date) -> None:
+    """
+    Crea, se manca, la partizione mensile di audit_events che contiene `month`.
+    """
+    month = _month(month)
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {AuditEventRecord.__tablename__} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+    ))
+
+
+def audit_row(event: dict) -> dict:
+    recorded, username, entity_id, code = event_keys(event)
+    return {
+        "id": event["id"],
+        "recorded": _parse_recorded(recorded),
+        "code": code,
+        "username": username,
+        "entity_id": entity_id,
+        "content": event,
+    }
+
+
+class DatabaseAuditWriter:
+    """
+    Writer per AuditSink che inserisce i blocchi di eventi in audit_events.
+    """
+
+    def __init__(self, engine: Optional[Engine] = None, fallback=None):
+        if engine is None:
+            from app.services.database import engine
+        self.engine = engine
+        self.fallback = fallback
+        self._partitions: set[date] = set()
+
+    def _ensure_partitions(self, months: set) -> None:
+        for month in sorted(months - self._partitions):
+            try:
+                with self.engine.begin() as conn:
+                    ensure_partition(conn, month)
+            except DBAPIError as e:
+                # Due worker possono creare la stessa partizione nello stesso momento: vale se ora esiste
+                with self.engine.connect() as conn:
+                    exists = conn.execute(text("SELECT to_regclass(:name)"), {"name": partition_name(month)}).scalar()
+                if exists is None:
+                    raise e
+            self._partitions.add(month)
+
+    def write(self, events: list[dict]) -> None:
+        rows = [audit_row(e) for e in events]
+        try:
+            self._ensure_partitions({_month(r["recorded"].date()) for r in rows})
+            with self.engine.begin() as conn:
+                # executemany su un'unica INSERT: SQLAlchemy la invia come VALUES multi-riga
+                conn.execute(insert(AuditEventRecord).on_conflict_do_nothing(), rows)
+        except SQLAlchemyError as e:
+            if self.fallback is None:
+                raise
+            logger.error(f"[AUDIT] Database non disponibile, {len(events)} eventi scritti sui segmenti locali: {e}")
+            self.fallback.write(events)
+
+    def close(self) -> None:
+        if self.fallback is not None:
+            self.fallback.close()
+
+
+def search_audit_db(engine: Engine, start: Optional[date] = None, end: Optional[date] = None,
+                    username: Optional[str] = None, entity_id: Optional[str] = None, code: Optional[str] = None,
+                    limit: int = 100) -> list[dict]:
+    """
+    AuditEvent su database che soddisfano i filtri, dal più recente; il filtro su recorded
+    limita la lettura alle partizioni dei mesi richiesti.
+    """
+    query = select(AuditEventRecord.content).order_by(AuditEventRecord.recorded.desc()).limit(limit)
+    if start:
+        query = query.where(AuditEventRecord.recorded >= _day_start(start))
+    if end:
+        query = query.where(AuditEventRecord.recorded < _day_start(end + timedelta(days=1)))
+    for column, value in ((AuditEventRecord.username, username), (AuditEventRecord.entity_id, entity_id),
+                          (AuditEventRecord.code, code)):
+        if value is not None:
+            query = query.where(column == value)
+    with engine.connect() as conn:
+        return list(conn.execute(query).scalars())
@@ -0,0 +1,94 @@
+import json
+import os
+import zlib
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Optional
+
+from fastapi import Request
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app.models.fhir_resource import FhirResource
+from app.services.database import engine
+
+# Tipi esportabili con $export
+EXPORT_TYPES = ("Patient", "Encounter", "Observation", "Condition")
+
+# Righe lette dal cursore lato server per ogni fetch (e scritte nello stream per ogni chunk)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+EXPORT_GZIP_LEVEL = 6
+
+
+def parse_export_types(types: Optional[str]) -> list[str]:
+    """
+    Interpreta il parametro _type (tipi separati da virgola); senza parametro esporta tutti i tipi.
+    Solleva ValueError per tipi non supportati.
+    """
+    if not types:
+        return list(EXPORT_TYPES)
+    requested = list(dict.fromkeys(t.strip() for t in types.split(",") if t.strip()))
+    unknown = [t for t in requested if t not in EXPORT_TYPES]
+    if unknown:
+        raise ValueError(f"Tipi non supportati in _type: {', '.join(unknown)}")
+    return requested
+
+
+def iter_ndjson(resource_type: str, since: Optional[datetime] = None,
+                batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[bytes]:
+    """
+    Genera il contenuto NDJSON di un tipo di risorsa leggendo fhir_resources con un cursore
+    lato server (yield_per): in memoria resta al più un batch di righe alla volta.
+    La sessione è aperta qui e non dalla dependency, perché lo stream prosegue dopo la fine dell'handler.
+    """
+    stmt = (
+        select(FhirResource.content)
+        .where(FhirResource.resource_type == resource_type)
+        .order_by(FhirResource.id)
+        .execution_options(yield_per=batch_size)
+    )
+    if since is not None:
+        stmt = stmt.where(FhirResource.last_updated > since)
+
+    with Session(engine) as db:
+        for partition in db.execute(stmt).partitions():
+            yield b"".join(
+                json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                for (content,) in partition
+            )
+
+
+def gzip_stream(chunks: Iterable[bytes], level: int = EXPORT_GZIP_LEVEL) -> Iterator[bytes]:
+    """
+    Comprime incrementalmente uno stream di byte in formato gzip.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_manifest(request: Request, types: list[str], since: Optional[datetime], compress: bool) -> dict:
+    """
+    Manifest in stile FHIR Bulk Data: un file NDJSON per tipo, scaricabile da /api/{Type}/$export.
+    """
+    params = {}
+    if since is not None:
+        params["_since"] = since.isoformat()
+    if compress:
+        params["_compress"] = "true"
+    return {
+        "transactionTime": datetime.now(timezone.utc).isoformat(),
+        "request": str(request.url),
+        "requiresAccessToken": True,
+        "output": [
+            {
+                "type": resource_type,
+                "url": str(request.url.replace(path=f"/api/{resource_type}/$export", query="")
+                           .include_query_params(**params)),
+            }
+            for resource_type in types
+        ],
+        "error": [],
+    }
@@ -0,0 +1,277 @@
+import functools
+import logging
+import os
+from collections import Counter
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from app.models.fhir_resource import FhirResource
+from app.services.database import bulk_insert_resources
+from app.services.patient_index import PatientIndex
+from app.services.transform_pool import get_transform_pool, map_ordered
+from app.utils import metrics
+from app.utils.anonymization import get_pseudonymizer
+from app.utils.streaming import iter_chunks
+from app.utils.transform import (
+    csv_to_patient, csv_to_encounter, csv_to_observation, csv_to_condition, deterministic_resource_id
+)
+
+logger = logging.getLogger(__name__)
+
+# Numero di righe CSV trasformate, verificate e scritte per ogni transazione
+INGEST_CHUNK_SIZE = int(os.getenv("INGEST_CHUNK_SIZE", "1000"))
+
+INGESTED_ROWS = metrics.counter(
+    "ingestion_rows_total", "Righe/risorse elaborate in ingestion", ("resource_type", "source", "outcome")
+)
+INGESTION_THROUGHPUT = metrics.gauge(
+    "ingestion_rows_per_second", "Throughput dell'ultimo caricamento", ("resource_type", "source")
+)
+INGESTION_DURATION = metrics.histogram(
+    "ingestion_duration_seconds", "Durata dei caricamenti", ("source",),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+)
+
+
+def record_ingestion(source: str, accepted: Counter, rejected: Counter, elapsed: float) -> None:
+    """
+    Aggiorna le metriche di ingestion: righe accettate/rifiutate e righe al secondo per tipo.
+    """
+    INGESTION_DURATION.observe(elapsed, source=source)
+    for resource_type in set(accepted) | set(rejected):
+        INGESTED_ROWS.inc(accepted[resource_type], resource_type=resource_type, source=source, outcome="inserted")
+        INGESTED_ROWS.inc(rejected[resource_type], resource_type=resource_type, source=source, outcome="rejected")
+        rows = accepted[resource_type] + rejected[resource_type]
+        INGESTION_THROUGHPUT.set(rows / elapsed if elapsed > 0 else 0, resource_type=resource_type, source=source)
+
+
+class CsvIngestSpec(NamedTuple):
+    """
+    Descrive come trasformare e verificare le righe CSV di un tipo di risorsa.
+    I duplicati sono scartati dall'INSERT ... ON CONFLICT DO NOTHING (chiavi naturali in NATURAL_KEY_INDEXES).
+    """
+    transform: Callable[[dict], dict]
+    check_key: Callable[[dict], None]
+    patient_ref: Optional[Callable[[dict], str]]
+    missing_patient_msg: str
+    duplicate_msg: Callable[[dict], str]
+    error_prefix: str
+
+
+def find_existing_patients(db: Session, identifiers: set) -> set:
+    """
+    Ritorna il sottoinsieme degli identifier (CF hashati) già presenti come Patient.
+    """
+    identifiers = {i for i in identifiers if i}
+    if not identifiers:
+        return set()
+    expr = FhirResource.identifier_value
+    rows = (
+        db.query(expr)
+          .filter(FhirResource.resource_type == "Patient", expr.in_(identifiers))
+          .all()
+    )
+    return {r[0] for r in rows}
+
+
+def _first_identifier(data: dict):
+    return data.get("identifier", [{}])[0].get("value")
+
+
+def _subject_identifier(data: dict):
+    return data.get("subject", {}).get("identifier", {}).get("value")
+
+
+def _condition_key(data: dict) -> tuple:
+    return (
+        data.get("code", {}).get("coding", [{}])[0].get("code"),
+        data.get("onsetDateTime"),
+        data["subject"]["identifier"]["value"],
+    )
+
+
+def _encounter_patient_ref(data: dict) -> str:
+    patient_id = _subject_identifier(data)
+    if not patient_id:
+        raise ValueError("CF hashato mancante nel campo subject.identifier")
+    return patient_id
+
+
+def _encounter_check_key(data: dict) -> None:
+    if not _first_identifier(data):
+        raise ValueError("Encounter identifier mancante")
+
+
+def _no_check(data: dict) -> None:
+    return None
+
+
+CSV_INGEST_SPECS: dict[str, CsvIngestSpec] = {
+    "Patient": CsvIngestSpec(
+        transform=csv_to_patient,
+        check_key=_no_check,
+        patient_ref=None,
+        missing_patient_msg="",
+        duplicate_msg=lambda d: f"Duplicate Patient con identifier {_first_identifier(d)}",
+        error_prefix="Errore: ",
+    ),
+    "Encounter": CsvIngestSpec(
+        transform=csv_to_encounter,
+        check_key=_encounter_check_key,
+        patient_ref=_encounter_patient_ref,
+        missing_patient_msg="Encounter scartato: paziente {} non trovato.",
+        duplicate_msg=lambda d: f"Duplicate Encounter con identifier {_first_identifier(d)}",
+        error_prefix="Errore: ",
+    ),
+    "Observation": CsvIngestSpec(
+        transform=csv_to_observation,
+        check_key=_no_check,
+        patient_ref=lambda d: d["subject"]["identifier"]["value"],
+        missing_patient_msg="Observation scartata: paziente {} non trovato.",
+        duplicate_msg=lambda d: f"Observation duplicata con identifier {_first_identifier(d)}",
+        error_prefix="Errore nella creazione Observation: ",
+    ),
+    "Condition": CsvIngestSpec(
+        transform=csv_to_condition,
+        check_key=_no_check,
+        patient_ref=lambda d: d["subject"]["identifier"]["value"],
+        missing_patient_msg="Condition scartata: paziente {} non trovato.",
+        duplicate_msg=lambda d: (
+            "Duplicate Condition per paziente {2} con codice {0} e data {1}".format(*_condition_key(d))
+        ),
+        error_prefix="Errore nella creazione della risorsa Condition: ",
+    ),
+}
+
+
+def ingest_csv_rows(db: Session, rows: Iterable[dict], resource_type: str,
+                    chunk_size: int = INGEST_CHUNK_SIZE,
+                    on_chunk: Optional[Callable[[Session, dict], None]] = None,
+                    id_seed: Optional[str] = None, start_ordinal: int = 0,
+                    report: Optional[dict] = None, patient_index: Optional[PatientIndex] = None) -> dict:
+    """
+    Trasforma e persiste le righe CSV a blocchi di `chunk_size`, con un commit per blocco.
+    Per ogni blocco: una query per l'esistenza dei Patient, una per i duplicati
+    e un unico INSERT multi-riga. Ritorna il report { inserted, skipped, errors }.
+    Per i job ripresi da un checkpoint:
+      - `on_chunk(db, report)` è eseguito nella transazione del blocco, prima del commit;
+      - con `id_seed` (hash del file) l'id di ogni risorsa deriva da hash e numero di riga
+        (a partire da `start_ordinal`): ricaricare le stesse righe produce gli stessi id;
+      - `report` è il report parziale da cui proseguire;
+      - `patient_index` risolve in memoria l'esistenza dei Patient di riferimento
+        ed è aggiornato con i Patient inseriti dal job.
+    """
+    spec = CSV_INGEST_SPECS[resource_type]
+    if report is None:
+        report = {"inserted": 0, "skipped": 0, "errors": []}
+    ordinal = start_ordinal
+    for chunk in iter_chunks(rows, chunk_size):
+        ids = None
+        if id_seed is not None:
+            ids = [deterministic_resource_id(resource_type, id_seed, ordinal + i) for i in range(len(chunk))]
+        _ingest_chunk(db, resource_type, spec, chunk, report, ids, patient_index)
+        ordinal += len(chunk)
+        if on_chunk:
+            on_chunk(db, report)
+        db.commit()
+    return report
+
+
+def transform_row(transform: Callable[[dict], dict], row: dict) -> tuple[Optional[dict], Optional[Exception]]:
+    """
+    Applica la trasformazione a una riga; l'errore è ritornato come ValueError con lo stesso messaggio,
+    perché le eccezioni di validazione pydantic non tornano dai processi del pool.
+    """
+    try:
+        return transform(row), None
+    except Exception as e:
+        return None, ValueError(str(e))
+
+
+def _ingest_chunk(db: Session, resource_type: str, spec: CsvIngestSpec, chunk: list[dict], report: dict,
+                  ids: Optional[list[str]] = None, patient_index: Optional[PatientIndex] = None) -> None:
+    def reject(msg: str, level=logging.ERROR):
+        logger.log(level, msg)
+        report["errors"].append(msg)
+        report["skipped"] += 1
+
+    # 0) Pseudonimi dei CF distinti del blocco in un solo passaggio: le trasformazioni li trovano nella LRU
+    #    (con il pool ogni processo ha la propria LRU)
+    pseudonymizer = get_pseudonymizer()
+    if pseudonymizer.cache_size and get_transform_pool() is None:
+        pseudonymizer.pseudonymize_many(
+            (row.get("codice_fiscale") or "").strip() for row in chunk if row.get("codice_fiscale")
+        )
+
+    # 1) Trasformazione delle righe, eventualmente in parallelo (gli errori restano nell'ordine originale)
+    results = map_ordered(functools.partial(transform_row, spec.transform), chunk)
+    prepared = [(row, data, err) for row, (data, err) in zip(chunk, results)]
+    if ids is not None:
+        for (data, _), resource_id in zip(results, ids):
+            if data is not None:
+                data["id"] = resource_id
+
+    valid = [data for _, data, err in prepared if err is None]
+
+    # 2) Esistenza dei Patient di riferimento: in memoria con l'indice del job, altrimenti una query per blocco
+    existing_patients = set()
+    if spec.patient_ref:
+        refs = set()
+        for data in valid:
+            try:
+                refs.add(spec.patient_ref(data))
+            except Exception:
+                continue
+        if patient_index is not None:
+            existing_patients = patient_index.existing(db, refs)
+        else:
+            existing_patients = find_existing_patients(db, refs)
+
+    # 3) Verifiche riga per riga, con la stessa precedenza del caricamento riga-per-riga
+    survivors = []
+    for row, data, err in prepared:
+        try:
+            if err is not None:
+                raise err
+            if spec.patient_ref:
+                patient_id = spec.patient_ref(data)
+                if patient_id not in existing_patients:
+                    reject(spec.missing_patient_msg.format(patient_id), logging.WARNING)
+                    continue
+            spec.check_key(data)
+            survivors.append((row, data))
+        except Exception as e:
+            reject(f"{spec.error_prefix}{e} - Riga: {row}")
+
+    # 4) Scrittura del blocco con un solo INSERT multi-riga ... ON CONFLICT DO NOTHING RETURNING id:
+    #    le righe non restituite sono duplicati, nel database o nel blocco (il commit è in ingest_csv_rows)
+    if not survivors:
+        return
+    failed = set()
+    try:
+        inserted = bulk_insert_resources(db, resource_type, [data for _, data in survivors])
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.warning(f"INSERT multi-riga {resource_type} fallito ({e}), ripiego riga per riga")
+        inserted = set()
+        for i, (row, data) in enumerate(survivors):
+            try:
+                with db.begin_nested():
+                    inserted |= bulk_insert_resources(db, resource_type, [data])
+            except Exception as row_err:
+                reject(f"{spec.error_prefix}{row_err} - Riga: {row}")
+                failed.add(i)
+    for i, (row, data) in enumerate(survivors):
+        if i in failed:
+            continue
+        if data["id"] in inserted:
+            # Un id ripetuto nel blocco conta come inserito una sola volta
+            inserted.discard(data["id"])
+            report["inserted"] += 1
+            if patient_index is not None and resource_type == "Patient":
+                patient_index.add([_first_identifier(data)])
+        else:
+            logger.info(spec.duplicate_msg(data))
+            report["skipped"] += 1
@@ -1,11 +1,27 @@
 import os
+from typing import Optional
 
 from fhir.resources.encounter import Encounter
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, exists, func, literal, select, text
+from sqlalchemy.dialects.postgresql import JSONB, insert
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, scoped_session, Session
 
 from app.models.fhir_resource import FhirResource
+from app.models.resource_count import ResourceCount
+from app.services.db_pool import (
+    InstrumentedAsyncQueuePool,
+    InstrumentedQueuePool,
+    instrument_engine,
+    pool_options,
+    statement_timeout_args,
+)
+from app.services.partitioning import (
+    claim_observation_keys, ensure_rows_partitions, is_partitioned, release_observation_keys, resource_partition,
+)
+from app.services.query_metrics import instrument_queries
+from app.services.resource_events import ResourceRow, notify_written, notify_cleared
 
 # Configurazione da variabili d'ambiente
 DB_USER = os.getenv("POSTGRES_USER", "postgres")
@@ -16,9 +32,27 @@ DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
-engine = create_engine(DATABASE_URL)
+engine = create_engine(
+    DATABASE_URL,
+    **pool_options(InstrumentedQueuePool),
+    connect_args=statement_timeout_args("psycopg2"),
+)
+instrument_engine(engine, "sync")
+instrument_queries(engine, "sync")
 SessionLocal = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
 
+# Engine async (asyncpg) per le route di sola lettura: non occupano il threadpool di Starlette
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    **pool_options(InstrumentedAsyncQueuePool),
+    connect_args=statement_timeout_args("asyncpg"),
+)
+instrument_engine(async_engine.sync_engine, "async")
+instrument_queries(async_engine.sync_engine, "async")
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
 
 def get_db_session():
     """
@@ -31,6 +65,14 @@ def get_db_session():
         db.close()
 
 
+async def get_async_db_session():
+    """
+    Dependency-injection di FastAPI per ottenere la sessione DB async.
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def reset_database():
     """
     Cancella tutte le risorse FHIR nella tabella fhir_resources.
@@ -38,7 +80,7 @@ def reset_database():
     db = SessionLocal()
     try:
         print("Inizio reset database...")
-        db.query(FhirResource).delete()
+        clear_resources(db)
         db.commit()
         print("Database resettato correttamente.")
     except SQLAlchemyError as e:
@@ -49,23 +91,70 @@ def reset_database():
         db.close()
 
 
+def clear_resources(db: Session, resource_type: Optional[str] = None) -> int:
+    """
+    Elimina tutte le risorse di un tipo (None = tutte) e ne notifica lo svuotamento; ritorna quante erano.
+    Con fhir_resources partizionata è un TRUNCATE della partizione del tipo: nessuna scansione
+    né tuple morte da ripulire, e il numero di righe viene dai contatori per tipo.
+    Il commit è a carico del chiamante.
+    """
+    partition = resource_partition(resource_type)
+    if partition is not None and is_partitioned(db.connection()):
+        counted = select(func.coalesce(func.sum(ResourceCount.count), 0))
+        if resource_type is not None:
+            counted = counted.where(ResourceCount.resource_type == resource_type)
+        deleted = int(db.execute(counted).scalar())
+        db.execute(text(f"TRUNCATE {partition}"))
+    else:
+        query = db.query(FhirResource)
+        if resource_type is not None:
+            query = query.filter(FhirResource.resource_type == resource_type)
+        deleted = query.delete(synchronize_session=False)
+    notify_cleared(db, resource_type)
+    return deleted
+
+
+def _patient_exists(column, value):
+    return exists().where(FhirResource.resource_type == "Patient", column == value)
+
+
+def insert_if_absent(db: Session, resource_type: str, data: dict, condition=None) -> bool:
+    """
+    Inserisce una risorsa con un'unica istruzione INSERT ... ON CONFLICT DO NOTHING RETURNING:
+    nessuna riga se esiste già una risorsa con lo stesso id o la stessa chiave naturale
+    (o se `condition`, es. l'esistenza del Patient, è falsa). Ritorna True se inserita.
+    Il commit è a carico del chiamante.
+    """
+    row = ResourceRow(data.get("id"), resource_type, data)
+    partition_date = ensure_rows_partitions(db.connection(), [row])[0]
+    claimed = claim_observation_keys(db.connection(), [row], [partition_date])
+    if claimed is not None and resource_type == "Observation" and row.id not in claimed:
+        return False
+    values = select(literal(row.id), literal(resource_type), literal(data, JSONB), literal(partition_date))
+    if condition is not None:
+        values = values.where(condition)
+    inserted = db.execute(
+        insert(FhirResource)
+        .from_select(["id", "resource_type", "content", "partition_date"], values)
+        .on_conflict_do_nothing()
+        .returning(FhirResource.id)
+    ).first()
+    if inserted is None:
+        if claimed:
+            release_observation_keys(db.connection(), claimed)
+        return False
+    notify_written(db, [ResourceRow(inserted[0], resource_type, data)])
+    return True
+
+
 def load_or_deduplicate_patient(db: Session, fhir_data: dict) -> tuple[bool, dict]:
     """
     Inserisce un Patient se non esiste, altrimenti bypass.
     Ritorna (True, data) se inserito, (False, data) se già presente.
     """
-    identifier = fhir_data.get("identifier", [{}])[0].get("value")
-    existing = (
-        db.query(FhirResource)
-          .filter_by(resource_type="Patient")
-          .filter(FhirResource.content["identifier"][0]["value"].astext == identifier)
-          .first()
-    )
-    if existing:
-        return False, fhir_data
-    db.add(FhirResource(id=fhir_data.get("id"), resource_type="Patient", content=fhir_data))
+    inserted = insert_if_absent(db, "Patient", fhir_data)
     db.commit()
-    return True, fhir_data
+    return inserted, fhir_data
 
 
 def save_encounter_if_valid(db: Session, fhir_data: Encounter | dict) -> bool:
@@ -87,25 +176,13 @@ def save_encounter_if_valid(db: Session, fhir_data: Encounter | dict) -> bool:
     else:
         raise ValueError("Nessun campo 'reference' o 'identifier' in subject")
 
-    # Controllo esistenza Patient
-    if not (
-        db.query(FhirResource)
-          .filter_by(resource_type="Patient")
-          .filter(FhirResource.content["id"].astext == patient_id)
-          .first()
-    ):
-        raise ValueError(f"Patient {patient_id} non trovato nel database")
-
-    identifier = fhir_dict.get("identifier", [{}])[0].get("value")
-    if (
-        db.query(FhirResource)
-          .filter_by(resource_type="Encounter")
-          .filter(FhirResource.content["identifier"][0]["value"].astext == identifier)
-          .first()
-    ):
+    patient_exists = _patient_exists(FhirResource.fhir_id, patient_id)
+    if not insert_if_absent(db, "Encounter", fhir_dict, patient_exists):
+        # Solo in caso di rifiuto si distingue il motivo
+        if not db.query(patient_exists).scalar():
+            raise ValueError(f"Patient {patient_id} non trovato nel database")
+        identifier = fhir_dict.get("identifier", [{}])[0].get("value")
         raise ValueError(f"Encounter {identifier} già presente nel database")
-
-    db.add(FhirResource(id=fhir_dict.get("id"), resource_type="Encounter", content=fhir_dict))
     db.commit()
     return True
 
@@ -116,27 +193,11 @@ def save_observation_if_valid(db: Session, fhir_data: dict) -> bool:
     Ritorna False se duplicato o Patient mancante.
     """
     codice_fiscale = fhir_data.get("subject", {}).get("identifier", {}).get("value")
-    # Controllo esistenza Patient
-    if not (
-        db.query(FhirResource)
-          .filter_by(resource_type="Patient")
-          .filter(FhirResource.content["identifier"][0]["value"].astext == codice_fiscale)
-          .first()
-    ):
-        return False
-
-    identifier = fhir_data.get("identifier", [{}])[0].get("value")
-    if (
-        db.query(FhirResource)
-          .filter_by(resource_type="Observation")
-          .filter(FhirResource.content["identifier"][0]["value"].astext == identifier)
-          .first()
-    ):
-        return False
-
-    db.add(FhirResource(id=fhir_data.get("id"), resource_type="Observation", content=fhir_data))
+    inserted = insert_if_absent(
+        db, "Observation", fhir_data, _patient_exists(FhirResource.identifier_value, codice_fiscale)
+    )
     db.commit()
-    return True
+    return inserted
 
 
 def save_resource(db: Session, resource_type: str, data: dict) -> FhirResource:
@@ -146,4 +207,61 @@ def save_resource(db: Session, resource_type: str, data: dict) -> FhirResource:
     res = FhirResource(id=data["id"], resource_type=resource_type, content=data)
     db.add(res)
     db.commit()
-    return res
\ No newline at end of file
+    return res
+
+
+def insert_resources(db: Session, rows: list[ResourceRow]) -> set[tuple[str, str]]:
+    """
+    Inserisce risorse FHIR (anche di tipi diversi) con un unico INSERT multi-riga ... ON CONFLICT DO NOTHING.
+    Le righe in conflitto su id o chiave naturale (NATURAL_KEY_INDEXES) sono ignorate: ritorna le coppie
+    (resource_type, id) effettivamente inserite (con il layout partizionato l'id è unico solo nel tipo).
+    Il commit è a carico del chiamante.
+    """
+    if not rows:
+        return set()
+    partition_dates = ensure_rows_partitions(db.connection(), rows)
+    candidates = list(zip(rows, partition_dates))
+    claimed = claim_observation_keys(db.connection(), rows, partition_dates)
+    if claimed is not None:
+        # Layout partizionato: solo le Observation di cui è stata riservata la chiave, una volta per id
+        pending, candidates = set(claimed), []
+        for r, d in zip(rows, partition_dates):
+            if r.resource_type == "Observation":
+                if r.id not in pending:
+                    continue
+                pending.discard(r.id)
+            candidates.append((r, d))
+        if not candidates:
+            return set()
+    inserted = set(db.execute(
+        insert(FhirResource)
+        .values([
+            {"id": r.id, "resource_type": r.resource_type, "content": r.content, "partition_date": d}
+            for r, d in candidates
+        ])
+        .on_conflict_do_nothing()
+        .returning(FhirResource.resource_type, FhirResource.id)
+    ).tuples())
+    if claimed:
+        release_observation_keys(db.connection(), claimed - {i for t, i in inserted if t == "Observation"})
+    # Lo stesso id ripetuto nel blocco è inserito una sola volta (la prima)
+    written, notified = [], set()
+    for r in rows:
+        key = (r.resource_type, r.id)
+        if key in inserted and key not in notified:
+            notified.add(key)
+            written.append(r)
+    notify_written(db, written)
+    return inserted
+
+
+def bulk_insert_resources(db: Session, resource_type: str, items: list[dict]) -> set[str]:
+    """
+    Variante di insert_resources per risorse dello stesso tipo: ritorna gli id inseriti.
+    """
+    inserted = insert_resources(db, [ResourceRow(data["id"], resource_type, data) for data in items])
+    return {resource_id for _, resource_id in inserted}
+
+
+# Registrazione dei listener sulle scritture delle risorse
+from app.services import resource_counts, response_cache, rollups, search_index  # noqa: E402,F401
@@ -0,0 +1,114 @@
+"""
+Configurazione e strumentazione del pool di connessioni.
+
+Parametri da variabili d'ambiente (valgono per l'engine sync e per quello async):
+  DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (s), DB_POOL_RECYCLE (s),
+  DB_POOL_PRE_PING (true/false), DB_STATEMENT_TIMEOUT_MS (0 = nessun limite).
+Metriche: attesa al checkout e durata del possesso per route chiamante, connessioni in uso / libere,
+timeout del pool.
+"""
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from app.utils import metrics
+from app.utils.request_context import current_route
+
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+
+CHECKOUT_WAIT = metrics.histogram(
+    "db_pool_checkout_wait_seconds", "Attesa per ottenere una connessione dal pool", ("pool", "route")
+)
+HOLD_TIME = metrics.histogram(
+    "db_pool_connection_hold_seconds", "Durata del possesso di una connessione", ("pool", "route")
+)
+CHECKOUT_TIMEOUTS = metrics.counter(
+    "db_pool_checkout_timeouts_total", "Checkout falliti per pool esaurito (QueuePool limit)", ("pool", "route")
+)
+IN_USE = metrics.gauge("db_pool_connections_in_use", "Connessioni assegnate a una richiesta", ("pool",))
+IDLE = metrics.gauge("db_pool_connections_idle", "Connessioni aperte e libere nel pool", ("pool",))
+OVERFLOW = metrics.gauge("db_pool_overflow", "Connessioni oltre pool_size (negativo: posti ancora liberi)", ("pool",))
+
+
+class _InstrumentedPoolMixin:
+    """
+    Misura il tempo di attesa in _do_get, dove il pool si blocca quando è esaurito.
+    """
+    metrics_name = "sync"
+
+    def _do_get(self):
+        route = current_route()
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            CHECKOUT_TIMEOUTS.inc(pool=self.metrics_name, route=route)
+            raise
+        finally:
+            CHECKOUT_WAIT.observe(time.perf_counter() - start, pool=self.metrics_name, route=route)
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    metrics_name = "sync"
+
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    metrics_name = "async"
+
+
+def pool_options(poolclass) -> dict:
+    """
+    Argomenti di create_engine / create_async_engine per il pool configurato.
+    """
+    return {
+        "poolclass": poolclass,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING,
+    }
+
+
+def statement_timeout_args(driver: str) -> dict:
+    """
+    connect_args che impostano statement_timeout per sessione (psycopg2: options; asyncpg: server_settings).
+    """
+    if STATEMENT_TIMEOUT_MS <= 0:
+        return {}
+    if driver == "asyncpg":
+        return {"server_settings": {"statement_timeout": str(STATEMENT_TIMEOUT_MS)}}
+    return {"options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"}
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """
+    Registra gli eventi di checkout/checkin per la durata del possesso e le gauge del pool.
+    """
+    pool = engine.pool
+
+    @event.listens_for(pool, "checkout")
+    def _on_checkout(dbapi_conn, record, proxy):
+        record.info["checkout_at"] = time.perf_counter()
+        record.info["checkout_route"] = current_route()
+
+    @event.listens_for(pool, "checkin")
+    def _on_checkin(dbapi_conn, record):
+        start = record.info.pop("checkout_at", None)
+        if start is not None:
+            HOLD_TIME.observe(
+                time.perf_counter() - start, pool=name, route=record.info.pop("checkout_route", "-")
+            )
+
+    IN_USE.set_function(pool.checkedout, pool=name)
+    IDLE.set_function(pool.checkedin, pool=name)
+    OVERFLOW.set_function(pool.overflow, pool=name)
@@ -0,0 +1,628 @@
+"""
+Coda dei caricamenti asincroni, persistita nella tabella ingestion_jobs (nessun broker esterno).
+
+Con `Prefer: respond-async` gli endpoint di upload salvano il file in INGEST_JOBS_DIR, inseriscono
+un job in stato queued e rispondono 202 con l'URL di stato /api/jobs/{id}.
+Ogni processo dell'app avvia INGEST_JOB_WORKERS thread che prelevano i job con
+SELECT ... FOR UPDATE SKIP LOCKED (più processi non eseguono mai lo stesso job)
+e scrivono, nella stessa transazione di ogni blocco, il checkpoint: posizione in byte e numero
+della prossima riga, report parziale e heartbeat. Il checkpoint è scritto solo se il job è ancora
+assegnato al worker (stesso numero di tentativi), altrimenti il blocco è annullato.
+Il report conserva solo i contatori, i primi INGEST_JOB_REPORT_ERRORS errori e il conteggio per motivo;
+l'elenco completo è scritto in coda al file {upload}.errors (una stringa JSON per riga),
+disponibile da /api/jobs/{id}/errors. Durante l'esecuzione un thread separato aggiorna
+l'heartbeat ogni INGEST_JOB_HEARTBEAT secondi, anche mentre il job non arriva a un checkpoint
+(righe già confermate da saltare, caricamento dell'indice dei Patient, blocchi lenti).
+Un job interrotto riprende dal checkpoint: allo shutdown il worker si ferma a fine blocco e rimette
+il job in coda; i job rimasti in running senza heartbeat per INGEST_JOB_STALE_AFTER secondi
+(processo terminato) tornano in coda fino a INGEST_JOB_MAX_ATTEMPTS tentativi.
+Gli id delle risorse derivano da SHA-256 del file e numero di riga: le righe di un blocco riletto
+dopo un'interruzione (o di un file caricato di nuovo) hanno gli stessi id e risultano duplicate,
+senza ripetere i controlli sulle righe già confermate.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import AsyncIterator, BinaryIO, Callable, Iterable, Iterator, NamedTuple, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from app.models.ingestion_job import IngestionJob
+from app.services.bulk_ingestion import CSV_INGEST_SPECS, ingest_csv_rows, record_ingestion
+from app.services.database import engine
+from app.services.patient_index import load_patient_index
+from app.utils.audit import log_audit_event
+from app.utils.json_stream import JSON_READ_CHUNK, iter_json_resources
+from app.utils.transform import deterministic_resource_id, process_json_resources
+
+logger = logging.getLogger(__name__)
+
+INGEST_JOBS_DIR = os.getenv("INGEST_JOBS_DIR", "app/uploads/jobs")
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "1"))
+INGEST_JOB_POLL_INTERVAL = float(os.getenv("INGEST_JOB_POLL_INTERVAL", "2"))
+INGEST_JOB_STALE_AFTER = float(os.getenv("INGEST_JOB_STALE_AFTER", "300"))
+INGEST_JOB_MAX_ATTEMPTS = int(os.getenv("INGEST_JOB_MAX_ATTEMPTS", "3"))
+INGEST_JOB_HEARTBEAT = float(os.getenv("INGEST_JOB_HEARTBEAT", str(max(1.0, INGEST_JOB_STALE_AFTER / 5))))
+INGEST_JOB_REPORT_ERRORS = int(os.getenv("INGEST_JOB_REPORT_ERRORS", "100"))
+
+
+# --- accodamento ----------------------------------------------------------------
+
+class SavedUpload(NamedTuple):
+    job_id: str
+    path: str
+    size: int
+    sha256: str
+
+
+def _new_job_path(suffix: str) -> tuple[str, str]:
+    os.makedirs(INGEST_JOBS_DIR, exist_ok=True)
+    job_id = uuid.uuid4().hex
+    return job_id, os.path.join(INGEST_JOBS_DIR, f"{job_id}{suffix}")
+
+
+def save_upload(src: BinaryIO, suffix: str) -> SavedUpload:
+    """
+    Copia su disco il file caricato calcolandone l'hash.
+    """
+    job_id, path = _new_job_path(suffix)
+    digest = hashlib.sha256()
+    size = 0
+    src.seek(0)
+    with open(path, "wb") as dst:
+        while chunk := src.read(1024 * 1024):
+            digest.update(chunk)
+            dst.write(chunk)
+            size += len(chunk)
+    return SavedUpload(job_id, path, size, digest.hexdigest())
+
+
+async def asave_upload(chunks: AsyncIterator[bytes], suffix: str) -> SavedUpload:
+    """
+    Variante per il body di una richiesta in streaming.
+    """
+    job_id, path = _new_job_path(suffix)
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "wb") as dst:
+        async for chunk in chunks:
+            digest.update(chunk)
+            dst.write(chunk)
+            size += len(chunk)
+    return SavedUpload(job_id, path, size, digest.hexdigest())
+
+
+def enqueue_job(db: Session, upload: SavedUpload, kind: str, resource_type: Optional[str],
+                filename: Optional[str], username: str, client_ip: str) -> IngestionJob:
+    job = IngestionJob(
+        id=upload.job_id,
+        kind=kind,
+        resource_type=resource_type,
+        status="queued",
+        file_path=upload.path,
+        file_hash=upload.sha256,
+        filename=filename,
+        username=username,
+        client_ip=client_ip,
+        total_bytes=upload.size,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    wake_job_workers()
+    return job
+
+
+def job_status(job: IngestionJob) -> dict:
+    """
+    Stato del job per il polling: avanzamento, throughput, ETA e report finale.
+    """
+    elapsed = None
+    if job.started_at:
+        elapsed = ((job.finished_at or datetime.now(timezone.utc)) - job.started_at).total_seconds()
+    rows_per_second = job.rows_processed / elapsed if elapsed else None
+    progress = job.bytes_processed / job.total_bytes if job.total_bytes else None
+    eta = None
+    if job.status == "running" and elapsed and job.bytes_processed:
+        eta = elapsed * (job.total_bytes - job.bytes_processed) / job.bytes_processed
+    return {
+        "id": job.id,
+        "status": job.status,
+        "kind": job.kind,
+        "resourceType": job.resource_type,
+        "filename": job.filename,
+        "created": job.created_at,
+        "started": job.started_at,
+        "finished": job.finished_at,
+        "bytes_total": job.total_bytes,
+        "bytes_processed": job.bytes_processed,
+        "progress": round(progress, 4) if progress is not None else None,
+        "rows_processed": job.rows_processed,
+        "checkpoint_row": job.checkpoint_row,
+        "attempts": job.attempts,
+        "inserted": job.rows_inserted,
+        "skipped": job.rows_skipped,
+        "rows_per_second": round(rows_per_second, 1) if rows_per_second is not None else None,
+        "eta_seconds": round(eta, 1) if eta is not None else None,
+        # Memoria e velocità dell'indice dei Patient usato per le verifiche referenziali
+        "patient_index": (job.report or {}).get("patient_index"),
+        "report": job.report if job.status == "done" else None,
+        "error": job.error,
+    }
+
+
+# --- esecuzione -----------------------------------------------------------------
+
+def _update_job(job_id: str, **values) -> None:
+    with Session(engine) as db:
+        db.execute(
+            update(IngestionJob).where(IngestionJob.id == job_id).values(updated_at=func.now(), **values)
+        )
+        db.commit()
+
+
+def _stale_condition():
+    cutoff = func.now() - func.make_interval(0, 0, 0, 0, 0, 0, INGEST_JOB_STALE_AFTER)
+    return (IngestionJob.status == "running") & (IngestionJob.updated_at < cutoff)
+
+
+def recover_stale_jobs(db: Session) -> None:
+    """
+    Rimette in coda i job il cui worker non dà più segni di vita; oltre il numero massimo di tentativi li chiude come failed.
+    """
+    requeued = db.execute(
+        update(IngestionJob)
+        .where(_stale_condition(), IngestionJob.attempts < INGEST_JOB_MAX_ATTEMPTS)
+        .values(status="queued", updated_at=func.now())
+        .returning(IngestionJob.id, IngestionJob.checkpoint_row)
+    ).all()
+    failed = db.execute(
+        update(IngestionJob)
+        .where(_stale_condition())
+        .values(status="failed", error=f"Job interrotto {INGEST_JOB_MAX_ATTEMPTS} volte",
+                finished_at=func.now(), updated_at=func.now())
+        .returning(IngestionJob.id, IngestionJob.file_path)
+    ).all()
+    db.commit()
+    for job_id, row in requeued:
+        logger.warning(f"[JOB] {job_id} interrotto, rimesso in coda dalla riga {row}")
+    for job_id, path in failed:
+        logger.warning(f"[JOB] {job_id} interrotto troppe volte, segnato come failed")
+        _remove(path)
+
+
+def claim_next_job() -> Optional[str]:
+    """
+    Preleva il job in coda più vecchio e lo segna running; None se la coda è vuota.
+    """
+    with Session(engine) as db:
+        recover_stale_jobs(db)
+        job = db.execute(
+            select(IngestionJob)
+            .where(IngestionJob.status == "queued")
+            .order_by(IngestionJob.created_at)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).scalar_one_or_none()
+        if job is None:
+            return None
+        job.status = "running"
+        if job.started_at is None:
+            job.started_at = func.now()
+        job.updated_at = func.now()
+        job.attempts += 1
+        db.commit()
+        return job.id
+
+
+class CsvCheckpointReader:
+    """
+    Righe di un CSV come csv.DictReader, con la posizione esatta in byte dopo l'ultima riga letta.
+    Il file è letto in binario una linea alla volta: csv.reader consuma solo le linee della riga
+    corrente (anche con campi tra virgolette su più linee), quindi `offset` è sempre un inizio di riga.
+    """
+
+    def __init__(self, f: BinaryIO, offset: int = 0, row: int = 0, encoding: str = "utf-8",
+                 should_stop: Optional[Callable[[], bool]] = None):
+        self._f = f
+        self._encoding = encoding
+        self._should_stop = should_stop
+        f.seek(0)
+        self.offset = 0
+        self.fieldnames = next(csv.reader(self._lines()), None)
+        if offset > self.offset:
+            f.seek(offset)
+            self.offset = offset
+        self.row = row
+        self.interrupted = False
+
+    def _lines(self) -> Iterator[str]:
+        for line in self._f:
+            self.offset += len(line)
+            yield line.decode(self._encoding)
+
+    def __iter__(self) -> Iterator[dict]:
+        rows = iter(csv.DictReader(self._lines(), fieldnames=self.fieldnames))
+        while True:
+            # Controllo prima di leggere: una riga letta è sempre anche elaborata
+            if self._should_stop and self._should_stop():
+                self.interrupted = True
+                return
+            row = next(rows, None)
+            if row is None:
+                return
+            self.row += 1
+            yield row
+
+
+class JsonCheckpointReader:
+    """
+    Risorse di un file JSON/NDJSON numerate in ordine. Il parser incrementale non permette di riprendere
+    a metà file, quindi alla ripresa le prime `row` risorse sono rilette e scartate (solo parsing, nessuna query).
+    Le risorse senza id ricevono l'id derivato da hash del file e numero di risorsa.
+    """
+
+    def __init__(self, f: BinaryIO, seed: str, row: int = 0, should_stop: Optional[Callable[[], bool]] = None):
+        self._f = f
+        self._seed = seed
+        self._start = row
+        self._should_stop = should_stop
+        self.row = row
+        self.offset = 0
+        self.interrupted = False
+
+    def _chunks(self) -> Iterator[bytes]:
+        while chunk := self._f.read(JSON_READ_CHUNK):
+            yield chunk
+
+    def __iter__(self) -> Iterator[dict]:
+        self._f.seek(0)
+        for ordinal, raw in enumerate(iter_json_resources(self._chunks())):
+            if ordinal < self._start:
+                continue
+            if self._should_stop and self._should_stop():
+                self.interrupted = True
+                return
+            if isinstance(raw, dict) and not raw.get("id"):
+                raw["id"] = deterministic_resource_id(raw.get("resourceType") or "Patient", self._seed, ordinal)
+            self.row = ordinal + 1
+            self.offset = self._f.tell()
+            yield raw
+
+
+class _Heartbeat:
+    """
+    Thread che aggiorna updated_at del job finché il worker lo esegue, indipendentemente dai checkpoint.
+    Il numero di tentativi identifica l'esecuzione: se il job è stato rimesso in coda e preso da un altro
+    worker l'aggiornamento non trova la riga e `lost` segnala al worker di abbandonarlo.
+    """
+
+    def __init__(self, job_id: str, attempt: int, interval: float = INGEST_JOB_HEARTBEAT):
+        self.job_id = job_id
+        self.attempt = attempt
+        self.interval = interval
+        self.lost = threading.Event()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"ingestion-heartbeat-{job_id[:8]}", daemon=True)
+
+    def __enter__(self) -> "_Heartbeat":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._done.set()
+        self._thread.join()
+
+    def should_stop(self) -> bool:
+        return _stop.is_set() or self.lost.is_set()
+
+    def _run(self) -> None:
+        while not self._done.wait(self.interval):
+            try:
+                with Session(engine) as db:
+                    alive = db.execute(
+                        update(IngestionJob)
+                        .where(IngestionJob.id == self.job_id, IngestionJob.status == "running",
+                               IngestionJob.attempts == self.attempt)
+                        .values(updated_at=func.now())
+                    ).rowcount
+                    db.commit()
+            except Exception as e:
+                logger.error(f"[JOB] Heartbeat di {self.job_id} non registrato: {e}")
+                continue
+            if not alive:
+                logger.warning(f"[JOB] {self.job_id} non più assegnato a questo worker")
+                self.lost.set()
+                return
+
+
+def job_errors_path(job: IngestionJob) -> str:
+    return f"{job.file_path}.errors"
+
+
+def _error_reason(message: str) -> str:
+    # Il testo prima dei dettagli della riga: "Observation scartata", "Risorsa duplicata saltata", ...
+    return message.split("\n", 1)[0].split(":", 1)[0][:120]
+
+
+class _JobErrors:
+    """
+    Errori di un job: l'elenco completo in coda al file degli errori, nel report solo un campione e i contatori.
+    La dimensione del file è parte del checkpoint: alla ripresa le righe di un blocco non confermato sono troncate.
+    """
+
+    def __init__(self, path: str, report: Optional[dict]):
+        report = report or {}
+        self.path = path
+        self.sample = list(report.get("errors", []))[:INGEST_JOB_REPORT_ERRORS]
+        self.counts = Counter(report.get("error_counts", {}))
+        self.total = report.get("errors_total", len(report.get("errors", [])))
+        self.offset = report.get("errors_offset", 0)
+        self._pending = bytearray()
+        with open(path, "ab") as f:
+            f.truncate(self.offset)
+
+    def add(self, errors: Iterable[tuple[str, str]]) -> None:
+        """
+        Registra gli errori di un blocco come coppie (messaggio, motivo); il file è scritto da write().
+        """
+        for message, reason in errors:
+            if len(self.sample) < INGEST_JOB_REPORT_ERRORS:
+                self.sample.append(message)
+            self.counts[reason] += 1
+            self.total += 1
+            self._pending += json.dumps(message, ensure_ascii=False).encode() + b"\n"
+
+    def report(self) -> dict:
+        return {
+            "errors": self.sample,
+            "errors_total": self.total,
+            "error_counts": dict(self.counts),
+            "errors_offset": self.offset + len(self._pending),
+        }
+
+    def write(self) -> None:
+        # Prima del commit del blocco: se il commit fallisce le righe sono oltre l'offset confermato
+        with open(self.path, "ab") as f:
+            f.write(self._pending)
+        self.offset += len(self._pending)
+        self._pending.clear()
+
+
+class _JobLost(Exception):
+    """
+    Il job è stato rimesso in coda e preso da un altro worker: il blocco in corso va abbandonato.
+    """
+
+
+def _checkpoint(db: Session, job: IngestionJob, reader, inserted: int, skipped: int, report: dict) -> None:
+    # Nella transazione del blocco: dati e checkpoint sono confermati insieme.
+    # Come nell'heartbeat, il numero di tentativi identifica l'esecuzione di questo worker
+    owned = db.execute(
+        update(IngestionJob)
+        .where(IngestionJob.id == job.id, IngestionJob.status == "running",
+               IngestionJob.attempts == job.attempts)
+        .values(
+            checkpoint_offset=reader.offset,
+            checkpoint_row=reader.row,
+            bytes_processed=reader.offset,
+            rows_processed=reader.row,
+            rows_inserted=inserted,
+            rows_skipped=skipped,
+            report=report,
+            updated_at=func.now(),
+        )
+    ).rowcount
+    if not owned:
+        db.rollback()
+        raise _JobLost(job.id)
+
+
+def _final_report(report: dict) -> dict:
+    return {k: v for k, v in report.items() if k != "errors_offset"}
+
+
+class _JobRun(NamedTuple):
+    report: dict
+    accepted: Counter
+    rejected: Counter
+    interrupted: bool
+
+
+def _run_csv(db: Session, job: IngestionJob, f: BinaryIO, should_stop: Callable[[], bool]) -> _JobRun:
+    resource_type = job.resource_type
+    reader = CsvCheckpointReader(f, job.checkpoint_offset, job.checkpoint_row, should_stop=should_stop)
+    previous = job.report or {"inserted": 0, "skipped": 0}
+    start_inserted, start_skipped = previous["inserted"], previous["skipped"]
+    errors = _JobErrors(job_errors_path(job), job.report)
+    # Il report del blocco raccoglie solo gli errori nuovi, spostati nel file a ogni checkpoint
+    report = {"inserted": start_inserted, "skipped": start_skipped, "errors": []}
+
+    # Indice dei Patient del job: le verifiche referenziali delle righe non interrogano il database
+    patient_index = load_patient_index(db) if CSV_INGEST_SPECS[resource_type].patient_ref else None
+
+    def checkpoint(db: Session, report: dict) -> None:
+        errors.add((message, _error_reason(message)) for message in report["errors"])
+        report["errors"].clear()
+        if patient_index is not None:
+            report["patient_index"] = patient_index.stats()
+        _checkpoint(db, job, reader, report["inserted"], report["skipped"], {**report, **errors.report()})
+        errors.write()
+
+    report = ingest_csv_rows(
+        db, reader, resource_type,
+        on_chunk=checkpoint, id_seed=job.file_hash, start_ordinal=job.checkpoint_row, report=report,
+        patient_index=patient_index,
+    )
+    return _JobRun(
+        _final_report({**report, **errors.report()}),
+        Counter({resource_type: report["inserted"] - start_inserted}),
+        Counter({resource_type: report["skipped"] - start_skipped}),
+        reader.interrupted,
+    )
+
+
+def _run_json(db: Session, job: IngestionJob, f: BinaryIO, should_stop: Callable[[], bool]) -> _JobRun:
+    reader = JsonCheckpointReader(f, job.file_hash, job.checkpoint_row, should_stop=should_stop)
+    previous = job.report or {}
+    start_accepted = Counter(previous.get("processed_by_type", {}))
+    start_rejected = Counter(previous.get("rejected_by_type", {}))
+    errors = _JobErrors(job_errors_path(job), job.report)
+    summary = {
+        "total": previous.get("total", 0),
+        "processed": previous.get("processed", 0),
+        "processed_by_type": dict(start_accepted),
+        "rejected_by_type": dict(start_rejected),
+        "errors": [],
+    }
+
+    def checkpoint(db: Session, summary: dict) -> None:
+        rejected = summary["rejected_by_type"]
+        for e in summary["errors"]:
+            rejected[e["resourceType"]] = rejected.get(e["resourceType"], 0) + 1
+        # Stesso formato degli errori di json_upload_response
+        errors.add((f"[{e['resourceType']}/{e['id']}] {e['error']}", _error_reason(e["error"]))
+                   for e in summary["errors"])
+        summary["errors"].clear()
+        _checkpoint(db, job, reader, summary["processed"], errors.total, {**summary, **errors.report()})
+        errors.write()
+
+    summary = process_json_resources(reader, db, before_commit=checkpoint, summary=summary)
+    report = {"inserted": summary["processed"], "skipped": errors.total, **errors.report()}
+    return _JobRun(
+        _final_report(report),
+        Counter(summary["processed_by_type"]) - start_accepted,
+        Counter(summary["rejected_by_type"]) - start_rejected,
+        reader.interrupted,
+    )
+
+
+def run_job(job_id: str) -> None:
+    with Session(engine) as db:
+        job = db.get(IngestionJob, job_id)
+        if job is None:
+            logger.warning(f"[JOB] {job_id} non trovato, ignorato")
+            return
+        db.expunge(job)
+        db.commit()
+
+        resumed = f" dalla riga {job.checkpoint_row}" if job.checkpoint_row else ""
+        logger.info(f"[JOB] {job_id} avviato ({job.kind} {job.resource_type or ''}){resumed}")
+        started = time.perf_counter()
+        heartbeat = _Heartbeat(job_id, job.attempts)
+        try:
+            with heartbeat, open(job.file_path, "rb") as f:
+                run_kind = _run_csv if job.kind == "csv" else _run_json
+                run = run_kind(db, job, f, heartbeat.should_stop)
+        except _JobLost:
+            logger.warning(f"[JOB] {job_id} abbandonato a metà blocco: è in carico a un altro worker")
+            return
+        except Exception as e:
+            db.rollback()
+            if heartbeat.lost.is_set():
+                logger.warning(f"[JOB] {job_id} abbandonato dopo un errore: è in carico a un altro worker")
+                return
+            logger.exception(f"[JOB] {job_id} fallito")
+            _update_job(job_id, status="failed", error=str(e), finished_at=func.now())
+            _remove(job.file_path)
+            return
+
+    record_ingestion(job.kind, run.accepted, run.rejected, time.perf_counter() - started)
+    if heartbeat.lost.is_set():
+        # Rimesso in coda e preso da un altro worker: lo stato del job è suo
+        logger.warning(f"[JOB] {job_id} abbandonato: è in carico a un altro worker")
+        return
+    if run.interrupted:
+        # Shutdown: l'ultimo blocco è confermato con il suo checkpoint, il job riprenderà da lì
+        _update_job(job_id, status="queued")
+        logger.info(f"[JOB] {job_id} sospeso, rimesso in coda")
+        return
+
+    report = run.report
+    _update_job(
+        job_id,
+        status="done",
+        report=report,
+        bytes_processed=job.total_bytes,
+        rows_inserted=report["inserted"],
+        rows_skipped=report["skipped"],
+        finished_at=func.now(),
+    )
+    _remove(job.file_path)
+    logger.info(f"[JOB] {job_id} completato: {report['inserted']} inseriti, {report['skipped']} scartati")
+    if job.kind == "json":
+        log_audit_event(
+            event_type="120301",
+            username=job.username,
+            success=(report["skipped"] == 0),
+            ip=job.client_ip,
+            action="C",
+            entity_type="BatchJSONIngest"
+        )
+
+
+def _remove(path: Optional[str]) -> None:
+    try:
+        if path:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# --- worker ---------------------------------------------------------------------
+
+_wakeup = threading.Event()
+_stop = threading.Event()
+_threads: list[threading.Thread] = []
+
+
+def wake_job_workers() -> None:
+    _wakeup.set()
+
+
+def _worker_loop() -> None:
+    while not _stop.is_set():
+        try:
+            job_id = claim_next_job()
+        except Exception as e:
+            logger.error(f"[JOB] Lettura della coda fallita: {e}")
+            job_id = None
+        if job_id is None:
+            _wakeup.wait(INGEST_JOB_POLL_INTERVAL)
+            _wakeup.clear()
+            continue
+        try:
+            run_job(job_id)
+        except Exception:
+            # Errore fuori dall'esecuzione (lettura o stato finale del job): il job tornerà in coda
+            # con il recupero dei job senza heartbeat, il worker resta attivo per i successivi
+            logger.exception(f"[JOB] Errore nella gestione di {job_id}")
+
+
+def start_job_workers(count: int = INGEST_JOB_WORKERS) -> None:
+    if _threads:
+        return
+    _stop.clear()
+    for i in range(count):
+        thread = threading.Thread(target=_worker_loop, name=f"ingestion-job-{i}", daemon=True)
+        thread.start()
+        _threads.append(thread)
+
+
+def stop_job_workers(timeout: float = 30.0) -> None:
+    """
+    Ferma i worker: il job in corso conferma il blocco corrente con il suo checkpoint e torna in coda.
+    """
+    _stop.set()
+    _wakeup.set()
+    for thread in _threads:
+        thread.join(timeout)
+    _threads.clear()
@@ -0,0 +1,98 @@
+import logging
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import Session
+
+from app.base import Base
+from app.models.audit_event import AuditEventRecord  # noqa: F401 (tabella creata da create_all)
+from app.models.ingestion_job import IngestionJob  # noqa: F401
+from app.models.fhir_resource import FhirResource, NATURAL_KEY_INDEXES, SEARCH_COLUMNS
+from app.models.resource_count import ResourceCount
+from app.models.rollup import EpiRollup
+from app.models.search_index import SearchIndexEntry
+from app.services.partitioning import ensure_partitioning, is_partitioned
+
+logger = logging.getLogger(__name__)
+
+
+def ensure_search_columns(conn: Connection) -> None:
+    """
+    Aggiunge a fhir_resources le colonne generate di ricerca e last_updated, se mancanti, e i relativi indici.
+    Operazione idempotente: su tabelle già aggiornate non modifica nulla.
+    """
+    for name, expr in SEARCH_COLUMNS.items():
+        conn.execute(text(
+            f"ALTER TABLE fhir_resources ADD COLUMN IF NOT EXISTS {name} text "
+            f"GENERATED ALWAYS AS ({expr}) STORED"
+        ))
+    conn.execute(text(
+        "ALTER TABLE fhir_resources ADD COLUMN IF NOT EXISTS last_updated timestamptz NOT NULL DEFAULT now()"
+    ))
+    conn.execute(text(
+        "ALTER TABLE fhir_resources ADD COLUMN IF NOT EXISTS partition_date date NOT NULL DEFAULT '1970-01-01'"
+    ))
+    for index in FhirResource.__table__.indexes - set(NATURAL_KEY_INDEXES):
+        index.create(bind=conn, checkfirst=True)
+
+
+def ensure_natural_keys(conn: Connection) -> None:
+    """
+    Crea gli indici unici sulle chiavi naturali. Se i dati esistenti contengono già duplicati
+    l'indice non viene creato (e i nuovi duplicati di quel tipo non sono scartati): va segnalato.
+    Con il layout partizionato le chiavi sono sulle partizioni (app/services/partitioning.py).
+    """
+    if is_partitioned(conn):
+        return
+    for index in NATURAL_KEY_INDEXES:
+        try:
+            with conn.begin_nested():
+                index.create(bind=conn, checkfirst=True)
+        except IntegrityError as e:
+            logger.error(f"Indice {index.name} non creato, rimuovere prima i duplicati esistenti: {e.orig}")
+
+
+def ensure_job_columns(conn: Connection) -> None:
+    """
+    Colonne di checkpoint aggiunte a ingestion_jobs dopo la sua creazione.
+    """
+    for column in (
+        "file_hash text",
+        "checkpoint_offset bigint NOT NULL DEFAULT 0",
+        "checkpoint_row bigint NOT NULL DEFAULT 0",
+    ):
+        conn.execute(text(f"ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS {column}"))
+
+
+def run_migrations(engine: Engine) -> None:
+    """
+    Applica allo schema esistente le modifiche introdotte dopo la prima creazione delle tabelle.
+    """
+    existing_tables = set(inspect(engine).get_table_names())
+    with engine.begin() as conn:
+        ensure_search_columns(conn)
+        ensure_natural_keys(conn)
+        # Crea solo le tabelle mancanti (indice di ricerca, aggregati, ...)
+        Base.metadata.create_all(bind=conn)
+        ensure_job_columns(conn)
+        # Layout partizionato (FHIR_PARTITIONED) e partizioni mensili dei prossimi mesi
+        ensure_partitioning(conn)
+
+    # Tabelle derivate appena create su un database già popolato: backfill
+    from app.services.resource_counts import resync_counts
+    from app.services.rollups import rebuild_rollups
+    from app.services.search_index import rebuild_search_index
+
+    backfills = {
+        SearchIndexEntry.__tablename__: ("dell'indice di ricerca FHIR", rebuild_search_index),
+        EpiRollup.__tablename__: ("degli aggregati epidemiologici", rebuild_rollups),
+        ResourceCount.__tablename__: ("dei contatori per tipo", resync_counts),
+    }
+    with Session(engine) as db:
+        populated = db.query(FhirResource.id).first() is not None
+        for table, (label, rebuild) in backfills.items():
+            if populated and table not in existing_tables:
+                logger.info(f"Backfill {label}")
+                rebuild(db)
+    logger.info("Migrazioni schema applicate")
@@ -0,0 +1,105 @@
+import base64
+import binascii
+import json
+from typing import Optional
+
+from fastapi import HTTPException, Request
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.fhir_resource import FhirResource
+
+DEFAULT_COUNT = 50
+MAX_COUNT = 1000
+
+# Elementi sempre inclusi nella proiezione _elements
+MANDATORY_ELEMENTS = ("resourceType", "id", "meta")
+
+
+def encode_cursor(last_id: str) -> str:
+    """
+    Cursore opaco per la paginazione keyset: codifica l'ultima chiave primaria restituita.
+    """
+    raw = json.dumps({"id": last_id}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str) -> str:
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded))["id"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursore _cursor non valido")
+
+
+def parse_elements(elements: Optional[str]) -> Optional[list[str]]:
+    if not elements:
+        return None
+    names = [e.strip() for e in elements.split(",") if e.strip()]
+    return list(dict.fromkeys([*MANDATORY_ELEMENTS, *names]))
+
+
+def content_projection(elements: Optional[list[str]]):
+    """
+    Espressione SQL del contenuto restituito: l'intero JSONB o solo gli elementi di primo livello richiesti,
+    selezionati nel database con jsonb_each / jsonb_object_agg.
+    """
+    if not elements:
+        return FhirResource.content
+    each = func.jsonb_each(FhirResource.content).table_valued("key", "value")
+    return (
+        select(func.coalesce(func.jsonb_object_agg(each.c.key, each.c.value), literal_column("'{}'::jsonb")))
+        .where(each.c.key.in_(elements))
+        .scalar_subquery()
+    )
+
+
+async def fetch_page(db: AsyncSession, resource_type: str, conditions: list, count: int,
+                     cursor: Optional[str] = None, elements: Optional[str] = None) -> tuple[list, Optional[str]]:
+    """
+    Legge una pagina di risorse ordinata per chiave primaria (keyset, senza OFFSET).
+    Ritorna le righe (id, content) e il cursore della pagina successiva (None se ultima).
+    """
+    stmt = (
+        select(FhirResource.id, content_projection(parse_elements(elements)))
+        .where(FhirResource.resource_type == resource_type, *conditions)
+    )
+    if cursor:
+        stmt = stmt.where(FhirResource.id > decode_cursor(cursor))
+    rows = (await db.execute(stmt.order_by(FhirResource.id).limit(count + 1))).all()
+    if len(rows) > count:
+        rows = rows[:count]
+        return rows, encode_cursor(rows[-1][0])
+    return rows, None
+
+
+def searchset_bundle(request: Request, resource_type: str, rows: list, next_cursor: Optional[str]) -> dict:
+    """
+    Costruisce un Bundle FHIR searchset con i link self/next.
+    """
+    base = str(request.base_url).rstrip("/")
+    links = [{"relation": "self", "url": str(request.url)}]
+    if next_cursor:
+        links.append({
+            "relation": "next",
+            "url": str(request.url.include_query_params(_cursor=next_cursor)),
+        })
+    return {
+        "resourceType": "Bundle",
+        "type": "searchset",
+        "link": links,
+        "entry": [
+            {
+                "fullUrl": f"{base}/api/{resource_type}/{row_id}",
+                "resource": content,
+                "search": {"mode": "match"},
+            }
+            for row_id, content in rows
+        ],
+    }
+
+
+async def paginated_searchset(db: AsyncSession, request: Request, resource_type: str, conditions: list,
+                              count: int, cursor: Optional[str], elements: Optional[str]) -> dict:
+    rows, next_cursor = await fetch_page(db, resource_type, conditions, count, cursor, elements)
+    return searchset_bundle(request, resource_type, rows, next_cursor)
@@ -0,0 +1,433 @@
+"""
+Layout partizionato di fhir_resources (opt-in con FHIR_PARTITIONED=true).
+
+fhir_resources diventa una tabella partizionata per LIST (resource_type):
+  - fhir_resources_patient / _encounter / _condition: una partizione per tipo;
+  - fhir_resources_observation: a sua volta partizionata per RANGE (partition_date), un mese per partizione
+    (fhir_resources_observation_2024_05), più una partizione DEFAULT per le Observation senza data;
+  - fhir_resources_other: DEFAULT per gli altri tipi.
+partition_date è una colonna ordinaria valorizzata dall'applicazione (Postgres non accetta colonne generate
+come chiave di partizione): mese di effectiveDateTime per le Observation, 1970-01-01 per il resto.
+La chiave primaria diventa (id, resource_type, partition_date): l'id è unico nel tipo, non più sull'intera
+tabella. Le chiavi naturali di Patient, Encounter e Condition sono indici unici sulle loro partizioni;
+per le Observation un indice unico dovrebbe includere il mese, quindi id e identifier sono registrati
+in fhir_resources_observation_keys (chiave primaria su id, unique su identifier): le scritture bulk vi
+riservano le chiavi prima dell'INSERT e scartano come duplicate le righe già presenti in qualsiasi mese,
+le scritture ORM falliscono con IntegrityError come con un indice unico. Le chiavi sono rimosse con le
+Observation eliminate, archiviate o svuotate (listener on_deleted / on_cleared).
+La FK dell'indice di ricerca non è più possibile: le eliminazioni sono propagate dai listener
+di app/services/search_index.py.
+
+Le partizioni mensili mancanti sono create prima di ogni scrittura, ciascuna in una transazione breve
+su una connessione dedicata (fuori dal pool) con FHIR_PARTITION_LOCK_TIMEOUT: la scrittura non resta
+in attesa del lock sulla tabella delle Observation, che la sua stessa transazione potrebbe tenere.
+Un mese la cui partizione non è stata creata finisce nella DEFAULT e il processo non lo ritenta più.
+All'avvio vengono create in anticipo le partizioni dei prossimi FHIR_PARTITION_MONTHS_AHEAD mesi.
+Lo svuotamento di un tipo è un TRUNCATE della sua partizione e un mese di Observation può essere
+staccato (DETACH PARTITION) e conservato come tabella di archivio.
+La migrazione è in un'unica transazione, serializzata tra i processi da un advisory lock:
+copia i dati nella nuova tabella e sostituisce la vecchia.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date
+from typing import Iterable, Optional
+
+from sqlalchemy import (
+    Column, Date, MetaData, Table, Text, create_engine, delete, event, select, text, update,
+)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+from app.models.fhir_resource import NATURAL_KEY_INDEXES, FhirResource
+from app.services.resource_events import ResourceRow, notify_deleted, on_cleared, on_deleted
+from app.utils.streaming import iter_chunks
+
+logger = logging.getLogger(__name__)
+
+FHIR_PARTITIONED = os.getenv("FHIR_PARTITIONED", "false").lower() in ("1", "true", "yes")
+FHIR_PARTITION_MONTHS_AHEAD = int(os.getenv("FHIR_PARTITION_MONTHS_AHEAD", "3"))
+FHIR_PARTITION_LOCK_TIMEOUT = os.getenv("FHIR_PARTITION_LOCK_TIMEOUT", "2s")
+# Chiave dell'advisory lock che serializza la migrazione tra i processi avviati insieme
+MIGRATION_LOCK = f"{FhirResource.__tablename__}_partitioning"
+
+TABLE = FhirResource.__tablename__
+TYPE_PARTITIONS = {
+    "Patient": f"{TABLE}_patient",
+    "Encounter": f"{TABLE}_encounter",
+    "Observation": f"{TABLE}_observation",
+    "Condition": f"{TABLE}_condition",
+}
+OTHER_PARTITION = f"{TABLE}_other"
+OBSERVATION_DEFAULT = f"{TABLE}_observation_default"
+OBSERVATION_KEYS = f"{TABLE}_observation_keys"
+ARCHIVE_PREFIX = "archive_"
+
+EPOCH = date(1970, 1, 1)
+_MONTH = re.compile(r"^(\d{4})-(0[1-9]|1[0-2])")
+_MONTH_SQL = r"^\d{4}-(0[1-9]|1[0-2])"
+PARTITION_DATE_SQL = (
+    f"CASE WHEN resource_type = 'Observation' AND content ->> 'effectiveDateTime' ~ '{_MONTH_SQL}' "
+    f"THEN to_date(left(content ->> 'effectiveDateTime', 7), 'YYYY-MM') ELSE DATE '1970-01-01' END"
+)
+
+# Fuori da Base.metadata: esiste solo con il layout partizionato
+observation_keys = Table(
+    OBSERVATION_KEYS, MetaData(),
+    Column("id", Text, primary_key=True),
+    Column("identifier_value", Text, unique=True),
+    Column("partition_date", Date, nullable=False),
+)
+
+_partitioned: Optional[bool] = None
+_known_months: Optional[set[date]] = None
+_known_loaded_at = 0.0
+KNOWN_MONTHS_TTL = 5.0
+# Mesi la cui partizione non è stata creata: le righe restano nella DEFAULT, senza nuovi tentativi
+_failed_months: set[date] = set()
+_ddl_engine: Optional[Engine] = None
+_ddl_lock = threading.Lock()
+
+
+def partition_date_of(resource_type: str, content: Optional[dict]) -> date:
+    """
+    Valore di partition_date per una risorsa (stessa regola di PARTITION_DATE_SQL).
+    """
+    if resource_type == "Observation" and content:
+        match = _MONTH.match(content.get("effectiveDateTime") or "")
+        if match:
+            return date(int(match.group(1)), int(match.group(2)), 1)
+    return EPOCH
+
+
+def _next_month(month: date) -> date:
+    return month.replace(year=month.year + 1, month=1) if month.month == 12 else month.replace(month=month.month + 1)
+
+
+def observation_partition(month: date) -> str:
+    return f"{TYPE_PARTITIONS['Observation']}_{month:%Y_%m}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    global _partitioned
+    if _partitioned is None:
+        _partitioned = conn.execute(
+            text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t)"), {"t": TABLE}
+        ).scalar() or False
+    return _partitioned
+
+
+def _refresh_known_months(conn: Connection) -> None:
+    """
+    Partizioni mensili esistenti, lette dal catalogo con la connessione del chiamante
+    (le partizioni sono create in transazioni proprie, quindi già confermate).
+    """
+    global _known_months, _known_loaded_at
+    names = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = to_regclass(:parent)"
+    ), {"parent": TYPE_PARTITIONS["Observation"]}).scalars().all()
+    months = set()
+    for name in names:
+        match = re.search(r"_(\d{4})_(\d{2})$", name)
+        if match:
+            months.add(date(int(match.group(1)), int(match.group(2)), 1))
+    _known_months, _known_loaded_at = months, time.monotonic()
+
+
+def _create_partition_sql(month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {observation_partition(month)} "
+        f"PARTITION OF {TYPE_PARTITIONS['Observation']} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_next_month(month).isoformat()}')"
+    )
+
+
+def _partition_engine(conn: Connection) -> Engine:
+    global _ddl_engine
+    if _ddl_engine is None:
+        # NullPool: una connessione aperta solo per la creazione, senza occupare il pool dell'applicazione
+        _ddl_engine = create_engine(conn.engine.url, poolclass=NullPool)
+    return _ddl_engine
+
+
+def ensure_observation_partitions(conn: Connection, months: Iterable[date]) -> None:
+    """
+    Crea le partizioni mensili mancanti, ciascuna in una transazione breve sulla connessione dedicata.
+    Se il lock non si ottiene entro FHIR_PARTITION_LOCK_TIMEOUT (altre scritture in corso, anche quella
+    del chiamante) o la DEFAULT contiene già righe del mese, le righe finiscono nella DEFAULT
+    e il mese è ricordato come fallito.
+    """
+    if not is_partitioned(conn):
+        return
+    months = set(months) - {EPOCH} - _failed_months
+    if _known_months is None or (months - _known_months and time.monotonic() - _known_loaded_at > KNOWN_MONTHS_TTL):
+        _refresh_known_months(conn)
+    missing = months - _known_months
+    if not missing:
+        return
+    with _ddl_lock:
+        for month in sorted(missing - _known_months - _failed_months):
+            try:
+                with _partition_engine(conn).begin() as ddl:
+                    ddl.execute(text("SELECT set_config('lock_timeout', :timeout, true)"),
+                                {"timeout": FHIR_PARTITION_LOCK_TIMEOUT})
+                    ddl.execute(text(_create_partition_sql(month)))
+                _known_months.add(month)
+            except DBAPIError as e:
+                _failed_months.add(month)
+                logger.error(
+                    f"[PARTITION] Partizione {observation_partition(month)} non creata, "
+                    f"le Observation del mese restano in {OBSERVATION_DEFAULT}: {e.orig}"
+                )
+
+
+def ensure_rows_partitions(conn: Connection, rows: Iterable[ResourceRow]) -> list[date]:
+    """
+    partition_date di ciascuna riga, dopo aver creato le partizioni mensili necessarie.
+    """
+    dates = [partition_date_of(r.resource_type, r.content) for r in rows]
+    ensure_observation_partitions(conn, dates)
+    return dates
+
+
+@event.listens_for(FhirResource, "before_insert")
+def _insert_partition_date(mapper, connection: Connection, target: FhirResource) -> None:
+    # Scritture ORM (db.add): un'Observation già presente, in qualsiasi mese, fa fallire l'INSERT della chiave
+    row = ResourceRow(target.id, target.resource_type, target.content)
+    target.partition_date = ensure_rows_partitions(connection, [row])[0]
+    if row.resource_type == "Observation" and is_partitioned(connection):
+        connection.execute(insert(observation_keys).values(_observation_key(row, target.partition_date)))
+
+
+@event.listens_for(FhirResource, "before_update")
+def _update_partition_date(mapper, connection: Connection, target: FhirResource) -> None:
+    # Modifica di content: un cambio di mese sposta la riga di partizione
+    row = ResourceRow(target.id, target.resource_type, target.content)
+    target.partition_date = ensure_rows_partitions(connection, [row])[0]
+    if row.resource_type == "Observation" and is_partitioned(connection):
+        key = _observation_key(row, target.partition_date)
+        connection.execute(
+            update(observation_keys).where(observation_keys.c.id == row.id)
+            .values(identifier_value=key["identifier_value"], partition_date=key["partition_date"])
+        )
+
+
+# --- chiavi delle Observation -----------------------------------------------------
+
+def _observation_key(row: ResourceRow, partition_date: date) -> dict:
+    # Stessa regola della colonna generata identifier_value
+    identifier = (row.content or {}).get("identifier")
+    first = identifier[0] if isinstance(identifier, list) and identifier else {}
+    value = first.get("value") if isinstance(first, dict) else None
+    return {"id": row.id, "identifier_value": None if value is None else str(value), "partition_date": partition_date}
+
+
+def claim_observation_keys(conn: Connection, rows: list[ResourceRow], dates: list[date]) -> Optional[set[str]]:
+    """
+    Riserva id e identifier delle Observation prima dell'INSERT; ritorna gli id riservati
+    (None senza layout partizionato, dove bastano gli indici unici). Le chiavi riservate restano
+    bloccate fino al commit: scritture concorrenti della stessa Observation attendono e la scartano.
+    """
+    if not is_partitioned(conn):
+        return None
+    keys = {}
+    for r, d in zip(rows, dates):
+        # Un id ripetuto nel blocco vale alla prima occorrenza, come con la chiave primaria
+        if r.resource_type == "Observation":
+            keys.setdefault(r.id, _observation_key(r, d))
+    if not keys:
+        return set()
+    return set(conn.execute(
+        insert(observation_keys).values(list(keys.values())).on_conflict_do_nothing().returning(observation_keys.c.id)
+    ).scalars())
+
+
+def release_observation_keys(conn: Connection, ids: Iterable[str]) -> None:
+    ids = list(ids)
+    if ids and is_partitioned(conn):
+        conn.execute(delete(observation_keys).where(observation_keys.c.id.in_(ids)))
+
+
+@on_deleted
+def _release_deleted(conn: Connection, rows: list[ResourceRow]) -> None:
+    release_observation_keys(conn, [r.id for r in rows if r.resource_type == "Observation"])
+
+
+@on_cleared
+def _release_cleared(conn: Connection, resource_type: Optional[str]) -> None:
+    if resource_type in (None, "Observation") and is_partitioned(conn):
+        conn.execute(text(f"TRUNCATE {OBSERVATION_KEYS}"))
+
+
+def ensure_observation_keys(conn: Connection) -> None:
+    """
+    Crea la tabella delle chiavi delle Observation e, se nuova, la popola dalle Observation esistenti.
+    Sostituisce l'indice unico (identifier_value, partition_date) dei database partizionati in precedenza.
+    """
+    if conn.execute(text("SELECT to_regclass(:t)"), {"t": OBSERVATION_KEYS}).scalar() is not None:
+        return
+    observation_keys.create(conn)
+    conn.execute(text(f"DROP INDEX IF EXISTS uq_{TABLE}_observation_identifier"))
+    total = conn.execute(text(f"SELECT count(*) FROM {TYPE_PARTITIONS['Observation']}")).scalar()
+    # A parità di chiave resta la prima Observation scritta
+    claimed = conn.execute(text(
+        f"INSERT INTO {OBSERVATION_KEYS} (id, identifier_value, partition_date) "
+        f"SELECT id, identifier_value, partition_date FROM {TYPE_PARTITIONS['Observation']} "
+        f"ORDER BY last_updated ON CONFLICT DO NOTHING"
+    )).rowcount
+    if claimed < total:
+        logger.error(
+            f"[PARTITION] {total - claimed} Observation duplicate (id o identifier già presenti in un altro mese): "
+            f"restano nella tabella ma non sono registrate in {OBSERVATION_KEYS}"
+        )
+
+
+def resource_partition(resource_type: Optional[str]) -> Optional[str]:
+    """
+    Tabella che contiene tutte e sole le risorse del tipo (None = tutte), se esiste.
+    """
+    return TABLE if resource_type is None else TYPE_PARTITIONS.get(resource_type)
+
+
+# --- archiviazione --------------------------------------------------------------
+
+def archive_observation_month(db: Session, month: date, batch_size: int = 2000) -> dict:
+    """
+    Stacca la partizione delle Observation di `month` e la rinomina come tabella di archivio.
+    Le righe sono prima notificate come eliminate (contatori, aggregati, indice di ricerca, cache, chiavi delle
+    Observation: un mese archiviato non blocca il ricaricamento delle stesse Observation).
+    Il commit è a carico del chiamante.
+    """
+    month = month.replace(day=1)
+    name = observation_partition(month)
+    conn = db.connection()
+    if not is_partitioned(conn) or conn.execute(text("SELECT to_regclass(:t)"), {"t": name}).scalar() is None:
+        raise ValueError(f"Partizione {name} non trovata")
+
+    archived = 0
+    result = db.execute(
+        select(FhirResource.id, FhirResource.resource_type, FhirResource.content)
+        .where(FhirResource.resource_type == "Observation", FhirResource.partition_date == month)
+        .execution_options(yield_per=batch_size)
+    )
+    for chunk in iter_chunks(result, batch_size):
+        notify_deleted(db, [ResourceRow(*r) for r in chunk])
+        archived += len(chunk)
+
+    archive = ARCHIVE_PREFIX + name
+    conn.execute(text(f"ALTER TABLE {TYPE_PARTITIONS['Observation']} DETACH PARTITION {name}"))
+    conn.execute(text(f"ALTER TABLE {name} RENAME TO {archive}"))
+    if _known_months is not None:
+        _known_months.discard(month)
+    logger.info(f"[PARTITION] {archived} Observation di {month:%Y-%m} archiviate in {archive}")
+    return {"month": f"{month:%Y-%m}", "archived_table": archive, "archived_count": archived}
+
+
+# --- migrazione -----------------------------------------------------------------
+
+def _create_partitioned_table(conn: Connection, name: str) -> None:
+    conn.execute(text(
+        f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS INCLUDING GENERATED) "
+        f"PARTITION BY LIST (resource_type)"
+    ))
+    conn.execute(text(f"ALTER TABLE {name} ADD CONSTRAINT {TABLE}_part_pkey "
+                      f"PRIMARY KEY (id, resource_type, partition_date)"))
+    for resource_type, partition in TYPE_PARTITIONS.items():
+        conn.execute(text(
+            f"CREATE TABLE {partition} PARTITION OF {name} FOR VALUES IN ('{resource_type}')"
+            + (" PARTITION BY RANGE (partition_date)" if resource_type == "Observation" else "")
+        ))
+    conn.execute(text(f"CREATE TABLE {OBSERVATION_DEFAULT} PARTITION OF {TYPE_PARTITIONS['Observation']} DEFAULT"))
+    conn.execute(text(f"CREATE TABLE {OTHER_PARTITION} PARTITION OF {name} DEFAULT"))
+
+
+def _create_natural_keys(conn: Connection) -> None:
+    # Stessi nomi degli indici di NATURAL_KEY_INDEXES, ma sulle partizioni dei singoli tipi;
+    # le Observation usano fhir_resources_observation_keys (unicità su tutti i mesi)
+    keys = {
+        f"uq_{TABLE}_patient_identifier": (TYPE_PARTITIONS["Patient"], "identifier_value"),
+        f"uq_{TABLE}_encounter_identifier": (TYPE_PARTITIONS["Encounter"], "identifier_value"),
+        f"uq_{TABLE}_condition_key": (
+            TYPE_PARTITIONS["Condition"],
+            "subject_identifier, code_value, COALESCE(content ->> 'onsetDateTime', '')",
+        ),
+    }
+    for name, (table, columns) in keys.items():
+        try:
+            with conn.begin_nested():
+                conn.execute(text(f"CREATE UNIQUE INDEX {name} ON {table} ({columns})"))
+        except DBAPIError as e:
+            logger.error(f"Indice {name} non creato, rimuovere prima i duplicati esistenti: {e.orig}")
+
+
+def migrate_to_partitioned(conn: Connection) -> None:
+    """
+    Converte fhir_resources nel layout partizionato, nella transazione di `conn`.
+    Gli indici secondari esistenti (modello, GIN su content, ...) sono ricreati sulla tabella partizionata.
+    """
+    global _partitioned, _known_months
+    new_table = f"{TABLE}_partitioned"
+    logger.info("[PARTITION] Migrazione di fhir_resources al layout partizionato")
+
+    indexes = conn.execute(text(
+        "SELECT indexname, indexdef FROM pg_indexes "
+        "WHERE schemaname = current_schema() AND tablename = :t AND indexname <> ALL(:skip)"
+    ), {"t": TABLE, "skip": [f"{TABLE}_pkey"] + [index.name for index in NATURAL_KEY_INDEXES]}).all()
+
+    _create_partitioned_table(conn, new_table)
+    months = conn.execute(text(
+        f"SELECT DISTINCT {PARTITION_DATE_SQL} FROM {TABLE} WHERE resource_type = 'Observation'"
+    )).scalars()
+    for month in months:
+        if month != EPOCH:
+            conn.execute(text(_create_partition_sql(month)))
+
+    copied = conn.execute(text(
+        f"INSERT INTO {new_table} (id, resource_type, content, last_updated, partition_date) "
+        f"SELECT id, resource_type, content, last_updated, {PARTITION_DATE_SQL} FROM {TABLE}"
+    )).rowcount
+
+    # La FK dell'indice di ricerca richiederebbe un id unico su tutta la tabella partizionata
+    conn.execute(text("ALTER TABLE fhir_search_index DROP CONSTRAINT IF EXISTS fhir_search_index_resource_id_fkey"))
+    conn.execute(text(f"DROP TABLE {TABLE}"))
+    conn.execute(text(f"ALTER TABLE {new_table} RENAME TO {TABLE}"))
+    conn.execute(text(f"ALTER TABLE {TABLE} RENAME CONSTRAINT {TABLE}_part_pkey TO {TABLE}_pkey"))
+    for name, definition in indexes:
+        conn.execute(text(definition))
+    _create_natural_keys(conn)
+
+    _partitioned, _known_months = True, None
+    ensure_observation_keys(conn)
+    logger.info(f"[PARTITION] {copied} risorse copiate nel layout partizionato")
+
+
+def ensure_partitioning(conn: Connection) -> None:
+    """
+    Applica la migrazione se richiesta e crea le partizioni mensili dei prossimi mesi.
+    Il layout partizionato resta attivo anche se FHIR_PARTITIONED viene disattivato.
+    """
+    global _partitioned, _known_months
+    # Processi avviati insieme: il primo converte la tabella, gli altri attendono e la trovano partizionata
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": MIGRATION_LOCK})
+    _partitioned = None
+    if FHIR_PARTITIONED and not is_partitioned(conn):
+        migrate_to_partitioned(conn)
+    if is_partitioned(conn):
+        ensure_observation_keys(conn)
+        month = date.today().replace(day=1)
+        # Sulla connessione della migrazione: la tabella appena convertita non è visibile ad altre connessioni
+        for _ in range(FHIR_PARTITION_MONTHS_AHEAD + 1):
+            try:
+                with conn.begin_nested():
+                    conn.execute(text(_create_partition_sql(month)))
+            except DBAPIError as e:
+                logger.error(f"[PARTITION] Partizione {observation_partition(month)} non creata: {e.orig}")
+            month = _next_month(month)
+        _known_months = None
@@ -0,0 +1,183 @@
+"""
+Indice in memoria dei Patient esistenti, per le verifiche referenziali dei job di ingestion.
+
+Al primo blocco il job carica in streaming gli identifier (CF pseudonimizzati: SHA-256 / HMAC in esadecimale)
+ordinati, e li conserva come digest da 32 byte contigui in un unico buffer: la ricerca è binaria,
+senza un oggetto Python per paziente (≈32 byte a paziente contro ≈100 di un set di stringhe).
+Gli identifier in un altro formato e i Patient inseriti durante il job finiscono in un set di appoggio.
+Un identifier non trovato viene verificato sul database (Patient scritti da altri processi dopo il caricamento):
+l'indice non produce mai falsi negativi, e le query restano solo per i riferimenti mancanti.
+Oltre INGEST_PATIENT_INDEX_MAX pazienti l'indice non viene creato e si usano le query per blocco.
+"""
+import bisect
+import logging
+import os
+import sys
+import time
+from typing import Iterable, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.models.fhir_resource import FhirResource
+from app.models.resource_count import ResourceCount
+
+logger = logging.getLogger(__name__)
+
+INGEST_PATIENT_INDEX = os.getenv("INGEST_PATIENT_INDEX", "true").lower() in ("1", "true", "yes")
+INGEST_PATIENT_INDEX_MAX = int(os.getenv("INGEST_PATIENT_INDEX_MAX", "10000000"))
+PATIENT_INDEX_BATCH_SIZE = 10000
+
+DIGEST_SIZE = 32
+
+
+def _digest(identifier: str) -> Optional[bytes]:
+    """
+    Digest binario di un identifier esadecimale da 64 caratteri minuscoli, None per altri formati.
+    """
+    if len(identifier) != 2 * DIGEST_SIZE or identifier.lower() != identifier:
+        return None
+    try:
+        return bytes.fromhex(identifier)
+    except ValueError:
+        return None
+
+
+class _Records:
+    """
+    Vista di un buffer come sequenza di record da DIGEST_SIZE byte (per bisect).
+    """
+
+    def __init__(self, buf: bytes):
+        self._buf = buf
+        self._len = len(buf) // DIGEST_SIZE
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __getitem__(self, i: int) -> bytes:
+        start = i * DIGEST_SIZE
+        return self._buf[start:start + DIGEST_SIZE]
+
+
+class PatientIndex:
+    def __init__(self, digests: bytes, extra: set[str], load_seconds: float = 0.0):
+        self._digests = digests
+        self._records = _Records(digests)
+        self._extra = extra
+        self.load_seconds = load_seconds
+        self.lookups = 0
+        self.hits = 0
+        self.db_checks = 0
+        self.added = 0
+        self._lookup_seconds = 0.0
+
+    @classmethod
+    def load(cls, db: Session, batch_size: int = PATIENT_INDEX_BATCH_SIZE) -> "PatientIndex":
+        """
+        Legge gli identifier dei Patient in streaming, già ordinati dal database (COLLATE "C": ordine dei byte).
+        """
+        started = time.perf_counter()
+        digests, extra = bytearray(), set()
+        ordered, last = True, b""
+        result = db.execute(
+            select(FhirResource.identifier_value)
+            .where(FhirResource.resource_type == "Patient", FhirResource.identifier_value.is_not(None))
+            .order_by(FhirResource.identifier_value.collate("C"))
+            .execution_options(yield_per=batch_size)
+        )
+        for partition in result.partitions():
+            for (identifier,) in partition:
+                digest = _digest(identifier)
+                if digest is None:
+                    extra.add(identifier)
+                    continue
+                ordered = ordered and digest >= last
+                last = digest
+                digests += digest
+        if not ordered:
+            records = _Records(bytes(digests))
+            digests = b"".join(sorted(records[i] for i in range(len(records))))
+        # Copia immutabile: le slice di bytes non richiedono una seconda conversione
+        index = cls(bytes(digests), extra, time.perf_counter() - started)
+        logger.info(
+            f"[PATIENT-INDEX] {len(index)} Patient caricati in {index.load_seconds:.2f}s "
+            f"({index.memory_bytes() / 1024 / 1024:.1f} MiB)"
+        )
+        return index
+
+    def __len__(self) -> int:
+        return len(self._records) + len(self._extra)
+
+    def _contains(self, identifier: str) -> bool:
+        digest = _digest(identifier)
+        if digest is not None:
+            i = bisect.bisect_left(self._records, digest)
+            if i < len(self._records) and self._records[i] == digest:
+                return True
+        return identifier in self._extra
+
+    def add(self, identifiers: Iterable[str]) -> None:
+        """
+        Registra i Patient inseriti durante il job.
+        """
+        for identifier in identifiers:
+            if identifier and not self._contains(identifier):
+                self._extra.add(identifier)
+                self.added += 1
+
+    def existing(self, db: Session, identifiers: set) -> set:
+        """
+        Sottoinsieme degli identifier presenti come Patient; i mancanti sono verificati con una sola query.
+        """
+        identifiers = {i for i in identifiers if i}
+        started = time.perf_counter()
+        found = {i for i in identifiers if self._contains(i)}
+        self._lookup_seconds += time.perf_counter() - started
+        self.lookups += len(identifiers)
+        self.hits += len(found)
+        missing = identifiers - found
+        if missing:
+            self.db_checks += len(missing)
+            rows = db.execute(
+                select(FhirResource.identifier_value)
+                .where(FhirResource.resource_type == "Patient", FhirResource.identifier_value.in_(missing))
+            ).scalars().all()
+            self.add(rows)
+            found.update(rows)
+        return found
+
+    def memory_bytes(self) -> int:
+        return (
+            sys.getsizeof(self._digests)
+            + sys.getsizeof(self._extra)
+            + sum(sys.getsizeof(i) for i in self._extra)
+        )
+
+    def stats(self) -> dict:
+        return {
+            "patients": len(self),
+            "memory_bytes": self.memory_bytes(),
+            "load_seconds": round(self.load_seconds, 3),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "db_checks": self.db_checks,
+            "added": self.added,
+            "lookups_per_second": round(self.lookups / self._lookup_seconds) if self._lookup_seconds else None,
+        }
+
+
+def load_patient_index(db: Session) -> Optional[PatientIndex]:
+    """
+    Indice per un job, se abilitato e se il numero di Patient (da fhir_resource_counts) è entro il limite.
+    """
+    if not INGEST_PATIENT_INDEX:
+        return None
+    count = db.execute(
+        select(func.coalesce(func.sum(ResourceCount.count), 0)).where(ResourceCount.resource_type == "Patient")
+    ).scalar()
+    if count > INGEST_PATIENT_INDEX_MAX:
+        logger.info(f"[PATIENT-INDEX] {count} Patient oltre il limite {INGEST_PATIENT_INDEX_MAX}: verifiche su database")
+        return None
+    return PatientIndex.load(db)
+
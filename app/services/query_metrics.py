@@ -0,0 +1,60 @@
+"""
+Hook SQLAlchemy sull'engine per il conteggio e la durata delle query,
+per tipo di statement e route chiamante, e per le statistiche della richiesta corrente.
+"""
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.utils import metrics
+from app.utils.request_context import current_request_stats, current_route
+
+QUERY_DURATION = metrics.histogram(
+    "db_query_duration_seconds", "Durata delle query SQL", ("engine", "route", "statement")
+)
+QUERY_ERRORS = metrics.counter(
+    "db_query_errors_total", "Query SQL terminate con errore", ("engine", "route", "statement")
+)
+
+_STATEMENT_KINDS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "BEGIN", "COMMIT", "ROLLBACK",
+                    "CREATE", "ALTER", "DROP", "TRUNCATE", "LOCK", "SET", "SHOW"}
+
+
+def statement_kind(statement: str) -> str:
+    head = statement.lstrip().split(None, 1)
+    kind = head[0].upper() if head else ""
+    return kind if kind in _STATEMENT_KINDS else "OTHER"
+
+
+def _finish(context, engine_name: str, failed: bool) -> None:
+    start = getattr(context, "_metrics_started", None)
+    if start is None:
+        return
+    context._metrics_started = None
+    elapsed = time.perf_counter() - start
+    labels = {"engine": engine_name, "route": current_route(), "statement": statement_kind(context.statement or "")}
+    QUERY_DURATION.observe(elapsed, **labels)
+    if failed:
+        QUERY_ERRORS.inc(**labels)
+    stats = current_request_stats()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+def instrument_queries(engine: Engine, name: str) -> None:
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            _finish(context, name, failed=False)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        if exception_context.execution_context is not None:
+            _finish(exception_context.execution_context, name, failed=True)
@@ -0,0 +1,99 @@
+"""
+Contatori per tipo di risorsa (fhir_resource_counts).
+
+Gli inserimenti e le eliminazioni applicano un delta al contatore del tipo nella stessa transazione,
+quindi la lettura di tutti i contatori con una sola SELECT è coerente con i dati committati.
+In alternativa la modalità stimata usa le statistiche del planner (pg_class / pg_stats), senza toccare le tabelle.
+"""
+import logging
+from collections import Counter
+from typing import Optional
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.fhir_resource import FhirResource
+from app.models.resource_count import ResourceCount
+from app.services.resource_events import ResourceRow, on_cleared, on_deleted, on_written
+
+logger = logging.getLogger(__name__)
+
+
+def apply_count_deltas(conn: Connection, deltas: Counter) -> None:
+    values = [{"resource_type": t, "count": d} for t, d in sorted(deltas.items()) if d]
+    if not values:
+        return
+    stmt = insert(ResourceCount).values(values)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=[ResourceCount.resource_type],
+        set_={"count": ResourceCount.count + stmt.excluded.count},
+    ))
+
+
+@on_written
+def _count_written(conn: Connection, rows: list[ResourceRow], previous: list) -> None:
+    # Solo gli inserimenti cambiano i conteggi (previous None); gli aggiornamenti no
+    apply_count_deltas(conn, Counter(r.resource_type for r, p in zip(rows, previous) if p is None))
+
+
+@on_deleted
+def _count_deleted(conn: Connection, rows: list[ResourceRow]) -> None:
+    deltas = Counter()
+    deltas.subtract(r.resource_type for r in rows)
+    apply_count_deltas(conn, deltas)
+
+
+@on_cleared
+def _count_cleared(conn: Connection, resource_type: Optional[str]) -> None:
+    stmt = delete(ResourceCount)
+    if resource_type is not None:
+        stmt = stmt.where(ResourceCount.resource_type == resource_type)
+    conn.execute(stmt)
+
+
+async def exact_counts(db: AsyncSession) -> dict[str, int]:
+    """
+    Conteggi mantenuti, letti con un'unica query.
+    """
+    rows = await db.execute(select(ResourceCount.resource_type, ResourceCount.count))
+    return {t: int(c) for t, c in rows}
+
+
+async def estimated_counts(db: AsyncSession) -> Optional[dict[str, int]]:
+    """
+    Stima da pg_class.reltuples e dalle frequenze dei valori più comuni di resource_type in pg_stats.
+    None se la tabella non è ancora stata analizzata.
+    """
+    row = (await db.execute(text(
+        "SELECT c.reltuples, s.most_common_vals::text::text[], s.most_common_freqs "
+        "FROM pg_class c "
+        "LEFT JOIN pg_stats s ON s.schemaname = current_schema() "
+        "AND s.tablename = c.relname AND s.attname = 'resource_type' "
+        "WHERE c.relname = 'fhir_resources' AND c.relnamespace = current_schema()::regnamespace"
+    ))).first()
+    if row is None or row[0] is None or row[0] < 0 or row[1] is None:
+        return None
+    total, values, freqs = row
+    return {value: int(round(total * freq)) for value, freq in zip(values, freqs)}
+
+
+def resync_counts(db: Session) -> dict[str, int]:
+    """
+    Ricalcola i contatori con un unico GROUP BY su fhir_resources e li sostituisce.
+    La tabella dei contatori è bloccata per evitare delta concorrenti persi durante il ricalcolo.
+    """
+    db.execute(text(f"LOCK TABLE {ResourceCount.__tablename__} IN EXCLUSIVE MODE"))
+    counts = {
+        t: int(c) for t, c in db.execute(
+            select(FhirResource.resource_type, func.count()).group_by(FhirResource.resource_type)
+        )
+    }
+    db.execute(delete(ResourceCount))
+    if counts:
+        db.execute(insert(ResourceCount), [{"resource_type": t, "count": c} for t, c in counts.items()])
+    db.commit()
+    logger.info(f"[COUNTS] Contatori risincronizzati: {counts}")
+    return counts
@@ -0,0 +1,152 @@
+"""
+Notifiche di scrittura sulle risorse FHIR.
+
+I sottosistemi derivati (indice di ricerca, aggregati, contatori, cache) si registrano
+qui e vengono aggiornati nella stessa transazione della scrittura:
+  - le scritture ORM (db.add / modifica di content / db.delete) sono intercettate
+    automaticamente dall'evento after_flush della Session;
+  - le scritture bulk (INSERT multi-riga, DELETE/TRUNCATE per tipo) devono chiamare
+    esplicitamente notify_written / notify_deleted / notify_cleared.
+I listener on_committed sono invece chiamati dopo il COMMIT della Session che ha scritto,
+con l'insieme dei tipi modificati (None = tutti): servono a ciò che vive fuori dal database (cache).
+"""
+import logging
+from typing import Callable, NamedTuple, Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.models.fhir_resource import FhirResource
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceRow(NamedTuple):
+    id: str
+    resource_type: str
+    content: dict
+
+
+_written: list[Callable] = []
+_deleted: list[Callable] = []
+_cleared: list[Callable] = []
+_committed: list[Callable] = []
+
+# Chiave in Session.info dei tipi di risorsa modificati nella transazione corrente
+_CHANGED_TYPES = "fhir_changed_types"
+
+
+def on_written(func: Callable[[Connection, list[ResourceRow], list[Optional[ResourceRow]]], None]):
+    """
+    Registra un listener per risorse inserite o aggiornate.
+    Riceve le righe nuove e, in parallelo, le versioni precedenti (None se inserite).
+    """
+    _written.append(func)
+    return func
+
+
+def on_deleted(func: Callable[[Connection, list[ResourceRow]], None]):
+    """
+    Registra un listener per risorse eliminate singolarmente.
+    """
+    _deleted.append(func)
+    return func
+
+
+def on_cleared(func: Callable[[Connection, Optional[str]], None]):
+    """
+    Registra un listener per lo svuotamento di un tipo di risorsa (None = tutte).
+    """
+    _cleared.append(func)
+    return func
+
+
+def on_committed(func: Callable[[set[Optional[str]]], None]):
+    """
+    Registra un listener chiamato dopo il commit di una transazione che ha scritto risorse.
+    """
+    _committed.append(func)
+    return func
+
+
+def _connection(db: Session | Connection) -> Connection:
+    return db.connection() if isinstance(db, Session) else db
+
+
+def _mark_changed(db: Session | Connection, resource_types) -> None:
+    if isinstance(db, Session):
+        db.info.setdefault(_CHANGED_TYPES, set()).update(resource_types)
+
+
+def notify_written(db: Session | Connection, rows: list[ResourceRow],
+                   previous: Optional[list[Optional[ResourceRow]]] = None) -> None:
+    if not rows:
+        return
+    conn = _connection(db)
+    _mark_changed(db, {r.resource_type for r in rows})
+    previous = previous or [None] * len(rows)
+    for listener in _written:
+        listener(conn, rows, previous)
+
+
+def notify_deleted(db: Session | Connection, rows: list[ResourceRow]) -> None:
+    if not rows:
+        return
+    conn = _connection(db)
+    _mark_changed(db, {r.resource_type for r in rows})
+    for listener in _deleted:
+        listener(conn, rows)
+
+
+def notify_cleared(db: Session | Connection, resource_type: Optional[str] = None) -> None:
+    conn = _connection(db)
+    _mark_changed(db, {resource_type})
+    for listener in _cleared:
+        listener(conn, resource_type)
+
+
+def _row(obj: FhirResource, content: dict) -> ResourceRow:
+    return ResourceRow(obj.id, obj.resource_type, content)
+
+
+@event.listens_for(Session, "after_flush")
+def _dispatch_orm_writes(session: Session, flush_context) -> None:
+    written, previous, deleted = [], [], []
+
+    for obj in session.new:
+        if isinstance(obj, FhirResource):
+            written.append(_row(obj, obj.content))
+            previous.append(None)
+
+    for obj in session.dirty:
+        if not isinstance(obj, FhirResource):
+            continue
+        history = inspect(obj).attrs.content.history
+        if not history.has_changes():
+            continue
+        old = history.deleted[0] if history.deleted else None
+        written.append(_row(obj, obj.content))
+        previous.append(_row(obj, old) if old is not None else None)
+
+    for obj in session.deleted:
+        if isinstance(obj, FhirResource):
+            deleted.append(_row(obj, obj.content))
+
+    if written:
+        notify_written(session, written, previous)
+    if deleted:
+        notify_deleted(session, deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_committed(session: Session) -> None:
+    changed = session.info.pop(_CHANGED_TYPES, None)
+    if not changed:
+        return
+    for listener in _committed:
+        try:
+            listener(changed)
+        except Exception as e:
+            # Il commit è già avvenuto: un errore qui non deve propagarsi alla richiesta
+            logger.error(f"[EVENTS] Listener on_committed fallito: {e}")
@@ -0,0 +1,276 @@
+"""
+Cache delle risposte JSON degli endpoint di sola lettura (dashboard).
+
+Le voci sono indicizzate da endpoint + parametri di query normalizzati e da un contatore di versione,
+incrementato dopo ogni commit che scrive risorse FHIR (CRUD, CSV, JSON bulk, reset_database).
+Backend disponibili (variabile RESPONSE_CACHE_BACKEND):
+  - memory: LRU con TTL nel processo (default, adatto a un singolo worker);
+  - sqlite: file locale condiviso tra i worker uvicorn della stessa macchina (negli endpoint async
+    le sue chiamate sono eseguite nel threadpool);
+  - off: cache disabilitata (restano ETag e 304).
+"""
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+from app.services.resource_events import on_committed
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "512"))
+CACHE_SQLITE_PATH = os.getenv("RESPONSE_CACHE_PATH", "app/cache/response_cache.sqlite3")
+# max-age=0: il browser conserva la risposta ma la rivalida sempre con If-None-Match
+CACHE_CONTROL = os.getenv("RESPONSE_CACHE_CONTROL", "private, max-age=0, must-revalidate")
+# Il backend sqlite esegue I/O sincrono (con attese sul lock del file): negli endpoint async va nel threadpool
+CACHE_OFFLOAD = CACHE_BACKEND == "sqlite"
+
+
+class CacheEntry(NamedTuple):
+    body: bytes
+    etag: str
+
+
+class MemoryCacheBackend:
+    """
+    LRU con scadenza per voce, protetta da lock (gli endpoint sync girano nel threadpool).
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, CacheEntry]] = OrderedDict()
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def version(self) -> int:
+        return self._version
+
+    def bump(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, entry = item
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SqliteCacheBackend:
+    """
+    Cache su file SQLite (WAL) condivisa tra i processi: anche il contatore di versione
+    è nel file, quindi una scrittura in un worker invalida la cache di tutti.
+    """
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, ttl: float = CACHE_TTL,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "key TEXT PRIMARY KEY, body BLOB NOT NULL, etag TEXT NOT NULL, expires REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache_entries(expires)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS cache_version (id INTEGER PRIMARY KEY, value INTEGER NOT NULL)")
+            self._conn.execute("INSERT OR IGNORE INTO cache_version (id, value) VALUES (1, 0)")
+
+    def version(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT value FROM cache_version WHERE id = 1").fetchone()[0]
+
+    def bump(self) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute("UPDATE cache_version SET value = value + 1 WHERE id = 1")
+            self._conn.execute("DELETE FROM cache_entries")
+            self._conn.execute("COMMIT")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT body, etag FROM cache_entries WHERE key = ? AND expires >= ?", (key, time.time())
+            ).fetchone()
+        return CacheEntry(*row) if row else None
+
+    def set(self, key: str, entry: CacheEntry) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, body, etag, expires) VALUES (?, ?, ?, ?)",
+                (key, entry.body, entry.etag, now + self.ttl),
+            )
+            self._conn.execute("DELETE FROM cache_entries WHERE expires < ?", (now,))
+            # Oltre la dimensione massima si scartano le voci più vicine alla scadenza (le più vecchie)
+            self._conn.execute(
+                "DELETE FROM cache_entries WHERE key IN ("
+                "SELECT key FROM cache_entries ORDER BY expires DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.execute("COMMIT")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_cache_backend():
+    """
+    Backend configurato, creato alla prima richiesta (None se la cache è disabilitata).
+    """
+    global _backend
+    if _backend is None and CACHE_BACKEND != "off":
+        with _backend_lock:
+            if _backend is None:
+                if CACHE_BACKEND == "sqlite":
+                    _backend = SqliteCacheBackend()
+                else:
+                    _backend = MemoryCacheBackend()
+    return _backend
+
+
+def invalidate_cache() -> None:
+    backend = get_cache_backend()
+    if backend is not None:
+        backend.bump()
+
+
+@on_committed
+def _invalidate_on_commit(resource_types: set) -> None:
+    invalidate_cache()
+
+
+def cache_key(version: int, request: Request) -> str:
+    """
+    Chiave: versione + path + parametri di query ordinati (l'ordine nella URL non conta).
+    """
+    params = "&".join(f"{k}={v}" for k, v in sorted(request.query_params.multi_items()))
+    return f"{version}:{request.url.path}?{params}"
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [c.strip() for c in header.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+
+def _render(result) -> Optional[bytes]:
+    """
+    Serializza il risultato come farebbe JSONResponse; None se non è una risposta JSON 200 cacheabile.
+    """
+    if isinstance(result, Response):
+        if result.status_code != 200 or result.media_type != "application/json":
+            return None
+        return bytes(result.body)
+    return json.dumps(
+        jsonable_encoder(result), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _response(request: Request, entry: CacheEntry, status: str) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": CACHE_CONTROL, "X-Cache": status}
+    if _etag_matches(request, entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+
+def cached_response(func):
+    """
+    Decoratore per endpoint GET (sync o async) che restituiscono JSON: serve le risposte dalla cache,
+    aggiunge ETag/Cache-Control e risponde 304 alle GET condizionali.
+    Se l'endpoint non dichiara già un parametro Request, ne viene aggiunto uno alla firma vista da FastAPI.
+    """
+    signature = inspect.signature(func)
+    request_param = next(
+        (name for name, p in signature.parameters.items() if p.annotation is Request), None
+    )
+    if request_param is None:
+        request_param = "request"
+        signature = signature.replace(parameters=[
+            inspect.Parameter(request_param, inspect.Parameter.KEYWORD_ONLY, annotation=Request),
+            *[p.replace(kind=inspect.Parameter.KEYWORD_ONLY) for p in signature.parameters.values()],
+        ])
+        own_request = False
+    else:
+        own_request = True
+
+    def lookup(kwargs) -> tuple:
+        request = kwargs[request_param] if own_request else kwargs.pop(request_param)
+        backend = get_cache_backend()
+        # Versione letta prima del calcolo: se nel frattempo arriva una scrittura, la voce resta orfana
+        key = cache_key(backend.version(), request) if backend else None
+        entry = backend.get(key) if backend else None
+        return request, backend, key, entry
+
+    def store(request: Request, backend, key: Optional[str], result):
+        body = _render(result)
+        if body is None:
+            return result
+        entry = CacheEntry(body, _etag(body))
+        if backend:
+            backend.set(key, entry)
+        return _response(request, entry, "MISS")
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if CACHE_OFFLOAD:
+                request, backend, key, entry = await run_in_threadpool(lookup, kwargs)
+            else:
+                request, backend, key, entry = lookup(kwargs)
+            if entry is not None:
+                return _response(request, entry, "HIT")
+            result = await func(*args, **kwargs)
+            if CACHE_OFFLOAD:
+                return await run_in_threadpool(store, request, backend, key, result)
+            return store(request, backend, key, result)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            request, backend, key, entry = lookup(kwargs)
+            if entry is not None:
+                return _response(request, entry, "HIT")
+            return store(request, backend, key, func(*args, **kwargs))
+
+    wrapper.__signature__ = signature
+    return wrapper
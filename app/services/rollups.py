@@ -0,0 +1,270 @@
+"""
+Aggregati epidemiologici giornalieri (epi_daily_rollup).
+
+Per ogni risorsa scritta si calcola la chiave (tipo, giorno, codice, provincia, sesso, fascia d'età)
+e si applica un delta al contatore corrispondente nella stessa transazione della scrittura.
+Le dimensioni del paziente (provincia, sesso, età) delle risorse cliniche sono quelle del Patient
+referenziato: quando un Patient viene scritto o eliminato le risorse che lo referenziano sono
+ricollocate sulle nuove chiavi, così che l'eliminazione di una risorsa sottragga sempre dalla chiave
+su cui era stata contata.
+"""
+import logging
+import re
+from collections import Counter
+from datetime import date
+from typing import Iterable, NamedTuple, Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.models.fhir_resource import FhirResource
+from app.models.rollup import EpiRollup
+from app.services.resource_events import ResourceRow, on_cleared, on_deleted, on_written
+from app.utils.streaming import iter_chunks
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TYPES = ("Patient", "Encounter", "Observation", "Condition")
+CLINICAL_TYPES = ROLLUP_TYPES[1:]
+
+# Data dell'evento da cui si ricava il giorno dell'aggregato
+EVENT_DATES = {
+    "Condition": lambda c: c.get("recordedDate"),
+    "Encounter": lambda c: (c.get("period") or {}).get("start"),
+    "Observation": lambda c: c.get("effectiveDateTime"),
+}
+
+_DAY = re.compile(r"^\d{4}-\d{2}-\d{2}")
+
+
+class RollupKey(NamedTuple):
+    resource_type: str
+    day: str
+    code: str
+    province: str
+    gender: str
+    age_band: str
+
+
+def _day(value) -> str:
+    if isinstance(value, str) and _DAY.match(value):
+        return value[:10]
+    return ""
+
+
+def _code(content: dict) -> str:
+    coding = (content.get("code") or {}).get("coding") or [{}]
+    return coding[0].get("code") or ""
+
+
+def _province(patient: dict) -> str:
+    address = patient.get("address") or [{}]
+    return address[0].get("district") or ""
+
+
+def age_band(birth_date, day: str) -> str:
+    """
+    Fascia d'età alla data dell'evento (stesse soglie della dashboard); vuota se non calcolabile.
+    """
+    if not day or not _day(birth_date):
+        return ""
+    try:
+        birth = date.fromisoformat(birth_date[:10])
+        event = date.fromisoformat(day)
+    except ValueError:
+        return ""
+    age = event.year - birth.year - ((event.month, event.day) < (birth.month, birth.day))
+    if age < 0:
+        return ""
+    if age < 18:
+        return "0-17"
+    if age < 40:
+        return "18-39"
+    if age < 65:
+        return "40-64"
+    return "65+"
+
+
+def _subject_identifier(content: dict) -> Optional[str]:
+    return ((content.get("subject") or {}).get("identifier") or {}).get("value")
+
+
+def _patient_identifier(content: dict) -> Optional[str]:
+    return ((content.get("identifier") or [{}])[0]).get("value")
+
+
+def _dimensions(patient: Optional[dict]) -> tuple:
+    patient = patient or {}
+    return _province(patient), patient.get("gender") or "", patient.get("birthDate")
+
+
+def _load_patients(conn: Connection, identifiers: set) -> dict:
+    if not identifiers:
+        return {}
+    rows = conn.execute(
+        select(FhirResource.identifier_value, FhirResource.content)
+        .where(FhirResource.resource_type == "Patient", FhirResource.identifier_value.in_(identifiers))
+    )
+    patients = {}
+    for identifier, content in rows:
+        patients.setdefault(identifier, content)
+    return patients
+
+
+def _load_dependents(conn: Connection, identifiers: set) -> list[ResourceRow]:
+    rows = conn.execute(
+        select(FhirResource.id, FhirResource.resource_type, FhirResource.content)
+        .where(FhirResource.resource_type.in_(CLINICAL_TYPES), FhirResource.subject_identifier.in_(identifiers))
+    )
+    return [ResourceRow(*r) for r in rows]
+
+
+def rollup_keys(conn: Connection, rows: Iterable[ResourceRow], patients: Optional[dict] = None) -> list[RollupKey]:
+    """
+    Calcola le chiavi di aggregazione delle risorse, con un'unica lettura dei Patient referenziati
+    (o con la mappa identifier -> Patient passata, per calcolare le chiavi di uno stato precedente).
+    """
+    rows = [r for r in rows if r.resource_type in ROLLUP_TYPES]
+    if patients is None:
+        patients = _load_patients(conn, {
+            _subject_identifier(r.content) for r in rows if r.resource_type != "Patient"
+        } - {None})
+
+    keys = []
+    for r in rows:
+        if r.resource_type == "Patient":
+            keys.append(RollupKey("Patient", "", "", _province(r.content), r.content.get("gender") or "", ""))
+            continue
+        day = _day(EVENT_DATES[r.resource_type](r.content))
+        patient = patients.get(_subject_identifier(r.content)) or {}
+        keys.append(RollupKey(
+            r.resource_type,
+            day,
+            _code(r.content),
+            _province(patient),
+            patient.get("gender") or "",
+            age_band(patient.get("birthDate"), day),
+        ))
+    return keys
+
+
+def _patient_deltas(conn: Connection, changes: list[tuple], rows: list[ResourceRow],
+                    previous: list[ResourceRow]) -> Counter:
+    """
+    Delta di una scrittura che modifica dei Patient (changes: coppie contenuto prima/dopo, None se assente).
+    Le righe scritte si contano con i Patient dopo la scrittura, le versioni precedenti con quelli di prima;
+    le altre risorse cliniche dei Patient con dimensioni cambiate passano dalla vecchia alla nuova chiave.
+    """
+    changed = {_patient_identifier(c) for change in changes for c in change if c is not None} - {None}
+    subjects = {_subject_identifier(r.content) for r in rows + previous if r.resource_type != "Patient"} - {None}
+    after = _load_patients(conn, changed | subjects)
+    before = dict(after)
+    for old, new in changes:
+        if new is not None:
+            before.pop(_patient_identifier(new), None)
+    for old, new in changes:
+        if old is not None and _patient_identifier(old):
+            before[_patient_identifier(old)] = old
+
+    deltas = Counter(rollup_keys(conn, rows, after))
+    deltas.subtract(rollup_keys(conn, previous, before))
+
+    changed = {i for i in changed if _dimensions(before.get(i)) != _dimensions(after.get(i))}
+    if changed:
+        written = {(r.resource_type, r.id) for r in rows + previous}
+        dependents = [r for r in _load_dependents(conn, changed) if (r.resource_type, r.id) not in written]
+        deltas.update(rollup_keys(conn, dependents, after))
+        deltas.subtract(rollup_keys(conn, dependents, before))
+    return deltas
+
+
+def apply_deltas(conn: Connection, deltas: Counter) -> None:
+    """
+    Somma i delta ai contatori con un unico INSERT ... ON CONFLICT DO UPDATE.
+    Le chiavi sono ordinate perché scritture concorrenti blocchino le righe nello stesso ordine.
+    """
+    values = [{**key._asdict(), "count": delta} for key, delta in sorted(deltas.items()) if delta]
+    if not values:
+        return
+    stmt = insert(EpiRollup).values(values)
+    conn.execute(stmt.on_conflict_do_update(
+        index_elements=list(RollupKey._fields),
+        set_={"count": EpiRollup.count + stmt.excluded.count},
+    ))
+
+
+@on_written
+def _rollup_written(conn: Connection, rows: list[ResourceRow], previous: list) -> None:
+    changes = [
+        (p.content if p is not None else None, r.content)
+        for r, p in zip(rows, previous) if r.resource_type == "Patient"
+    ]
+    previous = [p for p in previous if p is not None]
+    if changes:
+        apply_deltas(conn, _patient_deltas(conn, changes, rows, previous))
+        return
+    deltas = Counter(rollup_keys(conn, rows))
+    deltas.subtract(rollup_keys(conn, previous))
+    apply_deltas(conn, deltas)
+
+
+@on_deleted
+def _rollup_deleted(conn: Connection, rows: list[ResourceRow]) -> None:
+    changes = [(r.content, None) for r in rows if r.resource_type == "Patient"]
+    if changes:
+        apply_deltas(conn, _patient_deltas(conn, changes, [], rows))
+        return
+    deltas = Counter()
+    deltas.subtract(rollup_keys(conn, rows))
+    apply_deltas(conn, deltas)
+
+
+@on_cleared
+def _rollup_cleared(conn: Connection, resource_type: Optional[str]) -> None:
+    stmt = delete(EpiRollup)
+    if resource_type is not None:
+        stmt = stmt.where(EpiRollup.resource_type == resource_type)
+    conn.execute(stmt)
+    if resource_type == "Patient":
+        _drop_patient_dimensions(conn)
+
+
+def _drop_patient_dimensions(conn: Connection, batch_size: int = 2000) -> None:
+    """
+    Senza Patient le risorse cliniche restano senza provincia, sesso e fascia d'età: i contatori
+    sono accorpati sulle chiavi con le dimensioni del paziente vuote.
+    """
+    totals = conn.execute(
+        select(EpiRollup.resource_type, EpiRollup.day, EpiRollup.code, func.sum(EpiRollup.count))
+        .where(EpiRollup.resource_type.in_(CLINICAL_TYPES))
+        .group_by(EpiRollup.resource_type, EpiRollup.day, EpiRollup.code)
+    ).all()
+    conn.execute(delete(EpiRollup).where(EpiRollup.resource_type.in_(CLINICAL_TYPES)))
+    for chunk in iter_chunks(totals, batch_size):
+        apply_deltas(conn, Counter({
+            RollupKey(resource_type, day, code, "", "", ""): int(count)
+            for resource_type, day, code, count in chunk
+        }))
+
+
+def rebuild_rollups(db: Session, batch_size: int = 2000) -> int:
+    """
+    Ricalcola da zero gli aggregati leggendo fhir_resources in streaming.
+    """
+    totals = Counter()
+    result = db.execute(
+        select(FhirResource.id, FhirResource.resource_type, FhirResource.content)
+        .where(FhirResource.resource_type.in_(ROLLUP_TYPES))
+        .execution_options(yield_per=batch_size)
+    )
+    for chunk in iter_chunks(result, batch_size):
+        totals.update(rollup_keys(db.connection(), [ResourceRow(*r) for r in chunk]))
+
+    db.execute(delete(EpiRollup))
+    for chunk in iter_chunks(totals.items(), batch_size):
+        apply_deltas(db.connection(), Counter(dict(chunk)))
+    db.commit()
+    logger.info(f"[ROLLUP] Aggregati ricostruiti: {len(totals)} righe")
+    return len(totals)
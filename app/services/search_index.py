@@ -0,0 +1,443 @@
+"""
+Indice dei parametri di ricerca FHIR.
+
+Per ogni risorsa scritta vengono estratte righe tipizzate (token, date, quantity,
+reference, string) in fhir_search_index; le ricerche `GET /api/{type}?param=value`
+sono compilate in sottoquery indicizzate su questa tabella invece che in scansioni del JSONB.
+"""
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, InvalidOperation
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from sqlalchemy import and_, delete, insert, not_, or_, select, tuple_
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from app.models.fhir_resource import FhirResource
+from app.models.search_index import SearchIndexEntry
+from app.services.resource_events import ResourceRow, on_cleared, on_deleted, on_written
+from app.utils.streaming import iter_chunks
+
+logger = logging.getLogger(__name__)
+
+DATE_MIN = datetime(1, 1, 1, tzinfo=timezone.utc)
+DATE_MAX = datetime(9999, 12, 31, tzinfo=timezone.utc)
+
+
+class SearchParam(NamedTuple):
+    kind: str
+    extract: Callable[[dict], list]
+
+
+class SearchError(ValueError):
+    """Parametro o valore di ricerca non valido."""
+
+
+# --- estrazione dei valori -----------------------------------------------------
+
+def _list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _codings(concept) -> list[tuple]:
+    """
+    Ritorna le coppie (system, code) di un CodeableConcept, di una lista di concept o di un Coding.
+    """
+    out = []
+    for item in _list(concept):
+        if not isinstance(item, dict):
+            continue
+        if "coding" in item:
+            for c in _list(item.get("coding")):
+                if isinstance(c, dict) and c.get("code"):
+                    out.append((c.get("system"), c["code"]))
+        elif item.get("code"):
+            out.append((item.get("system"), item["code"]))
+    return out
+
+
+def _identifiers(value) -> list[tuple]:
+    return [
+        (i.get("system"), i["value"])
+        for i in _list(value)
+        if isinstance(i, dict) and i.get("value")
+    ]
+
+
+def _path(*keys):
+    def get(content: dict):
+        value = content
+        for key in keys:
+            if isinstance(value, list):
+                value = value[0] if value else None
+            if not isinstance(value, dict):
+                return None
+            value = value.get(key)
+        return value
+    return get
+
+
+def _token(getter, simple: bool = False):
+    # simple=True per i campi "code" FHIR (es. gender, status), senza system
+    if simple:
+        return lambda c: [(None, v) for v in _list(getter(c)) if isinstance(v, str) and v]
+    return lambda c: _codings(getter(c))
+
+
+def _reference(content_key: str):
+    def extract(content: dict) -> list[str]:
+        out = []
+        for ref in _list(content.get(content_key)):
+            if not isinstance(ref, dict):
+                continue
+            if ref.get("reference"):
+                out.append(ref["reference"])
+            ident = ref.get("identifier")
+            if isinstance(ident, dict) and ident.get("value"):
+                out.append(ident["value"])
+        return out
+    return extract
+
+
+def _address(field: str):
+    return lambda c: [a[field] for a in _list(c.get("address")) if isinstance(a, dict) and a.get(field)]
+
+
+def parse_fhir_date(value: str) -> tuple[datetime, datetime]:
+    """
+    Converte una data/dateTime FHIR nell'intervallo [inizio, fine) coperto dalla sua precisione.
+    """
+    value = value.strip()
+    if re.fullmatch(r"\d{4}", value):
+        start = datetime(int(value), 1, 1, tzinfo=timezone.utc)
+        return start, start.replace(year=start.year + 1) if start.year < 9999 else DATE_MAX
+    if re.fullmatch(r"\d{4}-\d{2}", value):
+        year, month = map(int, value.split("-"))
+        start = datetime(year, month, 1, tzinfo=timezone.utc)
+        end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+        return start, end
+    if re.fullmatch(r"\d{4}-\d{2}-\d{2}", value):
+        start = datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+        return start, start + timedelta(days=1)
+    start = datetime.fromisoformat(value)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    return start, start + timedelta(seconds=1)
+
+
+def _dates(getter):
+    def extract(content: dict) -> list[tuple]:
+        out = []
+        for v in _list(getter(content)):
+            if isinstance(v, str) and v:
+                out.append(parse_fhir_date(v))
+        return out
+    return extract
+
+
+def _period(key: str):
+    def extract(content: dict) -> list[tuple]:
+        period = content.get(key)
+        if not isinstance(period, dict):
+            return []
+        start = parse_fhir_date(period["start"])[0] if period.get("start") else DATE_MIN
+        end = parse_fhir_date(period["end"])[1] if period.get("end") else DATE_MAX
+        return [(start, end)]
+    return extract
+
+
+def _quantities(getter):
+    def extract(content: dict) -> list[tuple]:
+        out = []
+        for q in _list(getter(content)):
+            if isinstance(q, dict) and q.get("value") is not None:
+                out.append((Decimal(str(q["value"])), q.get("unit") or q.get("code"), q.get("system")))
+        return out
+    return extract
+
+
+_COMMON = {
+    "identifier": SearchParam("token", lambda c: _identifiers(c.get("identifier"))),
+}
+
+SEARCH_PARAMETERS: dict[str, dict[str, SearchParam]] = {
+    "Patient": {
+        **_COMMON,
+        "gender": SearchParam("token", _token(_path("gender"), simple=True)),
+        "birthdate": SearchParam("date", _dates(_path("birthDate"))),
+        "address-city": SearchParam("string", _address("city")),
+        "address-district": SearchParam("string", _address("district")),
+        "address-postalcode": SearchParam("string", _address("postalCode")),
+    },
+    "Encounter": {
+        **_COMMON,
+        "status": SearchParam("token", _token(_path("status"), simple=True)),
+        "class": SearchParam("token", _token(_path("class"))),
+        "date": SearchParam("date", _period("period")),
+        "subject": SearchParam("reference", _reference("subject")),
+    },
+    "Observation": {
+        **_COMMON,
+        "status": SearchParam("token", _token(_path("status"), simple=True)),
+        "code": SearchParam("token", _token(_path("code"))),
+        "date": SearchParam("date", _dates(_path("effectiveDateTime"))),
+        "value-quantity": SearchParam("quantity", _quantities(_path("valueQuantity"))),
+        "subject": SearchParam("reference", _reference("subject")),
+    },
+    "Condition": {
+        **_COMMON,
+        "code": SearchParam("token", _token(_path("code"))),
+        "clinical-status": SearchParam("token", _token(_path("clinicalStatus"))),
+        "verification-status": SearchParam("token", _token(_path("verificationStatus"))),
+        "recorded-date": SearchParam("date", _dates(_path("recordedDate"))),
+        "onset-date": SearchParam("date", _dates(_path("onsetDateTime"))),
+        "subject": SearchParam("reference", _reference("subject")),
+    },
+}
+
+_EMPTY_ENTRY = {
+    "system": None, "code": None, "text": None,
+    "date_start": None, "date_end": None, "number": None, "unit": None,
+}
+
+
+def extract_entries(resource_id: str, resource_type: str, content: dict) -> list[dict]:
+    """
+    Estrae le righe di indice di una risorsa. Valori malformati vengono ignorati (con log).
+    """
+    entries = []
+    for name, param in SEARCH_PARAMETERS.get(resource_type, {}).items():
+        try:
+            values = param.extract(content or {})
+        except (ValueError, TypeError, InvalidOperation) as e:
+            logger.warning(f"[SEARCH] Valore non indicizzabile {resource_type}/{resource_id} {name}: {e}")
+            continue
+        for value in values:
+            entry = {**_EMPTY_ENTRY, "resource_id": resource_id, "resource_type": resource_type,
+                     "param": name, "kind": param.kind}
+            if param.kind == "token":
+                entry["system"], entry["code"] = value
+            elif param.kind == "reference":
+                entry["code"] = value
+            elif param.kind == "string":
+                entry["code"], entry["text"] = value.lower(), value
+            elif param.kind == "date":
+                entry["date_start"], entry["date_end"] = value
+            elif param.kind == "quantity":
+                entry["number"], entry["unit"], entry["system"] = value
+            entries.append(entry)
+    return entries
+
+
+def _entries_of(rows: list[ResourceRow]):
+    # Per tipo e id: con fhir_resources partizionata lo stesso id può esistere in tipi diversi
+    # (il filtro sul solo id permette di usare l'indice su resource_id)
+    return and_(
+        SearchIndexEntry.resource_id.in_({r.id for r in rows}),
+        tuple_(SearchIndexEntry.resource_type, SearchIndexEntry.resource_id).in_(
+            [(r.resource_type, r.id) for r in rows]
+        ),
+    )
+
+
+def index_resources(conn: Connection, rows: Iterable[ResourceRow], replace: bool = True) -> int:
+    """
+    (Re)indicizza le risorse: elimina le righe precedenti e inserisce le nuove con un unico executemany.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    if replace:
+        conn.execute(delete(SearchIndexEntry).where(_entries_of(rows)))
+    entries = []
+    for r in rows:
+        entries.extend(extract_entries(r.id, r.resource_type, r.content))
+    if entries:
+        conn.execute(insert(SearchIndexEntry), entries)
+    return len(entries)
+
+
+@on_written
+def _index_written(conn: Connection, rows: list[ResourceRow], previous: list) -> None:
+    index_resources(conn, rows, replace=any(p is not None for p in previous))
+
+
+# Eliminazioni propagate dai listener e non da una FK: con fhir_resources partizionata l'id
+# non è unico sull'intera tabella e gli svuotamenti sono TRUNCATE di partizione
+@on_deleted
+def _index_deleted(conn: Connection, rows: list[ResourceRow]) -> None:
+    conn.execute(delete(SearchIndexEntry).where(_entries_of(rows)))
+
+
+@on_cleared
+def _index_cleared(conn: Connection, resource_type: Optional[str]) -> None:
+    stmt = delete(SearchIndexEntry)
+    if resource_type is not None:
+        stmt = stmt.where(SearchIndexEntry.resource_type == resource_type)
+    conn.execute(stmt)
+
+
+def rebuild_search_index(db: Session, batch_size: int = 2000) -> int:
+    """
+    Ricostruisce l'intero indice leggendo fhir_resources in streaming.
+    """
+    db.execute(delete(SearchIndexEntry))
+    total = 0
+    result = db.execute(
+        select(FhirResource.id, FhirResource.resource_type, FhirResource.content)
+        .execution_options(yield_per=batch_size)
+    )
+    for chunk in iter_chunks(result, batch_size):
+        total += index_resources(db.connection(), [ResourceRow(*r) for r in chunk], replace=False)
+    db.commit()
+    logger.info(f"[SEARCH] Indice ricostruito: {total} righe")
+    return total
+
+
+# --- compilazione delle ricerche ---------------------------------------------
+
+_PREFIXES = ("eq", "ne", "gt", "lt", "ge", "le", "sa", "eb", "ap")
+
+
+def _split_prefix(value: str) -> tuple[str, str]:
+    if len(value) > 2 and value[:2] in _PREFIXES and not value[2].isalpha():
+        return value[:2], value[2:]
+    return "eq", value
+
+
+def _token_clause(value: str):
+    if "|" in value:
+        system, code = value.split("|", 1)
+        clauses = []
+        if code:
+            clauses.append(SearchIndexEntry.code == code)
+        if system:
+            clauses.append(SearchIndexEntry.system == system)
+        else:
+            clauses.append(SearchIndexEntry.system.is_(None))
+        return and_(*clauses)
+    return SearchIndexEntry.code == value
+
+
+def _date_clause(value: str):
+    prefix, raw = _split_prefix(value)
+    try:
+        low, high = parse_fhir_date(raw)
+    except ValueError:
+        raise SearchError(f"Data non valida: {raw}")
+    start, end = SearchIndexEntry.date_start, SearchIndexEntry.date_end
+    clauses = {
+        "eq": and_(start >= low, end <= high),
+        "ap": and_(start < high, end > low),
+        "ne": or_(start < low, end > high),
+        "gt": end > high,
+        "lt": start < low,
+        "ge": end > low,
+        "le": start < high,
+        "sa": start >= high,
+        "eb": end <= low,
+    }
+    return clauses[prefix]
+
+
+def _quantity_clause(value: str):
+    number, _, unit = value.partition("|")
+    prefix, raw = _split_prefix(number)
+    try:
+        target = Decimal(raw)
+    except InvalidOperation:
+        raise SearchError(f"Quantità non valida: {raw}")
+    if not target.is_finite():
+        raise SearchError(f"Quantità non valida: {raw}")
+    # Per eq/ne/ap si usa l'intervallo implicito dato dalla precisione del valore (es. 5.4 → [5.35, 5.45))
+    half = Decimal(1).scaleb(target.as_tuple().exponent) / 2
+    num = SearchIndexEntry.number
+    clauses = {
+        "eq": and_(num >= target - half, num < target + half),
+        "ap": and_(num >= target * Decimal("0.9"), num <= target * Decimal("1.1")),
+        "ne": or_(num < target - half, num >= target + half),
+        "gt": num > target, "sa": num > target,
+        "lt": num < target, "eb": num < target,
+        "ge": num >= target,
+        "le": num <= target,
+    }
+    clause = clauses[prefix]
+    if unit:
+        system, _, code = unit.partition("|")
+        if code:
+            clause = and_(clause, SearchIndexEntry.unit == code)
+        if system:
+            clause = and_(clause, SearchIndexEntry.system == system)
+    return clause
+
+
+def _reference_clause(value: str):
+    return SearchIndexEntry.code == value
+
+
+def _string_clause(value: str, modifier: Optional[str]):
+    if modifier == "exact":
+        return SearchIndexEntry.text == value
+    needle = value.lower().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    if modifier == "contains":
+        return SearchIndexEntry.code.like(f"%{needle}%", escape="\\")
+    return SearchIndexEntry.code.like(f"{needle}%", escape="\\")
+
+
+def _param_condition(resource_type: str, name: str, value: str):
+    base, _, modifier = name.partition(":")
+    modifier = modifier or None
+
+    if base == "_id":
+        return FhirResource.id.in_(value.split(","))
+
+    param = SEARCH_PARAMETERS.get(resource_type, {}).get(base)
+    if not param:
+        raise SearchError(f"Parametro di ricerca non supportato per {resource_type}: {base}")
+
+    alternatives = []
+    for v in value.split(","):
+        if param.kind == "token":
+            alternatives.append(_token_clause(v))
+        elif param.kind == "date":
+            alternatives.append(_date_clause(v))
+        elif param.kind == "quantity":
+            alternatives.append(_quantity_clause(v))
+        elif param.kind == "reference":
+            alternatives.append(_reference_clause(v))
+        elif param.kind == "string":
+            alternatives.append(_string_clause(v, modifier))
+
+    matching = select(SearchIndexEntry.resource_id).where(
+        SearchIndexEntry.resource_type == resource_type,
+        SearchIndexEntry.param == base,
+        or_(*alternatives),
+    )
+    if modifier == "not" and param.kind == "token":
+        return not_(FhirResource.id.in_(matching))
+    return FhirResource.id.in_(matching)
+
+
+def search_conditions(resource_type: str, params: list[tuple[str, str]]) -> list:
+    """
+    Compila i parametri di ricerca in condizioni su fhir_resources (AND tra parametri, OR tra valori separati da virgola).
+    """
+    return [
+        _param_condition(resource_type, name, value)
+        for name, value in params
+        if value != ""
+    ]
+
+
+def compile_search(resource_type: str, params: list[tuple[str, str]]):
+    """
+    SELECT completa delle risorse che soddisfano i parametri di ricerca.
+    """
+    return (
+        select(FhirResource)
+        .where(FhirResource.resource_type == resource_type, *search_conditions(resource_type, params))
+    )
@@ -0,0 +1,68 @@
+"""
+Pool di processi per la fase CPU-bound dell'ingestion (pseudonimizzazione, trasformazione, validazione).
+
+Ogni blocco destinato al database viene suddiviso in shard da INGEST_SHARD_SIZE elementi,
+elaborati in parallelo da INGEST_WORKERS processi; i risultati tornano nell'ordine originale
+e la scrittura resta a un unico writer (la sessione della richiesta).
+Con INGEST_WORKERS=0 (default) l'elaborazione avviene nel thread chiamante, come prima.
+I processi sono avviati con forkserver: non ereditano thread, pool di connessioni e lock del server.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Optional
+
+from app.utils.streaming import iter_chunks
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+INGEST_SHARD_SIZE = int(os.getenv("INGEST_SHARD_SIZE", "100"))
+INGEST_START_METHOD = os.getenv("INGEST_START_METHOD", "forkserver")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_transform_pool() -> Optional[ProcessPoolExecutor]:
+    """
+    Pool configurato, creato al primo utilizzo (None se l'elaborazione parallela è disabilitata).
+    """
+    global _pool
+    if _pool is None and INGEST_WORKERS > 0:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=INGEST_WORKERS,
+                    mp_context=multiprocessing.get_context(INGEST_START_METHOD),
+                )
+                logger.info(f"Pool di trasformazione avviato con {INGEST_WORKERS} processi")
+    return _pool
+
+
+def shutdown_transform_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
+
+
+def _apply_shard(func: Callable, shard: list) -> list:
+    return [func(item) for item in shard]
+
+
+def map_ordered(func: Callable, items: Iterable, shard_size: int = INGEST_SHARD_SIZE) -> list:
+    """
+    [func(item) for item in items], eseguito sul pool se abilitato.
+    `func` deve essere una funzione di modulo (o un functools.partial di funzioni di modulo)
+    e i suoi argomenti e risultati devono essere serializzabili con pickle.
+    """
+    items = list(items)
+    pool = get_transform_pool()
+    if pool is None or len(items) <= shard_size:
+        return _apply_shard(func, items)
+    futures = [pool.submit(_apply_shard, func, shard) for shard in iter_chunks(items, shard_size)]
+    return [result for future in futures for result in future.result()]
@@ -1,12 +1,71 @@
-import hashlib
+"""
+Pseudonimizzazione degli identificativi (codice fiscale) e anonimizzazione dei Patient.
+
+Lo pseudonimo è lo SHA-256 esadecimale dell'identificativo oppure, se è impostato PSEUDONYM_PEPPER,
+un HMAC-SHA256 con il pepper come chiave segreta (non ricalcolabile da chi conosce solo il CF).
+Attenzione: attivare o cambiare il pepper cambia tutti gli pseudonimi, quindi va deciso prima del primo caricamento.
+Lo stesso CF ricorre in ogni Encounter/Observation/Condition del paziente: gli pseudonimi
+sono memorizzati in una LRU limitata (PSEUDONYM_CACHE_SIZE voci).
+"""
 import copy
+import functools
+import hashlib
+import hmac
+import os
+from typing import Iterable, Optional
+
+PSEUDONYM_PEPPER = os.getenv("PSEUDONYM_PEPPER", "")
+PSEUDONYM_CACHE_SIZE = int(os.getenv("PSEUDONYM_CACHE_SIZE", "100000"))
+
+
+class Pseudonymizer:
+    def __init__(self, pepper: Optional[str] = PSEUDONYM_PEPPER, cache_size: int = PSEUDONYM_CACHE_SIZE):
+        if pepper:
+            # Stato HMAC con la chiave già elaborata: per ogni valore si copia invece di ricalcolare i pad
+            self._hmac = hmac.new(pepper.encode("utf-8"), digestmod=hashlib.sha256)
+            digest = self._hmac_digest
+        else:
+            digest = self._sha256_digest
+        self.keyed = bool(pepper)
+        self.cache_size = cache_size
+        self._cached = functools.lru_cache(maxsize=cache_size)(digest) if cache_size > 0 else digest
+
+    @staticmethod
+    def _sha256_digest(value: str) -> str:
+        return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+    def _hmac_digest(self, value: str) -> str:
+        h = self._hmac.copy()
+        h.update(value.encode("utf-8"))
+        return h.hexdigest()
+
+    def pseudonymize(self, value: str) -> str:
+        return self._cached(value)
+
+    def pseudonymize_many(self, values: Iterable[str]) -> list[str]:
+        """
+        Pseudonimi di un'intera colonna (es. i CF di un blocco CSV): ogni valore distinto è calcolato una volta.
+        """
+        values = list(values)
+        distinct = {v: self._cached(v) for v in dict.fromkeys(values)}
+        return [distinct[v] for v in values]
+
+    def cache_info(self):
+        return self._cached.cache_info() if hasattr(self._cached, "cache_info") else None
+
+
+_default = Pseudonymizer()
+
+
+def get_pseudonymizer() -> Pseudonymizer:
+    return _default
 
 
 def hash_identifier(value: str) -> str:
     """
-    Hash SHA-256 di un identificatore (es. codice fiscale).
+    Pseudonimo di un identificatore (es. codice fiscale).
     """
-    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+    return _default.pseudonymize(value)
 
 
 def anonymize_patient(patient_data: dict) -> dict:
@@ -51,4 +110,5 @@ def anonymize_patient(patient_data: dict) -> dict:
 
     data.pop("name", None)
 
-    return data
\ No newline at end of file
+    return data
+
@@ -1,11 +1,8 @@
-import json
-import os
 from datetime import datetime
 from uuid import uuid4
 
-# Percorso file NDJSON
-AUDIT_LOG_PATH = "app/logs/audit.ndjson"
-os.makedirs(os.path.dirname(AUDIT_LOG_PATH), exist_ok=True)
+# Scrittura asincrona a blocchi su segmenti ruotati (AUDIT_LOG_PATH resta per compatibilità)
+from app.utils.audit_sink import AUDIT_LOG_PATH, get_audit_sink
 
 # Mappa di display leggibili per tipi di evento HL7
 DISPLAY_MAP = {
@@ -77,5 +74,5 @@ def log_audit_event(event_type: str, username: str, success: bool, ip: str = "un
             }
         ]
 
-    with open(AUDIT_LOG_PATH, "a") as f:
-        f.write(json.dumps(event) + "\n")
\ No newline at end of file
+    # Accodato al sink: la serializzazione e la scrittura avvengono nel thread di scrittura
+    get_audit_sink().submit(event)
\ No newline at end of file
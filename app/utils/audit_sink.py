@@ -0,0 +1,211 @@
+"""
+Sink asincrono degli AuditEvent.
+
+log_audit_event accoda l'evento in una coda limitata; un thread di scrittura in background
+raccoglie gli eventi in blocchi e li scrive quando il blocco è pieno o è trascorso l'intervallo di flush,
+tramite un writer scelto da AUDIT_BACKEND:
+  - file: segmenti ruotati e indicizzati (app/utils/audit_store.py, default);
+  - db: INSERT multi-riga nella tabella partizionata audit_events (app/services/audit_db.py),
+    con i segmenti locali come fallback se il database non risponde.
+Politica di backpressure a coda piena (AUDIT_BACKPRESSURE):
+  - block: il chiamante attende fino a AUDIT_BLOCK_TIMEOUT secondi, poi scrive l'evento in modo sincrono;
+  - inline: scrive subito l'evento in modo sincrono nel thread chiamante;
+  le scritture sincrone usano il writer di overflow: con il backend db sono i segmenti locali,
+  così il database non viene mai scritto sul percorso della richiesta;
+  - drop: l'evento viene scartato e conteggiato (audit_events_dropped_total).
+Nel thread dell'event loop (handler async) il chiamante non attende mai: a coda piena l'attesa
+e la scrittura sincrona di block/inline sono passate al threadpool (audit_events_deferred_total).
+Allo shutdown close() svuota la coda e attende il thread di scrittura.
+"""
+import asyncio
+import atexit
+import contextlib
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Optional
+
+from app.utils import metrics
+from app.utils.audit_store import SegmentedAuditWriter
+
+logger = logging.getLogger(__name__)
+
+# File unico usato prima dei segmenti: resta consultabile dalla ricerca
+AUDIT_LOG_PATH = os.getenv("AUDIT_LOG_PATH", "app/logs/audit.ndjson")
+AUDIT_BACKEND = os.getenv("AUDIT_BACKEND", "file")
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL", "1.0"))
+AUDIT_BACKPRESSURE = os.getenv("AUDIT_BACKPRESSURE", "block")
+AUDIT_BLOCK_TIMEOUT = float(os.getenv("AUDIT_BLOCK_TIMEOUT", "1.0"))
+
+EVENTS_WRITTEN = metrics.counter("audit_events_written_total", "AuditEvent scritti")
+EVENTS_DROPPED = metrics.counter("audit_events_dropped_total", "AuditEvent scartati per coda piena")
+EVENTS_INLINE = metrics.counter("audit_events_inline_total", "AuditEvent scritti in modo sincrono per coda piena")
+EVENTS_DEFERRED = metrics.counter(
+    "audit_events_deferred_total", "AuditEvent passati al threadpool per coda piena in un contesto async"
+)
+WRITE_ERRORS = metrics.counter("audit_write_errors_total", "Blocchi di AuditEvent non scritti per errore")
+QUEUE_DEPTH = metrics.gauge("audit_queue_depth", "AuditEvent in attesa di scrittura")
+
+_STOP = object()
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class AuditSink:
+    def __init__(self, writer, overflow=None, queue_size: int = AUDIT_QUEUE_SIZE, batch_size: int = AUDIT_BATCH_SIZE,
+                 flush_interval: float = AUDIT_FLUSH_INTERVAL, backpressure: str = AUDIT_BACKPRESSURE,
+                 block_timeout: float = AUDIT_BLOCK_TIMEOUT):
+        if backpressure not in ("block", "inline", "drop"):
+            raise ValueError(f"Politica di backpressure non valida: {backpressure}")
+        self.writer = writer
+        # Writer delle scritture sincrone a coda piena o dopo close() (default: lo stesso writer)
+        self.overflow = overflow if overflow is not None else writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.backpressure = backpressure
+        self.block_timeout = block_timeout
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._closed = False
+        QUEUE_DEPTH.set_function(self._queue.qsize)
+
+    def _ensure_started(self) -> None:
+        # Il thread va (ri)avviato anche nei processi figli creati con fork (worker uvicorn)
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+                QUEUE_DEPTH.set_function(self._queue.qsize)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, event: dict) -> None:
+        if self._closed:
+            self._write([event], self.overflow)
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+            return
+        except queue.Full:
+            pass
+
+        if self.backpressure == "drop":
+            EVENTS_DROPPED.inc()
+            logger.warning("[AUDIT] Coda piena: evento scartato")
+            return
+        loop = _running_loop()
+        if loop is not None:
+            EVENTS_DEFERRED.inc()
+            loop.run_in_executor(None, self._submit_full, event)
+            return
+        self._submit_full(event)
+
+    def _submit_full(self, event: dict) -> None:
+        """
+        Coda piena con politica block o inline: attesa (block) e poi scrittura sincrona.
+        """
+        if self.backpressure == "block":
+            try:
+                self._queue.put(event, timeout=self.block_timeout)
+                return
+            except queue.Full:
+                pass
+        EVENTS_INLINE.inc()
+        self._write([event], self.overflow)
+
+    def _write(self, events: list[dict], writer=None) -> None:
+        writer = writer or self.writer
+        # Il lock serializza il writer principale; un overflow distinto (segmenti) ha il proprio lock
+        # e non attende una scrittura sul database in corso
+        lock = self._write_lock if writer is self.writer else contextlib.nullcontext()
+        try:
+            with lock:
+                writer.write(events)
+            EVENTS_WRITTEN.inc(len(events))
+        except Exception as e:
+            WRITE_ERRORS.inc()
+            logger.error(f"[AUDIT] Scrittura di {len(events)} eventi fallita: {e}")
+
+    def _run(self) -> None:
+        batch: list[dict] = []
+        deadline = time.monotonic() + self.flush_interval
+        stopping = False
+        while not stopping:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            except queue.Empty:
+                pass
+            if batch and (stopping or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_interval
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Scrive gli eventi ancora in coda e ferma il thread; gli eventi successivi sono scritti in modo sincrono.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid() and thread.is_alive():
+            self._queue.put(_STOP)
+            thread.join(timeout)
+        self.writer.close()
+        if self.overflow is not self.writer:
+            self.overflow.close()
+
+
+def make_audit_writer(backend: str = AUDIT_BACKEND):
+    if backend == "db":
+        from app.services.audit_db import DatabaseAuditWriter
+        return DatabaseAuditWriter(fallback=SegmentedAuditWriter())
+    if backend != "file":
+        raise ValueError(f"Backend di audit non valido: {backend}")
+    return SegmentedAuditWriter()
+
+
+_sink: Optional[AuditSink] = None
+_sink_lock = threading.Lock()
+
+
+def get_audit_sink() -> AuditSink:
+    global _sink
+    if _sink is None:
+        with _sink_lock:
+            if _sink is None:
+                writer = make_audit_writer()
+                # Con il backend db le scritture sincrone vanno sui segmenti di fallback
+                _sink = AuditSink(writer, overflow=getattr(writer, "fallback", None))
+    return _sink
+
+
+def close_audit_sink() -> None:
+    if _sink is not None:
+        _sink.close()
+
+
+atexit.register(close_audit_sink)
@@ -0,0 +1,308 @@
+"""
+Archivio degli AuditEvent a segmenti.
+
+Ogni processo scrive su un proprio segmento attivo (audit-<inizio>-<pid>-<n>.ndjson), ruotato per dimensione
+o età. Alla chiusura il segmento viene compresso (.ndjson.gz) e accompagnato da un indice laterale
+(.idx.json) con intervallo temporale, giorni, utenti, entity_id e codici evento presenti:
+le ricerche aprono solo i segmenti il cui indice può contenere risultati.
+I segmenti senza indice (attivi, o lasciati da un processo terminato) vengono letti per intero.
+Il processo che scrive un segmento ne tiene un lock esclusivo (flock), rilasciato dal kernel alla sua
+terminazione: un segmento attivo di cui si ottiene il lock è orfano, e lo chiude chi ha il lock.
+"""
+import fcntl
+import gzip
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from datetime import date, datetime
+from typing import Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+AUDIT_DIR = os.getenv("AUDIT_DIR", "app/logs/audit")
+AUDIT_SEGMENT_MAX_BYTES = int(os.getenv("AUDIT_SEGMENT_MAX_BYTES", str(64 * 1024 * 1024)))
+AUDIT_SEGMENT_MAX_AGE = float(os.getenv("AUDIT_SEGMENT_MAX_AGE", str(24 * 3600)))
+
+_SEGMENT = re.compile(r"^audit-(\d{8}T\d{6})-(\d+)-(\d+)\.ndjson(\.gz)?$")
+
+
+def event_keys(event: dict) -> tuple[str, Optional[str], Optional[str], Optional[str]]:
+    """
+    (recorded, username, entity_id, codice evento) di un AuditEvent.
+    """
+    agent = (event.get("agent") or [{}])[0]
+    entity = (event.get("entity") or [{}])[0]
+    return (
+        event.get("recorded", ""),
+        ((agent.get("who") or {}).get("identifier") or {}).get("value"),
+        ((entity.get("what") or {}).get("identifier") or {}).get("value"),
+        (event.get("type") or {}).get("code"),
+    )
+
+
+class SegmentIndex:
+    """
+    Indice laterale di un segmento, accumulato durante la scrittura.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.start: Optional[str] = None
+        self.end: Optional[str] = None
+        self.dates: set[str] = set()
+        self.usernames: set[str] = set()
+        self.entity_ids: set[str] = set()
+        self.codes: set[str] = set()
+
+    def add(self, event: dict) -> None:
+        recorded, username, entity_id, code = event_keys(event)
+        self.count += 1
+        if recorded:
+            self.start = min(self.start, recorded) if self.start else recorded
+            self.end = max(self.end, recorded) if self.end else recorded
+            self.dates.add(recorded[:10])
+        for values, value in ((self.usernames, username), (self.entity_ids, entity_id), (self.codes, code)):
+            if value is not None:
+                values.add(value)
+
+    def to_dict(self, segment: str) -> dict:
+        return {
+            "segment": segment,
+            "count": self.count,
+            "start": self.start,
+            "end": self.end,
+            "dates": sorted(self.dates),
+            "usernames": sorted(self.usernames),
+            "entity_ids": sorted(self.entity_ids),
+            "codes": sorted(self.codes),
+        }
+
+
+def _index_path(segment_path: str) -> str:
+    return re.sub(r"\.ndjson(\.gz)?$", ".idx.json", segment_path)
+
+
+def seal_segment(path: str, index: Optional[SegmentIndex] = None) -> str:
+    """
+    Comprime un segmento chiuso e ne scrive l'indice laterale; ritorna il percorso del .gz.
+    """
+    if index is None:
+        index = SegmentIndex()
+        with open(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        index.add(json.loads(line))
+                    except ValueError:
+                        continue
+    gz_path = path + ".gz"
+    suffix = f".{os.getpid()}.tmp"
+    with open(path, "rb") as src, gzip.open(gz_path + suffix, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.replace(gz_path + suffix, gz_path)
+    index_path = _index_path(path)
+    with open(index_path + suffix, "w") as f:
+        json.dump(index.to_dict(os.path.basename(gz_path)), f)
+    os.replace(index_path + suffix, index_path)
+    os.remove(path)
+    return gz_path
+
+
+def _try_lock(f) -> bool:
+    """
+    Lock esclusivo non bloccante sul file: False se lo tiene già un altro processo.
+    """
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class SegmentedAuditWriter:
+    """
+    Writer per AuditSink: append sul segmento attivo del processo, rotazione per dimensione o età.
+    """
+
+    def __init__(self, directory: str = AUDIT_DIR, max_bytes: int = AUDIT_SEGMENT_MAX_BYTES,
+                 max_age: float = AUDIT_SEGMENT_MAX_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        os.makedirs(directory, exist_ok=True)
+        self._pid: Optional[int] = None
+        self._file = None
+        self._path: Optional[str] = None
+        self._opened_at = 0.0
+        self._seq = 0
+        self._index = SegmentIndex()
+        self._lock = threading.Lock()
+
+    def _open(self) -> None:
+        # Dopo un fork il segmento del padre resta al padre: si riparte con un segmento nuovo
+        self._pid = os.getpid()
+        self._seal_orphans()
+        # Il progressivo distingue i segmenti aperti nello stesso secondo
+        self._seq += 1
+        name = f"audit-{datetime.utcnow():%Y%m%dT%H%M%S}-{self._pid}-{self._seq}.ndjson"
+        self._path = os.path.join(self.directory, name)
+        self._file = open(self._path, "ab")
+        _try_lock(self._file)
+        self._opened_at = time.monotonic()
+        self._index = SegmentIndex()
+
+    def _seal_orphans(self) -> None:
+        """
+        Chiude i segmenti rimasti attivi da processi non più in esecuzione (nessuno ne tiene il lock).
+        """
+        for name in os.listdir(self.directory):
+            match = _SEGMENT.match(name)
+            if not match or match.group(4):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, "rb") as f:
+                    # Se nel frattempo un altro processo l'ha chiuso, il segmento non esiste più
+                    if _try_lock(f) and os.path.exists(path):
+                        seal_segment(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.error(f"[AUDIT] Segmento orfano {name} non chiuso: {e}")
+
+    def _rotate(self) -> None:
+        # Il file resta aperto (e bloccato) fino alla fine della chiusura del segmento
+        path, index = self._path, self._index
+        try:
+            if index.count:
+                seal_segment(path, index)
+            else:
+                os.remove(path)
+        finally:
+            self._file.close()
+            self._file = None
+
+    def write(self, events: list[dict]) -> None:
+        with self._lock:
+            if self._file is None or self._pid != os.getpid():
+                self._open()
+            elif self._file.tell() >= self.max_bytes or time.monotonic() - self._opened_at >= self.max_age:
+                self._rotate()
+                self._open()
+            self._file.write("".join(json.dumps(e) + "\n" for e in events).encode("utf-8"))
+            self._file.flush()
+            for e in events:
+                self._index.add(e)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None and self._pid == os.getpid():
+                self._rotate()
+
+
+# --- ricerca --------------------------------------------------------------------
+
+_index_cache: dict[str, dict] = {}
+
+
+def _load_index(path: str) -> Optional[dict]:
+    # Gli indici dei segmenti chiusi non cambiano più: si leggono una volta sola
+    cached = _index_cache.get(path)
+    if cached is None:
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        for key in ("dates", "usernames", "entity_ids", "codes"):
+            cached[key] = set(cached[key])
+        _index_cache[path] = cached
+    return cached
+
+
+def _index_may_match(index: dict, start: Optional[date], end: Optional[date], username: Optional[str],
+                     entity_id: Optional[str], code: Optional[str]) -> bool:
+    if start and index["end"] and index["end"][:10] < start.isoformat():
+        return False
+    if end and index["start"] and index["start"][:10] > end.isoformat():
+        return False
+    if username is not None and username not in index["usernames"]:
+        return False
+    if entity_id is not None and entity_id not in index["entity_ids"]:
+        return False
+    if code is not None and code not in index["codes"]:
+        return False
+    return True
+
+
+def candidate_segments(directory: str, start: Optional[date] = None, end: Optional[date] = None,
+                       username: Optional[str] = None, entity_id: Optional[str] = None,
+                       code: Optional[str] = None, legacy_path: Optional[str] = None) -> list[str]:
+    """
+    Segmenti da leggere: quelli indicizzati compatibili con i filtri, più quelli senza indice.
+    """
+    segments = []
+    if legacy_path and os.path.exists(legacy_path):
+        segments.append(legacy_path)
+    if not os.path.isdir(directory):
+        return segments
+    for name in sorted(os.listdir(directory)):
+        if not _SEGMENT.match(name):
+            continue
+        path = os.path.join(directory, name)
+        index = _load_index(_index_path(path)) if name.endswith(".gz") else None
+        if index is None or _index_may_match(index, start, end, username, entity_id, code):
+            segments.append(path)
+    return segments
+
+
+def _read_segment(path: str) -> Iterator[dict]:
+    if not os.path.exists(path) and os.path.exists(path + ".gz"):
+        # Segmento ruotato da un altro processo dopo l'elenco: si legge la versione compressa
+        path += ".gz"
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rb") as f:
+            for line in f:
+                if line.strip():
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+    except FileNotFoundError:
+        return
+
+
+def search_audit(directory: str = AUDIT_DIR, start: Optional[date] = None, end: Optional[date] = None,
+                 username: Optional[str] = None, entity_id: Optional[str] = None, code: Optional[str] = None,
+                 limit: int = 100, legacy_path: Optional[str] = None) -> list[dict]:
+    """
+    AuditEvent che soddisfano tutti i filtri, dal più recente, al più `limit`.
+    """
+    def matches(event: dict) -> bool:
+        recorded, ev_username, ev_entity, ev_code = event_keys(event)
+        day = recorded[:10]
+        return (
+            (start is None or day >= start.isoformat())
+            and (end is None or day <= end.isoformat())
+            and (username is None or ev_username == username)
+            and (entity_id is None or ev_entity == entity_id)
+            and (code is None or ev_code == code)
+        )
+
+    def unique(events: Iterator[dict]) -> Iterator[dict]:
+        # Durante una rotazione lo stesso segmento può comparire sia in chiaro sia compresso
+        seen = set()
+        for e in events:
+            if e.get("id") not in seen:
+                seen.add(e.get("id"))
+                yield e
+
+    segments = candidate_segments(directory, start, end, username, entity_id, code, legacy_path)
+    found = unique(e for path in segments for e in _read_segment(path) if matches(e))
+    return heapq.nlargest(limit, found, key=lambda e: e.get("recorded", ""))
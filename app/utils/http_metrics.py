@@ -0,0 +1,54 @@
+"""
+Middleware ASGI puro per le metriche HTTP: latenza per route (template), richieste in corso,
+numero e durata delle query SQL per richiesta.
+"""
+import time
+
+from app.utils import metrics
+from app.utils.request_context import end_request_stats, route_template, start_request_stats
+
+REQUEST_DURATION = metrics.histogram(
+    "http_request_duration_seconds", "Latenza delle richieste HTTP", ("method", "route", "status")
+)
+IN_FLIGHT = metrics.gauge("http_requests_in_flight", "Richieste HTTP in elaborazione", ("method",))
+REQUEST_QUERIES = metrics.histogram(
+    "http_request_db_queries", "Query SQL eseguite per richiesta", ("route",),
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+)
+REQUEST_DB_TIME = metrics.histogram(
+    "http_request_db_seconds", "Tempo trascorso in query SQL per richiesta", ("route",)
+)
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        stats, token = start_request_stats()
+        IN_FLIGHT.inc(method=method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            IN_FLIGHT.dec(method=method)
+            end_request_stats(token)
+            # Il template è disponibile solo dopo il match del router, quindi si legge a fine richiesta
+            route = route_template(scope)
+            REQUEST_DURATION.observe(elapsed, method=method, route=route, status=status_code)
+            REQUEST_QUERIES.observe(stats.queries, route=route)
+            REQUEST_DB_TIME.observe(stats.db_seconds, route=route)
@@ -0,0 +1,243 @@
+import codecs
+import json
+from typing import AsyncIterator, Iterable, Iterator
+
+# Dimensione dei blocchi letti dall'upload
+JSON_READ_CHUNK = 64 * 1024
+# Oltre questa soglia un singolo valore JSON incompleto viene considerato malformato
+JSON_MAX_PENDING = 64 * 1024 * 1024
+
+_WHITESPACE = " \t\r\n"
+_DELIMITERS = _WHITESPACE + ",]}"
+
+
+class FhirJsonStreamParser:
+    """
+    Parser JSON incrementale (push) per risorse FHIR.
+
+    Accetta, anche a blocchi arbitrari:
+      - un singolo oggetto risorsa;
+      - un array di risorse;
+      - NDJSON (una risorsa per riga, o più oggetti concatenati);
+      - un Bundle FHIR, le cui entry[].resource vengono emesse una alla volta
+        senza materializzare l'intero array entry.
+
+    `feed()` ritorna le risorse complete disponibili finora, `close()` quelle residue.
+    """
+
+    def __init__(self, max_pending: int = JSON_MAX_PENDING):
+        self._decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._state = "top"
+        self._obj: dict = {}
+        self._key: str | None = None
+        self._bundle = False
+        self._closed = False
+        self._max_pending = max_pending
+        self.count = 0
+
+    def feed(self, text: str) -> list[dict]:
+        self._buf = self._buf[self._pos:] + text
+        self._pos = 0
+        out = self._parse()
+        if len(self._buf) - self._pos > self._max_pending:
+            raise json.JSONDecodeError("Valore JSON troppo grande o malformato", self._buf, self._pos)
+        return out
+
+    def close(self) -> list[dict]:
+        self._closed = True
+        out = self._parse()
+        self._skip_ws()
+        if self._state != "top" or self._pos < len(self._buf):
+            raise json.JSONDecodeError("Contenuto JSON incompleto", self._buf, self._pos)
+        return out
+
+    # --- helpers -------------------------------------------------------------
+
+    def _skip_ws(self, extra: str = "") -> str | None:
+        chars = _WHITESPACE + extra
+        buf, pos = self._buf, self._pos
+        while pos < len(buf) and buf[pos] in chars:
+            pos += 1
+        self._pos = pos
+        return buf[pos] if pos < len(buf) else None
+
+    def _decode(self):
+        """
+        Decodifica il prossimo valore completo; ritorna (True, valore) o (False, None) se servono altri dati.
+        """
+        try:
+            value, end = self._decoder.raw_decode(self._buf, self._pos)
+        except json.JSONDecodeError:
+            if self._closed:
+                raise
+            return False, None
+        # Numeri e letterali sono completi solo se seguiti da un delimitatore ("1" potrebbe diventare "1.5")
+        if not self._closed and not isinstance(value, (dict, list, str)):
+            if end == len(self._buf) or self._buf[end] not in _DELIMITERS:
+                return False, None
+        self._pos = end
+        return True, value
+
+    def _emit(self, value, out: list) -> None:
+        if isinstance(value, dict) and value.get("resourceType") == "Bundle":
+            for entry in value.get("entry") or []:
+                if isinstance(entry, dict) and isinstance(entry.get("resource"), dict):
+                    out.append(entry["resource"])
+        elif isinstance(value, dict):
+            out.append(value)
+        else:
+            raise json.JSONDecodeError("Attesa una risorsa JSON (oggetto)", self._buf, self._pos)
+
+    def _error(self, msg: str):
+        raise json.JSONDecodeError(msg, self._buf, self._pos)
+
+    # --- macchina a stati ----------------------------------------------------
+
+    def _parse(self) -> list[dict]:
+        out: list[dict] = []
+        while True:
+            state = self._state
+
+            if state == "top":
+                c = self._skip_ws()
+                if c is None:
+                    break
+                self._pos += 1
+                if c == "[":
+                    self._state = "array_start"
+                elif c == "{":
+                    self._obj, self._key, self._bundle = {}, None, False
+                    self._state = "obj_key"
+                else:
+                    self._error("Atteso '{' o '['")
+
+            elif state in ("array_start", "array_sep"):
+                c = self._skip_ws()
+                if c is None:
+                    break
+                if c == "]":
+                    self._pos += 1
+                    self._state = "top"
+                elif state == "array_sep":
+                    if c != ",":
+                        self._error("Atteso ',' o ']'")
+                    self._pos += 1
+                    self._state = "array_item"
+                else:
+                    self._state = "array_item"
+
+            elif state == "array_item":
+                if self._skip_ws() is None:
+                    break
+                ok, value = self._decode()
+                if not ok:
+                    break
+                self._emit(value, out)
+                self._state = "array_sep"
+
+            elif state == "obj_key":
+                c = self._skip_ws(",")
+                if c is None:
+                    break
+                if c == "}":
+                    self._pos += 1
+                    self._finish_object(out)
+                    self._state = "top"
+                    continue
+                if c != '"':
+                    self._error("Attesa una chiave stringa")
+                ok, key = self._decode()
+                if not ok:
+                    break
+                self._key = key
+                self._state = "obj_colon"
+
+            elif state == "obj_colon":
+                c = self._skip_ws()
+                if c is None:
+                    break
+                if c != ":":
+                    self._error("Atteso ':'")
+                self._pos += 1
+                self._state = "obj_value"
+
+            elif state == "obj_value":
+                c = self._skip_ws()
+                if c is None:
+                    break
+                if self._key == "entry" and c == "[":
+                    # entry di un Bundle: le risorse vengono emesse man mano
+                    self._pos += 1
+                    self._state = "entry_start"
+                    continue
+                ok, value = self._decode()
+                if not ok:
+                    break
+                self._obj[self._key] = value
+                self._state = "obj_key"
+
+            elif state in ("entry_start", "entry_sep"):
+                c = self._skip_ws()
+                if c is None:
+                    break
+                if c == "]":
+                    self._pos += 1
+                    self._state = "obj_key"
+                elif state == "entry_sep":
+                    if c != ",":
+                        self._error("Atteso ',' o ']'")
+                    self._pos += 1
+                    self._state = "entry_item"
+                else:
+                    self._state = "entry_item"
+
+            elif state == "entry_item":
+                if self._skip_ws() is None:
+                    break
+                ok, entry = self._decode()
+                if not ok:
+                    break
+                if isinstance(entry, dict) and isinstance(entry.get("resource"), dict):
+                    self._bundle = True
+                    out.append(entry["resource"])
+                else:
+                    self._obj.setdefault("entry", []).append(entry)
+                self._state = "entry_sep"
+
+        self.count += len(out)
+        return out
+
+    def _finish_object(self, out: list) -> None:
+        obj, self._obj = self._obj, {}
+        if self._bundle:
+            return
+        self._emit(obj, out)
+
+
+def iter_json_resources(chunks: Iterable[bytes], encoding: str = "utf-8") -> Iterator[dict]:
+    """
+    Produce le risorse FHIR una alla volta a partire da blocchi di byte.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    parser = FhirJsonStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(decoder.decode(chunk))
+    yield from parser.feed(decoder.decode(b"", final=True))
+    yield from parser.close()
+
+
+async def aiter_json_resources(chunks: AsyncIterator[bytes], encoding: str = "utf-8") -> AsyncIterator[dict]:
+    """
+    Variante asincrona di `iter_json_resources`, per il body di una richiesta in arrivo.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    parser = FhirJsonStreamParser()
+    async for chunk in chunks:
+        for resource in parser.feed(decoder.decode(chunk)):
+            yield resource
+    for resource in parser.feed(decoder.decode(b"", final=True)):
+        yield resource
+    for resource in parser.close():
+        yield resource
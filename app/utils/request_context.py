@@ -0,0 +1,73 @@
+"""
+Contesto della richiesta HTTP corrente, accessibile anche fuori dagli handler
+(eventi del pool, hook SQL) tramite ContextVar.
+"""
+from contextvars import ContextVar
+from typing import Optional
+
+_current_scope: ContextVar[Optional[dict]] = ContextVar("current_scope", default=None)
+
+
+class RequestStats:
+    """
+    Statistiche SQL della richiesta corrente, incrementate dagli hook sull'engine.
+    È un oggetto mutabile: i thread del threadpool ricevono una copia del contesto
+    ma condividono la stessa istanza.
+    """
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def route_template(scope: dict) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def current_route() -> str:
+    """
+    Template della route in esecuzione (es. /api/patients/{identifier}); "-" fuori da una richiesta.
+    Si usa il template e non il path effettivo per non moltiplicare le etichette delle metriche.
+    """
+    scope = _current_scope.get()
+    if scope is None:
+        return "-"
+    return route_template(scope)
+
+
+def current_request_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def start_request_stats() -> tuple[RequestStats, object]:
+    stats = RequestStats()
+    return stats, _request_stats.set(stats)
+
+
+def end_request_stats(token) -> None:
+    _request_stats.reset(token)
+
+
+class RequestContextMiddleware:
+    """
+    Middleware ASGI puro: espone lo scope della richiesta al ContextVar. Il router aggiunge
+    "route" allo stesso dizionario dopo il match, quindi il template è visibile anche dagli handler.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _current_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current_scope.reset(token)
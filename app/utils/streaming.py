@@ -0,0 +1,46 @@
+import csv
+import io
+from contextlib import contextmanager
+from itertools import islice
+from typing import AsyncIterator, Iterable, Iterator
+
+from fastapi import UploadFile
+
+
+@contextmanager
+def open_csv_upload(file: UploadFile, encoding: str = "utf-8") -> Iterator[csv.DictReader]:
+    """
+    Apre un UploadFile CSV in lettura incrementale.
+    Lo spool viene decodificato a blocchi da TextIOWrapper e il DictReader
+    produce una riga alla volta: il file non viene mai caricato interamente in memoria.
+    """
+    file.file.seek(0)
+    text = io.TextIOWrapper(file.file, encoding=encoding, newline="")
+    try:
+        yield csv.DictReader(text)
+    finally:
+        # Sgancio il wrapper senza chiudere lo spool, che resta gestito da UploadFile
+        text.detach()
+
+
+def iter_chunks(rows: Iterable, size: int) -> Iterator[list]:
+    """
+    Suddivide un iterabile in liste di al più `size` elementi.
+    """
+    it = iter(rows)
+    while True:
+        chunk = list(islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+async def aiter_upload_chunks(file: UploadFile, size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """
+    Legge un UploadFile a blocchi di `size` byte.
+    """
+    while True:
+        chunk = await file.read(size)
+        if not chunk:
+            return
+        yield chunk
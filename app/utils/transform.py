@@ -1,7 +1,11 @@
-import logging
+import decimal
+import functools
 import hashlib
+import logging
+import os
 import uuid
 import shortuuid
+from typing import Callable, Iterable, Optional
 
 from fhir.resources.condition import Condition
 from fhir.resources.observation import Observation
@@ -14,12 +18,18 @@ from fhir.resources.reference import Reference
 from fhir.resources.codeableconcept import CodeableConcept
 from fhir.resources.coding import Coding
 
+from pydantic import TypeAdapter
+from pydantic_core import to_jsonable_python
 from sqlalchemy.orm import Session
 
 from app.schemas import PatientCreate, ObservationCreate, ConditionCreate, EncounterCreate
 
+from app.services.transform_pool import map_ordered
 from app.utils.anonymization import hash_identifier
+from app.utils.streaming import iter_chunks
 from app.models.fhir_resource import FhirResource
+from app.services.database import insert_resources
+from app.services.resource_events import ResourceRow
 
 
 logger = logging.getLogger(__name__)
@@ -33,10 +43,6 @@ EXPECTED_HEADERS = {
 }
 
 
-
-def hash_identifier(value: str) -> str:
-    return hashlib.sha256(value.encode("utf-8")).hexdigest()
-
 def validate_csv_headers(headers: list[str], resource_type: str) -> bool:
     if not headers or resource_type not in EXPECTED_HEADERS:
         return False
@@ -48,7 +54,19 @@ def validate_csv_headers(headers: list[str], resource_type: str) -> bool:
 def generate_patient_id() -> str:
     return "pat" + shortuuid.ShortUUID().random(length=8)
 
-def csv_to_patient(row: dict) -> dict:
+
+ID_PREFIXES = {"Patient": "pat", "Encounter": "enc", "Observation": "obs", "Condition": "cond"}
+
+
+def deterministic_resource_id(resource_type: str, seed: str, ordinal: int) -> str:
+    """
+    Id stabile per la riga `ordinal` di un file con hash `seed` (job di ingestion ripresi o ricaricati).
+    """
+    digest = hashlib.sha256(f"{seed}:{ordinal}".encode("utf-8")).hexdigest()
+    return ID_PREFIXES.get(resource_type, "") + digest[:24]
+
+
+def csv_to_patient_model(row: dict) -> dict:
     try:
         cf = row.get("codice_fiscale", "").strip()
         hashed = hash_identifier(cf)
@@ -126,7 +144,7 @@ def normalize_datetime(value: str) -> str:
     val = value.strip()
     return val if val.endswith("Z") else val + "Z"
 
-def csv_to_observation(row: dict) -> dict:
+def csv_to_observation_model(row: dict) -> dict:
     try:
         cf = row.get("codice_fiscale", "").strip()
         hashed_cf = hash_identifier(cf)
@@ -163,7 +181,7 @@ def csv_to_observation(row: dict) -> dict:
 def generate_condition_id() -> str:
         return "con" + shortuuid.ShortUUID().random(length=8)
 
-def csv_to_condition(row: dict) -> dict:
+def csv_to_condition_model(row: dict) -> dict:
     try:
         hashed_cf = hash_identifier(row.get("codice_fiscale", "").strip())
         condition_id = "cond" + shortuuid.ShortUUID().random(length=8)
@@ -212,6 +230,146 @@ def csv_to_condition(row: dict) -> dict:
 
 
 
+# --- trasformazioni veloci ------------------------------------------------------
+# Costruiscono direttamente i dict JSON come csv_to_encounter, senza il grafo di modelli fhir.resources.
+# Ogni valore preso dal CSV è validato con il tipo primitivo FHIR del campo corrispondente
+# (TypeAdapter compilato una volta per campo) e serializzato con le stesse regole di model_dump(mode="json"):
+# l'output e le righe rifiutate coincidono con le versioni *_model (vedi tests/test_transform.py).
+# CSV_TRANSFORM_MODE=model ripristina le trasformazioni basate sui modelli.
+CSV_TRANSFORM_MODE = os.getenv("CSV_TRANSFORM_MODE", "fast")
+
+
+@functools.lru_cache(maxsize=None)
+def _field_adapter(model: type, field: str) -> TypeAdapter:
+    return TypeAdapter(model.model_fields[field].annotation)
+
+
+def _fhir_value(model: type, field: str, value):
+    """
+    Valida `value` come il campo `field` di `model` e lo rende come nel JSON del modello.
+    """
+    value = _field_adapter(model, field).validate_python(value)
+    if isinstance(value, decimal.Decimal):
+        # Stessa regola di FHIRAbstractModel._serialize_primitive_value
+        exp = value.as_tuple().exponent
+        if value.is_finite() and value == value.to_integral_value() and isinstance(exp, int) and exp >= 0:
+            return int(value)
+        return float(value)
+    return to_jsonable_python(value)
+
+
+def csv_to_patient_fast(row: dict) -> dict:
+    try:
+        hashed = hash_identifier(row.get("codice_fiscale", "").strip())
+        return {
+            "resourceType": "Patient",
+            "id": generate_patient_id(),
+            "identifier": [{"system": "http://fhir.example.org", "value": hashed}],
+            "gender": _fhir_value(Patient, "gender", row.get("gender", "").strip()),
+            "birthDate": _fhir_value(Patient, "birthDate", row.get("data_nascita", "").strip()),
+            "address": [{
+                "city": _fhir_value(Address, "city", row.get("citta", "").strip()),
+                "district": _fhir_value(Address, "district", row.get("provincia", "").strip()),
+                "postalCode": _fhir_value(Address, "postalCode", row.get("cap", "").strip()),
+            }],
+        }
+    except Exception as e:
+        logger.error(f"Errore nella creazione della risorsa Patient: {e}")
+        raise
+
+
+def csv_to_observation_fast(row: dict) -> dict:
+    try:
+        hashed_cf = hash_identifier(row.get("codice_fiscale", "").strip())
+        return {
+            "resourceType": "Observation",
+            "id": generate_observation_id(),
+            "identifier": [{
+                "system": "http://fhir.example.org",
+                "value": _fhir_value(Identifier, "value", row.get("observation_id", "").strip()),
+            }],
+            "status": "final",
+            "code": {
+                "coding": [{
+                    "system": "http://loinc.org",
+                    "code": _fhir_value(Coding, "code", row.get("codice_lonic", "").strip()),
+                    "display": _fhir_value(Coding, "display", row.get("descrizione_test", "").strip()),
+                }]
+            },
+            "subject": {"identifier": {"value": hashed_cf}},
+            "effectiveDateTime": _fhir_value(
+                Observation, "effectiveDateTime", normalize_datetime(row.get("data_osservazione", ""))
+            ),
+            "valueQuantity": {
+                "value": _fhir_value(Quantity, "value", float(row.get("valore", "0.0"))),
+                "unit": _fhir_value(Quantity, "unit", row.get("unita", "").strip()),
+            },
+        }
+    except Exception as e:
+        logger.error(f"Errore nella creazione Observation: {e}")
+        raise
+
+
+def csv_to_condition_fast(row: dict) -> dict:
+    try:
+        hashed_cf = hash_identifier(row.get("codice_fiscale", "").strip())
+        condition_id = "cond" + shortuuid.ShortUUID().random(length=8)
+
+        codice_icd = row.get("codice_icd", "").strip()
+        descrizione = row.get("descrizione", "").strip()
+        data_diagnosi = row.get("data_diagnosi", "").strip()
+
+        if not codice_icd or not descrizione:
+            raise ValueError("Campi 'codice_icd' o 'descrizione' mancanti o vuoti.")
+
+        return {
+            "resourceType": "Condition",
+            "id": condition_id,
+            "clinicalStatus": {
+                "coding": [{
+                    "system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
+                    "code": "active",
+                    "display": "Active",
+                }]
+            },
+            "verificationStatus": {
+                "coding": [{
+                    "system": "http://terminology.hl7.org/CodeSystem/condition-ver-status",
+                    "code": "confirmed",
+                }]
+            },
+            "code": {
+                "coding": [{
+                    "system": "http://hl7.org/fhir/sid/icd-10",
+                    "code": _fhir_value(Coding, "code", codice_icd),
+                    "display": _fhir_value(Coding, "display", descrizione),
+                }],
+                "text": _fhir_value(CodeableConcept, "text", descrizione),
+            },
+            "subject": {"identifier": {"value": hashed_cf}},
+            "recordedDate": _fhir_value(Condition, "recordedDate", data_diagnosi),
+        }
+    except Exception as e:
+        logger.error(f"Errore nella creazione della risorsa Condition: {e}")
+        raise
+
+
+if CSV_TRANSFORM_MODE == "model":
+    csv_to_patient = csv_to_patient_model
+    csv_to_observation = csv_to_observation_model
+    csv_to_condition = csv_to_condition_model
+else:
+    csv_to_patient = csv_to_patient_fast
+    csv_to_observation = csv_to_observation_fast
+    csv_to_condition = csv_to_condition_fast
+
+FAST_TRANSFORM_PAIRS = {
+    "Patient": (csv_to_patient_model, csv_to_patient_fast),
+    "Observation": (csv_to_observation_model, csv_to_observation_fast),
+    "Condition": (csv_to_condition_model, csv_to_condition_fast),
+}
+
+
 JSON_SCHEMA_MAP: dict[str, type] = {
     "Patient": PatientCreate,
     "Condition": ConditionCreate,
@@ -219,61 +377,94 @@ JSON_SCHEMA_MAP: dict[str, type] = {
     "Encounter": EncounterCreate,
 }
 
-def process_json_resources(resources: list[dict], db: Session) -> dict:
+# Numero di risorse JSON validate e persistite per ogni commit
+JSON_BATCH_SIZE = int(os.getenv("JSON_BATCH_SIZE", "500"))
+
+
+def _prepare_json_resource(raw: dict) -> None:
     """
-    Valida e persiste in batch un array di risorse FHIR di tipi diversi.
-    Ritorna un report { total, processed, errors }.
+    Completa resourceType/id, anonimizza gli identificativi e normalizza gli status testuali delle Condition.
     """
-    summary = {
-        "total": len(resources),
-        "processed": 0,
-        "errors": []
-    }
+    if not raw.get("resourceType"):
+        raw["resourceType"] = "Patient"
+
+    r_type = raw["resourceType"]
+    if not raw.get("id"):
+        if r_type == "Patient":
+            raw["id"] = generate_patient_id()
+        else:
+            raw["id"] = uuid.uuid4().hex
+
+    # Anonimizzazione: hash su tutti i subject.identifier.value (Patient e gli altri)
+    if r_type == "Patient" and raw.get("identifier"):
+        # Patient può avere più identifier
+        for ident in raw["identifier"]:
+            if ident.get("value"):
+                ident["value"] = hash_identifier(ident["value"])
 
-    for raw in resources:
-        if not raw.get("resourceType"):
-            raw["resourceType"] = "Patient"
+    elif r_type in ("Encounter", "Observation", "Condition"):
+        # Tutti gli altri hanno subject.identifier come dict
+        subj = raw.get("subject", {})
+        ident = subj.get("identifier")
+        if isinstance(ident, dict) and ident.get("value"):
+            ident["value"] = hash_identifier(ident["value"])
+
+    if r_type == "Condition":
+        # clinicalStatus
+        cs = raw.get("clinicalStatus")
+        if isinstance(cs, str):
+            raw["clinicalStatus"] = {
+                "coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
+                            "code": cs, "display": cs.capitalize()}],
+                "text": cs.capitalize()
+            }
+        # verificationStatus
+        vs = raw.get("verificationStatus")
+        if isinstance(vs, str):
+            raw["verificationStatus"] = {
+                "coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-ver-status",
+                            "code": vs, "display": vs.capitalize()}],
+                "text": vs.capitalize()
+            }
 
-        r_type = raw["resourceType"]
-        if not raw.get("id"):
-            if r_type == "Patient":
-                raw["id"] = generate_patient_id()
-            else:
-                raw["id"] = uuid.uuid4().hex
-        r_id = raw["id"]
 
-        # Anonimizzazione: hash su tutti i subject.identifier.value (Patient e gli altri)
-        if r_type == "Patient" and raw.get("identifier"):
-            # Patient può avere più identifier
-            for ident in raw["identifier"]:
-                if ident.get("value"):
-                    ident["value"] = hash_identifier(ident["value"])
-
-        elif r_type in ("Encounter", "Observation", "Condition"):
-            # Tutti gli altri hanno subject.identifier come dict
-            subj = raw.get("subject", {})
-            ident = subj.get("identifier")
-            if isinstance(ident, dict) and ident.get("value"):
-                ident["value"] = hash_identifier(ident["value"])
+def prepare_and_validate(raw: dict) -> tuple[dict, Optional[str]]:
+    """
+    Completa e anonimizza una risorsa JSON e la valida con lo schema del suo tipo.
+    Ritorna la risorsa preparata e il messaggio di errore di validazione (None se valida o di tipo non supportato).
+    """
+    _prepare_json_resource(raw)
+    schema = JSON_SCHEMA_MAP.get(raw["resourceType"])
+    if schema is None:
+        return raw, None
+    try:
+        schema(**raw)
+    except Exception as e:
+        return raw, str(e)
+    return raw, None
+
+
+def new_json_summary() -> dict:
+    return {"total": 0, "processed": 0, "processed_by_type": {}, "errors": []}
 
-        if r_type == "Condition":
-            # clinicalStatus
-            cs = raw.get("clinicalStatus")
-            if isinstance(cs, str):
-                raw["clinicalStatus"] = {
-                    "coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-clinical",
-                                "code": cs, "display": cs.capitalize()}],
-                    "text": cs.capitalize()
-                }
-            # verificationStatus
-            vs = raw.get("verificationStatus")
-            if isinstance(vs, str):
-                raw["verificationStatus"] = {
-                    "coding": [{"system": "http://terminology.hl7.org/CodeSystem/condition-ver-status",
-                                "code": vs, "display": vs.capitalize()}],
-                    "text": vs.capitalize()
-                }
 
+def process_json_batch(resources: list[dict], db: Session, summary: dict,
+                       before_commit: Optional[Callable[[Session, dict], None]] = None) -> dict:
+    """
+    Valida e persiste un blocco di risorse FHIR di tipi diversi con un solo commit.
+    Le risorse valide sono scritte con un unico INSERT ... ON CONFLICT DO NOTHING RETURNING id:
+    quelle non restituite (stesso id o stessa chiave naturale) sono i duplicati.
+    Aggiorna e ritorna il report { total, processed, processed_by_type, errors };
+    `before_commit(db, summary)` è eseguito nella transazione del blocco (checkpoint dei job).
+    """
+    # Anonimizzazione e validazione, eventualmente in parallelo sul pool di processi
+    prepared = map_ordered(prepare_and_validate, resources)
+    summary["total"] += len(prepared)
+
+    valid = []
+    for raw, validation_error in prepared:
+        r_type = raw["resourceType"]
+        r_id = raw["id"]
 
         logger.info(f"[PROCESS] Inizio {r_type} (id={r_id})")
 
@@ -289,30 +480,64 @@ def process_json_resources(resources: list[dict], db: Session) -> dict:
             })
             continue
 
-        if db.query(FhirResource).filter(FhirResource.id == r_id).first():
-            warn = f"Risorsa duplicata saltata: {r_type} (id={r_id})"
-            logger.warning(warn)
+        if validation_error is not None:
+            logger.error(f"[PROCESS] Errore validazione {r_type} (id={r_id}): {validation_error}")
             summary["errors"].append({
                 "id": r_id,
                 "resourceType": r_type,
-                "error": warn
+                "error": validation_error
             })
             continue
 
-        try:
-            schema(**raw)
-            logger.info(f"[PROCESS] Validazione OK: {r_type} (id={r_id})")
-            db.add(FhirResource(id=r_id, resource_type=r_type, content=raw))
-            logger.info(f"[PROCESS] Aggiunto al DB: {r_type} (id={r_id})")
-            summary["processed"] += 1
-        except Exception as e:
-            logger.error(f"[PROCESS] Errore validazione/persistenza {r_type} (id={r_id}): {e}")
+        logger.info(f"[PROCESS] Validazione OK: {r_type} (id={r_id})")
+        valid.append(ResourceRow(r_id, r_type, raw))
+
+    inserted = insert_resources(db, valid)
+    for r_id, r_type, _ in valid:
+        if (r_type, r_id) not in inserted:
+            warn = f"Risorsa duplicata saltata: {r_type} (id={r_id})"
+            logger.warning(warn)
             summary["errors"].append({
                 "id": r_id,
                 "resourceType": r_type,
-                "error": str(e)
+                "error": warn
             })
-
-    # commit finale di tutte le risorse valide
+            continue
+        # Un id ripetuto nel blocco è inserito una sola volta
+        inserted.discard((r_type, r_id))
+        logger.info(f"[PROCESS] Aggiunto al DB: {r_type} (id={r_id})")
+        summary["processed"] += 1
+        summary["processed_by_type"][r_type] = summary["processed_by_type"].get(r_type, 0) + 1
+
+    # commit del blocco di risorse valide
+    if before_commit:
+        before_commit(db, summary)
     db.commit()
-    return summary
\ No newline at end of file
+    return summary
+
+
+def process_json_resources(resources: Iterable[dict], db: Session, batch_size: int = JSON_BATCH_SIZE,
+                           before_commit: Optional[Callable[[Session, dict], None]] = None,
+                           summary: Optional[dict] = None) -> dict:
+    """
+    Valida e persiste un flusso di risorse FHIR di tipi diversi, a blocchi di `batch_size`.
+    Accetta una lista o qualsiasi iterabile (es. il parser JSON/NDJSON incrementale).
+    Ritorna un report { total, processed, errors }, proseguendo `summary` se indicato.
+    """
+    if summary is None:
+        summary = new_json_summary()
+    for batch in iter_chunks(resources, batch_size):
+        process_json_batch(batch, db, summary, before_commit)
+    return summary
+
+
+def json_upload_response(summary: dict) -> dict:
+    """
+    Report per il front-end nello stesso formato dei caricamenti CSV: { inserted, skipped, errors }.
+    """
+    return {
+        "inserted": summary["processed"],
+        "skipped": len(summary["errors"]),
+        "errors": [f"[{e['resourceType']}/{e['id']}] {e['error']}" for e in summary["errors"]]
+    }
+
@@ -0,0 +1,40 @@
+"""
+Benchmark della pseudonimizzazione (SHA-256 / HMAC, con e senza LRU): python -m scripts.bench_anonymization
+"""
+import random
+import string
+import time
+
+from app.utils.anonymization import Pseudonymizer
+
+N = 1_000_000
+
+
+def _fake_cf() -> str:
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=16))
+
+
+def bench(label: str, func) -> None:
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:7.3f} s per milione  ({N / elapsed:,.0f} id/s)")
+
+
+def main() -> None:
+    patients = [_fake_cf() for _ in range(N // 20)]
+    # Come in un caricamento reale: ogni paziente ricorre in più righe cliniche
+    column = [random.choice(patients) for _ in range(N)]
+
+    for pepper, label in (("", "SHA-256"), ("pepper-di-prova", "HMAC-SHA256")):
+        uncached = Pseudonymizer(pepper=pepper, cache_size=0)
+        cached = Pseudonymizer(pepper=pepper, cache_size=len(patients))
+        bench(f"{label} senza cache", lambda: [uncached.pseudonymize(v) for v in column])
+        bench(f"{label} batch (blocchi da 1000)",
+              lambda: [uncached.pseudonymize_many(column[i:i + 1000]) for i in range(0, N, 1000)])
+        bench(f"{label} con LRU", lambda: [cached.pseudonymize(v) for v in column])
+        print(f"  {cached.cache_info()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+"""
+Confronto di memoria e velocità di PatientIndex con un set di stringhe: python -m scripts.bench_patient_index
+"""
+import hashlib
+import random
+import sys
+import time
+
+from app.services.patient_index import PatientIndex
+
+N = 1_000_000
+PROBES = 50_000
+
+
+def main() -> None:
+    identifiers = sorted(hashlib.sha256(str(i).encode()).hexdigest() for i in range(N))
+    digests = b"".join(bytes.fromhex(i) for i in identifiers)
+    index = PatientIndex(digests, set())
+    as_set = set(identifiers)
+    probes = (random.sample(identifiers, PROBES)
+              + [hashlib.sha256(f"x{i}".encode()).hexdigest() for i in range(PROBES)])
+
+    started = time.perf_counter()
+    hits = sum(index._contains(p) for p in probes)
+    index_rate = len(probes) / (time.perf_counter() - started)
+    started = time.perf_counter()
+    set_hits = sum(p in as_set for p in probes)
+    set_rate = len(probes) / (time.perf_counter() - started)
+    assert hits == set_hits == PROBES
+
+    set_bytes = sys.getsizeof(as_set) + sum(sys.getsizeof(i) for i in as_set)
+    print(f"indice: {index.memory_bytes() / 1024 / 1024:.1f} MiB, {index_rate:,.0f} lookup/s")
+    print(f"set:    {set_bytes / 1024 / 1024:.1f} MiB, {set_rate:,.0f} lookup/s")
+
+
+if __name__ == "__main__":
+    main()
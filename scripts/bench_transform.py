@@ -0,0 +1,38 @@
+"""
+Benchmark delle trasformazioni CSV, modelli fhir.resources contro versioni veloci: python -m scripts.bench_transform
+"""
+import itertools
+import logging
+import time
+
+from app.utils.transform import FAST_TRANSFORM_PAIRS
+
+N = 20_000
+
+ROWS = {
+    "Patient": {"codice_fiscale": "RSSMRA80A01H501U", "data_nascita": "1980-01-01", "gender": "male",
+                "citta": "Roma", "provincia": "RM", "cap": "00100"},
+    "Observation": {"codice_fiscale": "RSSMRA80A01H501U", "codice_lonic": "2345-7", "descrizione_test": "Glucosio",
+                    "valore": "5.25", "unita": "mg/dL", "data_osservazione": "2024-01-02T10:00:00Z",
+                    "observation_id": "obs-1"},
+    "Condition": {"codice_fiscale": "RSSMRA80A01H501U", "codice_icd": "J10", "descrizione": "Influenza",
+                  "data_diagnosi": "2024-01-02"},
+}
+
+
+def main() -> None:
+    logging.getLogger("app.utils.transform").disabled = True
+    for resource_type, (model, fast) in FAST_TRANSFORM_PAIRS.items():
+        rows = list(itertools.repeat(ROWS[resource_type], N))
+        timings = {}
+        for label, func in (("model", model), ("fast", fast)):
+            start = time.perf_counter()
+            for r in rows:
+                func(r)
+            timings[label] = time.perf_counter() - start
+        print(f"{resource_type:<12} model {N / timings['model']:>9,.0f} righe/s   "
+              f"fast {N / timings['fast']:>9,.0f} righe/s   x{timings['model'] / timings['fast']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
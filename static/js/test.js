@@ -263,10 +263,35 @@ function flattenObject(obj, prefix = "", res = {}) {
   return res;
 }
 
+// Paginazione del Bundle searchset: pages contiene gli URL delle pagine già visitate, next il link successivo
+const testPager = { pages: [], current: -1, next: null };
+
 function loadTestData(resourceType) {
-  fetch(`/api/${resourceType}`)
+  testPager.pages = [`/api/${resourceType}`];
+  testPager.current = 0;
+  fetchTestPage();
+}
+
+function loadTestPage(step) {
+  if (step > 0 && testPager.current === testPager.pages.length - 1) {
+    if (!testPager.next) return;
+    testPager.pages.push(testPager.next);
+  }
+  const target = testPager.current + step;
+  if (target < 0 || target >= testPager.pages.length) return;
+  testPager.current = target;
+  fetchTestPage();
+}
+
+function fetchTestPage() {
+  fetch(testPager.pages[testPager.current])
     .then(res => res.json())
-    .then(data => renderTable(data))
+    .then(data => {
+      const next = (data.link || []).find(l => l.relation === "next");
+      testPager.next = next ? next.url : null;
+      renderTable(data.entry ? data.entry.map(e => e.resource) : data);
+      updatePager();
+    })
     .catch(err => {
       console.error("Errore caricamento dati:", err);
       document.getElementById("data-table-body").innerHTML =
@@ -274,6 +299,16 @@ function loadTestData(resourceType) {
     });
 }
 
+function updatePager() {
+  const last = testPager.current === testPager.pages.length - 1;
+  document.getElementById("data-prev").disabled = testPager.current === 0;
+  document.getElementById("data-next").disabled = last && !testPager.next;
+  document.getElementById("data-page").textContent = `Pagina ${testPager.current + 1}`;
+  document.getElementById("data-pager").classList.toggle(
+    "d-none", testPager.current === 0 && !testPager.next
+  );
+}
+
 
 
 const busyLayer = document.getElementById('busyLayer');
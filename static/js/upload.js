@@ -1,4 +1,55 @@
 document.addEventListener("DOMContentLoaded", function () {
+  // Upload asincrono: il server risponde 202 con l'URL del job, che viene interrogato fino al termine
+  const POLL_INTERVAL_MS = 1000;
+
+  function formatProgress(job) {
+    const parts = [`${job.rows_processed} righe`];
+    if (job.progress !== null) parts.push(`${Math.round(job.progress * 100)}%`);
+    if (job.rows_per_second) parts.push(`${Math.round(job.rows_per_second)} righe/s`);
+    if (job.eta_seconds !== null) parts.push(`ETA ${Math.ceil(job.eta_seconds)} s`);
+    return parts.join(" | ");
+  }
+
+  async function uploadAsync(endpoint, formData, label) {
+    const response = await fetch(endpoint, {
+      method: "POST",
+      body: formData,
+      headers: { "Prefer": "respond-async" },
+    });
+    const accepted = await response.json();
+    if (!response.ok) {
+      throw new Error(accepted.detail || "Errore durante l'upload");
+    }
+    // Server senza coda dei job: il report è già nella risposta
+    if (response.status !== 202) return accepted;
+
+    const statusUrl = response.headers.get("Content-Location") || accepted.status_url;
+    const toast = Toastify({
+      text: `${label}: in coda...`,
+      duration: -1,
+      gravity: "bottom",
+      position: "right",
+      style: { background: "#334155", color: "white" },
+    });
+    toast.showToast();
+    try {
+      while (true) {
+        await new Promise((resolve) => setTimeout(resolve, POLL_INTERVAL_MS));
+        const resp = await fetch(statusUrl);
+        const job = await resp.json();
+        if (!resp.ok) throw new Error(job.detail || "Stato del caricamento non disponibile");
+        if (job.status === "done") return job.report;
+        if (job.status === "failed") throw new Error(job.error || "Caricamento fallito");
+        if (toast.toastElement) {
+          toast.toastElement.firstChild.textContent =
+            job.status === "running" ? `${label}: ${formatProgress(job)}` : `${label}: in coda...`;
+        }
+      }
+    } finally {
+      toast.hideToast();
+    }
+  }
+
   function handleCsvUpload(formId, endpoint) {
     const form = document.getElementById(formId);
 
@@ -13,16 +64,7 @@ document.addEventListener("DOMContentLoaded", function () {
       formData.append("file", file);
 
       try {
-        const response = await fetch(endpoint, {
-          method: "POST",
-          body: formData,
-        });
-
-        const result = await response.json();
-
-        if (!response.ok) {
-          throw new Error(result.detail || "Errore durante l'upload");
-        }
+        const result = await uploadAsync(endpoint, formData, file.name);
 
         // Messaggio success
         if (result.inserted > 0 || result.skipped > 0) {
@@ -92,9 +134,7 @@ document.addEventListener("DOMContentLoaded", function () {
       formData.append("file", file);
 
       try {
-        const resp = await fetch(endpoint, { method: "POST", body: formData });
-        const res  = await resp.json();
-        if (!resp.ok) throw new Error(res.detail || "Errore JSON");
+        const res = await uploadAsync(endpoint, formData, file.name);
 
         Toastify({
           text: `JSON: Inseriti ${res.inserted}, Scartati ${res.skipped}`,
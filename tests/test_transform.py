@@ -0,0 +1,81 @@
+"""
+Equivalenza delle trasformazioni CSV veloci con quelle basate sui modelli fhir.resources:
+per ogni riga devono fallire entrambe o produrre lo stesso JSON (a meno dell'id casuale).
+"""
+import itertools
+import json
+import logging
+
+import pytest
+
+from app.utils.transform import FAST_TRANSFORM_PAIRS
+
+SAMPLES = {
+    "Patient": [
+        {"codice_fiscale": "RSSMRA80A01H501U", "data_nascita": birth, "gender": gender,
+         "citta": city, "provincia": "RM", "cap": cap}
+        for birth, gender, city, cap in itertools.product(
+            ["1980-01-01", "1980", "1980-02", "1980-02-30", "1980-2-3", ""],
+            ["male", "female", "unknown", "", " male "],
+            ["Roma", "", "  San  Cesareo "],
+            ["00100", ""],
+        )
+    ],
+    "Observation": [
+        {"codice_fiscale": "RSSMRA80A01H501U", "codice_lonic": code, "descrizione_test": "Glucosio",
+         "valore": value, "unita": unit, "data_osservazione": when, "observation_id": obs_id}
+        for code, value, unit, when, obs_id in itertools.product(
+            ["2345-7", "", "a b", "a  b"],
+            ["5", "5.25", "1e3", "1e20", "-0.0", "0.0000001", "nan", "abc", " 7 "],
+            ["mg/dL", ""],
+            ["2024-01-02T10:00:00", "2024-01-02T10:00:00Z", "2024-01-02T10:00:00.5", "2024-01-02",
+             "2024-13-45T10:00:00", ""],
+            ["obs-1", ""],
+        )
+    ],
+    "Condition": [
+        {"codice_fiscale": "RSSMRA80A01H501U", "codice_icd": icd, "descrizione": desc, "data_diagnosi": when}
+        for icd, desc, when in itertools.product(
+            ["J10", "", "J 10"],
+            ["Influenza", "", " Influenza stagionale "],
+            ["2024-01-02", "2024", "2024-01-02T10:00:00Z", "2024-01-02T10:00:00+01:00", "2024-02-30", ""],
+        )
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def quiet_transform_logger():
+    # Le righe non valide sono registrate come errori: nei test non interessano
+    logger = logging.getLogger("app.utils.transform")
+    previous, logger.disabled = logger.disabled, True
+    yield
+    logger.disabled = previous
+
+
+def _run(func, row: dict):
+    try:
+        data = func(row)
+    except Exception:
+        return None
+    data["id"] = data["id"][:3]
+    return json.dumps(data)
+
+
+@pytest.mark.parametrize("resource_type", sorted(SAMPLES))
+def test_fast_transform_matches_model(resource_type):
+    model, fast = FAST_TRANSFORM_PAIRS[resource_type]
+    mismatches = [
+        f"{row}: {expected!r} != {actual!r}"
+        for row in SAMPLES[resource_type]
+        for expected, actual in [(_run(model, row), _run(fast, row))]
+        if expected != actual
+    ]
+    assert mismatches == []
+
+
+@pytest.mark.parametrize("resource_type", sorted(SAMPLES))
+def test_samples_cover_valid_and_invalid_rows(resource_type):
+    _, fast = FAST_TRANSFORM_PAIRS[resource_type]
+    outcomes = {_run(fast, row) is None for row in SAMPLES[resource_type]}
+    assert outcomes == {True, False}